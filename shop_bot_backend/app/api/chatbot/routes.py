@@ -1,39 +1,99 @@
-from fastapi import APIRouter, HTTPException
-from fastapi.responses import StreamingResponse
-from pydantic import BaseModel
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse, ORJSONResponse
+from starlette.background import BackgroundTask
+from pydantic import BaseModel, Field
 
 import sys, os
 project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
 sys.path.insert(0, project_root)
 
-from core_ai.ai_service import get_answer, get_answer_stream
+from app.core_ai.ai_service import aget_answer, aget_answers_batch, get_answer_stream
+from app.core_ai.admission import AdmissionRejected
+from app.core_ai.thread_locks import thread_locks, ThreadLease
+from app.utils.metrics import Counter, Gauge, Histogram
+import anyio
+import asyncio
 import logging
-import json
+import orjson
 from typing import AsyncGenerator
 
-router = APIRouter()
+router = APIRouter(default_response_class=ORJSONResponse)
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+STREAM_HEARTBEAT_SECONDS = float(os.getenv("STREAM_HEARTBEAT_SECONDS", "15"))
+STREAM_DISCONNECT_POLL_SECONDS = float(os.getenv("STREAM_DISCONNECT_POLL_SECONDS", "0.5"))
+STREAM_CANCEL_TIMEOUT = float(os.getenv("STREAM_CANCEL_TIMEOUT", "5"))
+# After the first frame, chunks are merged until the window ends or the buffer is full
+STREAM_COALESCE_MS = float(os.getenv("STREAM_COALESCE_MS", "30"))
+STREAM_COALESCE_BYTES = int(os.getenv("STREAM_COALESCE_BYTES", "512"))
+STREAM_QUEUE_SIZE = 256
+CHAT_BATCH_MAX_ITEMS = int(os.getenv("CHAT_BATCH_MAX_ITEMS", "10000"))
+CHAT_BATCH_MAX_CONCURRENCY = int(os.getenv("CHAT_BATCH_MAX_CONCURRENCY", "32"))
+
+active_streams = Gauge(
+    "chat_streams_active",
+    "Streaming answers currently being produced"
+)
+stream_disconnects = Counter(
+    "chat_stream_disconnects_total",
+    "Streaming answers cancelled because the client went away"
+)
+stream_cancel_seconds = Histogram(
+    "chat_stream_cancel_seconds",
+    "Time from detecting a disconnect until the answer producer has stopped"
+)
+stream_frames = Histogram(
+    "chat_stream_frames",
+    "Data frames sent per streamed answer",
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+)
+
+_DONE = object()
+
 class ChatRequest(BaseModel):
     question: str
     thread_id: str
+    user_id: str | None = None
+
+    @property
+    def user_key(self) -> str:
+        """Key for per-user admission limits; the thread stands in for unknown users"""
+        return self.user_id or self.thread_id
 
 class ChatResponse(BaseModel):
     answer: str
+    prompt_tokens: int | None = None
+
+class ChatBatchRequest(BaseModel):
+    items: list[ChatRequest] = Field(..., min_length=1, max_length=CHAT_BATCH_MAX_ITEMS)
+    concurrency: int | None = Field(None, ge=1, le=CHAT_BATCH_MAX_CONCURRENCY)
+
+def too_many_requests(e: AdmissionRejected) -> ORJSONResponse:
+    return ORJSONResponse(
+        {"error": "Too many requests", "details": str(e), "retry_after": e.retry_after, "status": 429},
+        status_code=429,
+        headers={"Retry-After": str(e.retry_after)}
+    )
 
 @router.post("/chat")
 async def chat(request: ChatRequest):
     try:
         logger.info(f" question: {request.question} --- thread_id: {request.thread_id}")
-        result = get_answer(request.question, request.thread_id)
+        # Wait for the thread's previous turn; aget_answer takes an agent slot
+        # only if the answer is not cached or templated
+        async with thread_locks.hold(request.thread_id):
+            result = await aget_answer(request.question, request.thread_id, request.user_key)
         logger.info(f" result: {result}")
         
         if not isinstance(result, dict) or "output" not in result:
-            raise ValueError("Invalid response format from get_answer")
+            raise ValueError("Invalid response format from aget_answer")
             
-        return ChatResponse(answer=result["output"])
+        return ChatResponse(answer=result["output"], prompt_tokens=result.get("prompt_tokens"))
+    except AdmissionRejected as e:
+        logger.warning(f"Rejected chat turn of thread {request.thread_id}: {e}")
+        return too_many_requests(e)
     except Exception as e:
         logger.error(f"Error in chat endpoint: {str(e)}", exc_info=True)
         # Return a more user-friendly error message
@@ -43,18 +103,196 @@ async def chat(request: ChatRequest):
             "status": 500
         }
 
-async def event_generator(question: str, thread_id: str) -> AsyncGenerator[str, None]:
+def sse_event(data: dict, event: str | None = None) -> bytes:
+    """Format one Server-Sent Events frame"""
+    frame = b"data: " + orjson.dumps(data) + b"\n\n"
+    return b"event: " + event.encode() + b"\n" + frame if event else frame
+
+async def produce_answer(answer: AsyncGenerator[str, None], first: object, queue: asyncio.Queue):
+    """Hand the first item, then each further chunk, then _DONE or the error, to the queue"""
+    if not isinstance(first, str):
+        await queue.put(first)
+        return
     try:
-        async for chunk in get_answer_stream(question, thread_id):
+        if first:
+            await queue.put(first)
+        async for chunk in answer:
             if chunk:
-                yield f"{json.dumps({'content': chunk}, ensure_ascii=False)}\n"
+                await queue.put(chunk)
     except Exception as e:
         logger.error(f"Error in stream: {str(e)}", exc_info=True)
-        yield f"{json.dumps({'error': str(e)})}\n\n"
+        await queue.put(e)
+    else:
+        await queue.put(_DONE)
+
+async def _get(queue: asyncio.Queue, timeout: float):
+    """Next queue item, or None if none arrives within the timeout"""
+    try:
+        return queue.get_nowait()
+    except asyncio.QueueEmpty:
+        pass
+    if timeout <= 0:
+        return None
+    try:
+        return await asyncio.wait_for(queue.get(), timeout=timeout)
+    except asyncio.TimeoutError:
+        return None
+
+async def _coalesce(queue: asyncio.Queue, first: str) -> tuple[str, object]:
+    """
+    Merge chunks arriving within STREAM_COALESCE_MS of the first one, up to
+    STREAM_COALESCE_BYTES; return the text and the item that ended the merge
+    (_DONE, an error, or None)
+    """
+    loop = asyncio.get_running_loop()
+    parts, size = [first], len(first)
+    deadline = loop.time() + STREAM_COALESCE_MS / 1000
+    while size < STREAM_COALESCE_BYTES:
+        try:
+            item = queue.get_nowait()
+        except asyncio.QueueEmpty:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            # One sleep per frame instead of a timed wait per chunk
+            await asyncio.sleep(remaining)
+            continue
+        if not isinstance(item, str):
+            return "".join(parts), item
+        parts.append(item)
+        size += len(item)
+    return "".join(parts), None
+
+async def release_turn(lease: ThreadLease, answer: AsyncGenerator[str, None]):
+    """Close the answer, which gives back its agent slot, and let the thread's next turn run"""
+    try:
+        await answer.aclose()
+    except RuntimeError:
+        # Still running in a producer that did not stop in time; it gives
+        # back the slot itself when it ends
+        pass
+    await lease.release()
+
+async def event_generator(
+    request: Request,
+    answer: AsyncGenerator[str, None],
+    first: object,
+    usage: dict,
+    thread_id: str,
+    lease: ThreadLease,
+) -> AsyncGenerator[bytes, None]:
+    """
+    Stream the answer as SSE: a data frame per chunk, a comment frame as
+    heartbeat while the agent is busy, and a final done event carrying the
+    request's prompt_tokens (or an error event)
+
+    The agent runs in its own task so the client connection can be watched
+    while it works. When the client goes away the task is cancelled, which
+    stops the model call or tool call in flight; get_answer_stream decides
+    what is kept of the partial answer. The first chunk is sent as soon as it
+    arrives; later chunks are coalesced to cut per-frame overhead.
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue(maxsize=STREAM_QUEUE_SIZE)
+    producer = asyncio.create_task(produce_answer(answer, first, queue))
+    active_streams.inc()
+    last_sent = last_checked = loop.time()
+    frames = 0
+    try:
+        while True:
+            item = await _get(queue, STREAM_DISCONNECT_POLL_SECONDS)
+            now = loop.time()
+            if item is None or now - last_checked >= STREAM_DISCONNECT_POLL_SECONDS:
+                last_checked = now
+                if await request.is_disconnected():
+                    logger.info(f"Client disconnected from stream of thread {thread_id}")
+                    return
+            if item is None:
+                if now - last_sent >= STREAM_HEARTBEAT_SECONDS:
+                    last_sent = now
+                    yield b": heartbeat\n\n"
+                continue
+            if isinstance(item, str):
+                ending = None
+                if frames:
+                    item, ending = await _coalesce(queue, item)
+                frames += 1
+                yield sse_event({"content": item})
+                last_sent = loop.time()
+                if ending is None:
+                    continue
+                item = ending
+            if item is _DONE:
+                yield sse_event({"prompt_tokens": usage.get("prompt_tokens")}, event="done")
+                return
+            yield sse_event({"error": str(item)}, event="error")
+            return
+    finally:
+        # Starlette cancels a disconnected stream through an anyio cancel
+        # scope, which would abort every await below; shield them so the turn
+        # is only released once the producer has stopped and saved its answer
+        with anyio.CancelScope(shield=True):
+            active_streams.dec()
+            stream_frames.observe(frames)
+            if not producer.done():
+                stream_disconnects.inc()
+                producer.cancel()
+                with stream_cancel_seconds.time():
+                    await asyncio.wait([producer], timeout=STREAM_CANCEL_TIMEOUT)
+                if not producer.done():
+                    logger.error(f"Stream producer of thread {thread_id} did not stop within {STREAM_CANCEL_TIMEOUT}s")
+            await release_turn(lease, answer)
 
 @router.post("/chat/stream")
-async def chat_stream(request: ChatRequest):
+async def chat_stream(request: ChatRequest, http_request: Request):
+    # Wait for the thread and an agent slot before the response starts so a
+    # rejection can still be a 429
+    try:
+        lease = await thread_locks.acquire(request.thread_id)
+    except AdmissionRejected as e:
+        logger.warning(f"Rejected chat stream of thread {request.thread_id}: {e}")
+        return too_many_requests(e)
+    # The first chunk comes once the turn is admitted (empty) or, for a
+    # cached or templated answer, right away
+    usage: dict = {}
+    answer = get_answer_stream(request.question, request.thread_id, request.user_key, usage=usage)
+    try:
+        first = await anext(answer, _DONE)
+    except AdmissionRejected as e:
+        await lease.release()
+        logger.warning(f"Rejected chat stream of thread {request.thread_id}: {e}")
+        return too_many_requests(e)
+    except Exception as e:
+        logger.error(f"Error in stream: {str(e)}", exc_info=True)
+        first = e
+    except BaseException:
+        await lease.release()
+        raise
     return StreamingResponse(
-        event_generator(request.question, request.thread_id),
-        media_type="text/event-stream"
-    )
\ No newline at end of file
+        event_generator(http_request, answer, first, usage, request.thread_id, lease),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        # Frees the slot and the thread if the generator never started; otherwise
+        # the generator has already released them (release is idempotent)
+        background=BackgroundTask(release_turn, lease, answer)
+    )
+
+async def batch_generator(request: ChatBatchRequest) -> AsyncGenerator[bytes, None]:
+    items = [(item.question, item.thread_id, item.user_key) for item in request.items]
+    kwargs = {"concurrency": request.concurrency} if request.concurrency else {}
+    completed, failed = 0, 0
+    try:
+        async for result in aget_answers_batch(items, **kwargs):
+            completed += 1
+            failed += "error" in result
+            yield orjson.dumps(result) + b"\n"
+    finally:
+        logger.info(f"Batch of {len(items)} items: {completed} done, {failed} failed")
+
+@router.post("/chat/batch")
+async def chat_batch(request: ChatBatchRequest):
+    """
+    Answer many (question, thread_id) pairs; one NDJSON line per item, in
+    completion order, each carrying the item's index in the request
+    """
+    return StreamingResponse(batch_generator(request), media_type="application/x-ndjson")
@@ -0,0 +1,49 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+import sys, os
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, project_root)
+
+from app.core_ai.response_cache import get_response_cache_stats
+from app.db.chat_history_service import get_history_cache_stats
+from app.db.connection import get_db_pool_stats
+from app.db.product_service import get_catalog_cache_stats
+from app.utils.metrics import register_collector, render_prometheus
+
+router = APIRouter()
+
+# psycopg_pool reports these as current values; every other key is cumulative
+POOL_GAUGES = {"pool_min", "pool_max", "pool_size", "pool_available", "requests_waiting", "requests_avg_wait_ms"}
+
+def collect_pool_stats():
+    for pool, stats in get_db_pool_stats().items():
+        for key, value in stats.items():
+            if key in POOL_GAUGES:
+                yield f"db_pool_{key}", "gauge", f"Connection pool {key} (psycopg_pool get_stats)", {"pool": pool}, value
+            else:
+                yield f"db_pool_{key}_total", "counter", f"Connection pool {key} since start (psycopg_pool get_stats)", {"pool": pool}, value
+
+def collect_cache_stats():
+    catalog = get_catalog_cache_stats()
+    caches = {
+        "catalog_search": catalog["search"],
+        "catalog_product": catalog["product"],
+        "chat_history": get_history_cache_stats(),
+        "response": get_response_cache_stats(),
+    }
+    for cache, stats in caches.items():
+        labels = {"cache": cache}
+        yield "cache_size", "gauge", "Entries in an in-process cache", labels, stats["size"]
+        yield "cache_maxsize", "gauge", "Capacity of an in-process cache (0 when disabled)", labels, stats["maxsize"]
+        yield "cache_hits_total", "counter", "In-process cache hits", labels, stats["hits"]
+        yield "cache_misses_total", "counter", "In-process cache misses", labels, stats["misses"]
+        yield "cache_evictions_total", "counter", "In-process cache evictions", labels, stats["evictions"]
+    yield "catalog_version", "gauge", "Catalog changes seen by this process", {}, catalog["version"]
+
+register_collector(collect_pool_stats)
+register_collector(collect_cache_stats)
+
+@router.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
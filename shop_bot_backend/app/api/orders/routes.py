@@ -0,0 +1,86 @@
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+
+import sys, os
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, project_root)
+
+from app.db.order_service import alist_orders, aiter_orders
+import base64
+import logging
+import orjson
+from datetime import datetime
+from decimal import Decimal
+from typing import AsyncGenerator
+
+router = APIRouter()
+
+logger = logging.getLogger(__name__)
+
+ORDER_PAGE_SIZE = int(os.getenv("ORDER_PAGE_SIZE", "50"))
+ORDER_PAGE_MAX_SIZE = int(os.getenv("ORDER_PAGE_MAX_SIZE", "500"))
+
+class Order(BaseModel):
+    id: int
+    user_id: str
+    product_id: int
+    quantity: int
+    total_amount: Decimal
+    status: str
+    created_at: datetime
+    updated_at: datetime | None = None
+
+class OrderPage(BaseModel):
+    orders: list[Order]
+    # Pass back as ?cursor= for the next page; None on the last page
+    next_cursor: str | None = None
+
+def encode_cursor(order: dict) -> str:
+    """Opaque cursor pointing just after an order"""
+    raw = orjson.dumps([order["created_at"], order["id"]])
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, order_id = orjson.loads(raw)
+        return datetime.fromisoformat(created_at), int(order_id)
+    except (ValueError, TypeError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid cursor: {e}")
+
+def _json_default(value):
+    # Amounts keep their exact value, as in the paged endpoint
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError
+
+@router.get("/orders", response_model=OrderPage)
+async def list_orders(
+    user_id: str | None = None,
+    cursor: str | None = None,
+    limit: int = Query(ORDER_PAGE_SIZE, ge=1, le=ORDER_PAGE_MAX_SIZE),
+):
+    """
+    Orders newest first, one page at a time; follow next_cursor for the next page
+    """
+    after = decode_cursor(cursor) if cursor else None
+    orders = await alist_orders(user_id, after, limit)
+    next_cursor = encode_cursor(orders[-1]) if len(orders) == limit else None
+    return OrderPage(orders=orders, next_cursor=next_cursor)
+
+async def export_generator(user_id: str | None) -> AsyncGenerator[bytes, None]:
+    exported = 0
+    try:
+        async for order in aiter_orders(user_id):
+            exported += 1
+            yield orjson.dumps(order, default=_json_default) + b"\n"
+    finally:
+        logger.info(f"Exported {exported} orders" + (f" of user {user_id}" if user_id else ""))
+
+@router.get("/orders/export")
+async def export_orders(user_id: str | None = None):
+    """
+    All orders (or all orders of one user) newest first, one NDJSON line per order
+    """
+    return StreamingResponse(export_generator(user_id), media_type="application/x-ndjson")
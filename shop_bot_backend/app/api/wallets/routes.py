@@ -0,0 +1,55 @@
+from fastapi import APIRouter, HTTPException, Query
+from pydantic import BaseModel
+
+import sys, os
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, project_root)
+
+from app.db.wallet_service import aget_wallet, alist_ledger, WALLET_LEDGER_PAGE_SIZE
+from datetime import datetime
+from decimal import Decimal
+
+router = APIRouter()
+
+WALLET_LEDGER_PAGE_MAX_SIZE = int(os.getenv("WALLET_LEDGER_PAGE_MAX_SIZE", "500"))
+
+class Wallet(BaseModel):
+    user_id: str
+    balance: Decimal
+    created_at: datetime | None = None
+    updated_at: datetime | None = None
+
+class LedgerEntry(BaseModel):
+    id: int
+    amount: Decimal
+    reason: str
+    order_id: int | None = None
+    created_at: datetime
+
+class LedgerPage(BaseModel):
+    entries: list[LedgerEntry]
+    # Pass back as ?before= for the next page; None on the last page
+    next_before: int | None = None
+
+@router.get("/wallets/{user_id}", response_model=Wallet)
+async def get_wallet(user_id: str):
+    """
+    Current balance of a user's wallet; the payments are in /orders?user_id=
+    """
+    wallet = await aget_wallet(user_id)
+    if wallet is None:
+        raise HTTPException(status_code=404, detail=f"Wallet of user {user_id} not found")
+    return wallet
+
+@router.get("/wallets/{user_id}/ledger", response_model=LedgerPage)
+async def get_wallet_ledger(
+    user_id: str,
+    before: int | None = None,
+    limit: int = Query(WALLET_LEDGER_PAGE_SIZE, ge=1, le=WALLET_LEDGER_PAGE_MAX_SIZE),
+):
+    """
+    Debits and credits of a wallet newest first (recorded with WALLET_MODE=ledger)
+    """
+    entries = await alist_ledger(user_id, before, limit)
+    next_before = entries[-1]["id"] if len(entries) == limit else None
+    return LedgerPage(entries=entries, next_before=next_before)
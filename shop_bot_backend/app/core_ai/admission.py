@@ -0,0 +1,221 @@
+import sys, os
+import asyncio
+import math
+import time
+import logging
+from bisect import insort
+from contextlib import asynccontextmanager
+from itertools import count
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, project_root)
+
+from app.core_ai.response_cache import has_order_intent
+from app.utils.metrics import Counter, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+ADMISSION_MAX_CONCURRENT = int(os.getenv("ADMISSION_MAX_CONCURRENT", "16"))
+ADMISSION_MAX_PER_USER = int(os.getenv("ADMISSION_MAX_PER_USER", "2"))
+ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", "100"))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "30"))
+
+# Lower runs first
+PRIORITY_ORDER = 0
+PRIORITY_NORMAL = 1
+PRIORITY_BACKGROUND = 2
+PRIORITY_NAMES = {PRIORITY_ORDER: "order", PRIORITY_NORMAL: "normal", PRIORITY_BACKGROUND: "background"}
+
+admission_wait_seconds = Histogram(
+    "admission_wait_seconds",
+    "Time a chat turn waited for an agent slot, by priority",
+    ("priority",)
+)
+admission_active = Gauge(
+    "admission_active",
+    "Chat turns currently holding an agent slot"
+)
+admission_queue_depth = Gauge(
+    "admission_queue_depth",
+    "Chat turns waiting for an agent slot"
+)
+admission_rejected = Counter(
+    "admission_rejected_total",
+    "Chat turns turned away by admission control, by reason (queue_full, timeout)",
+    ("reason",)
+)
+
+class AdmissionRejected(Exception):
+    """
+    Raised when a turn cannot get an agent slot; retry_after is a hint in seconds
+    """
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(f"Too many requests ({reason}), retry after {retry_after}s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+class Ticket:
+    """
+    An agent slot held by one turn; release() is idempotent
+    """
+
+    def __init__(self, controller: "AdmissionController", user_key: str):
+        self._controller = controller
+        self.user_key = user_key
+        self.started = time.monotonic()
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self._controller._release(self)
+
+class AdmissionController:
+    """
+    Global and per-user concurrency limit in front of the agent.
+
+    A turn runs at once if a global slot is free and its user holds fewer than
+    max_per_user slots; otherwise it waits in a bounded queue ordered by
+    priority, then arrival. Waiters whose user is at its limit are skipped, so
+    one busy user cannot hold up the others. Background turns (batch jobs)
+    wait without counting against the queue bound or the timeout.
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int = ADMISSION_MAX_CONCURRENT,
+        max_per_user: int = ADMISSION_MAX_PER_USER,
+        max_queue: int = ADMISSION_QUEUE_SIZE,
+        queue_timeout: float = ADMISSION_QUEUE_TIMEOUT,
+    ):
+        self.max_concurrent = max_concurrent
+        self.max_per_user = max_per_user
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._active = 0
+        self._per_user: dict[str, int] = {}
+        # (priority, sequence, user_key, future), kept sorted
+        self._waiting: list[tuple[int, int, str, asyncio.Future]] = []
+        self._sequence = count()
+        # Moving average of slot hold time, for Retry-After
+        self._avg_hold = 1.0
+
+    def _can_run(self, user_key: str) -> bool:
+        return self._active < self.max_concurrent and self._per_user.get(user_key, 0) < self.max_per_user
+
+    def _grant(self, user_key: str) -> Ticket:
+        self._active += 1
+        self._per_user[user_key] = self._per_user.get(user_key, 0) + 1
+        admission_active.set(self._active)
+        return Ticket(self, user_key)
+
+    def _release(self, ticket: Ticket):
+        self._active -= 1
+        remaining = self._per_user[ticket.user_key] - 1
+        if remaining:
+            self._per_user[ticket.user_key] = remaining
+        else:
+            del self._per_user[ticket.user_key]
+        self._avg_hold = 0.9 * self._avg_hold + 0.1 * (time.monotonic() - ticket.started)
+        admission_active.set(self._active)
+        self._wake()
+
+    def _wake(self):
+        index = 0
+        while index < len(self._waiting) and self._active < self.max_concurrent:
+            _, _, user_key, future = self._waiting[index]
+            if self._can_run(user_key):
+                del self._waiting[index]
+                future.set_result(self._grant(user_key))
+            else:
+                index += 1
+        admission_queue_depth.set(len(self._waiting))
+
+    def _queued(self) -> int:
+        return sum(1 for priority, *_ in self._waiting if priority != PRIORITY_BACKGROUND)
+
+    def retry_after(self) -> int:
+        """
+        Estimated seconds until a slot frees up for a new turn
+        """
+        rounds = (len(self._waiting) + 1) / max(1, self.max_concurrent)
+        return max(1, math.ceil(rounds * self._avg_hold))
+
+    async def acquire(self, user_key: str, priority: int = PRIORITY_NORMAL) -> Ticket:
+        """
+        Wait for an agent slot
+
+        Args:
+            user_key (str): User the turn belongs to (user_id, or thread_id when unknown)
+            priority (int): PRIORITY_ORDER, PRIORITY_NORMAL or PRIORITY_BACKGROUND
+
+        Returns:
+            Ticket: The slot; release it when the turn is done
+
+        Raises:
+            AdmissionRejected: If the queue is full or the wait times out
+        """
+        start = time.perf_counter()
+        label = PRIORITY_NAMES[priority]
+        if self._can_run(user_key):
+            admission_wait_seconds.observe(0.0, priority=label)
+            return self._grant(user_key)
+        background = priority == PRIORITY_BACKGROUND
+        if not background and self._queued() >= self.max_queue:
+            admission_rejected.inc(reason="queue_full")
+            raise AdmissionRejected("queue_full", self.retry_after())
+
+        future = asyncio.get_running_loop().create_future()
+        waiter = (priority, next(self._sequence), user_key, future)
+        insort(self._waiting, waiter, key=lambda w: w[:2])
+        admission_queue_depth.set(len(self._waiting))
+        try:
+            if background:
+                ticket = await future
+            else:
+                ticket = await asyncio.wait_for(asyncio.shield(future), timeout=self.queue_timeout)
+        except BaseException as e:
+            if future.done() and not future.cancelled() and future.exception() is None:
+                # Granted while we were giving up: hand the slot on
+                future.result().release()
+            else:
+                future.cancel()
+                self._waiting.remove(waiter)
+                admission_queue_depth.set(len(self._waiting))
+            if isinstance(e, asyncio.TimeoutError):
+                admission_rejected.inc(reason="timeout")
+                raise AdmissionRejected("timeout", self.retry_after())
+            raise
+        admission_wait_seconds.observe(time.perf_counter() - start, priority=label)
+        return ticket
+
+    @asynccontextmanager
+    async def admit(self, user_key: str, priority: int = PRIORITY_NORMAL):
+        """
+        Hold an agent slot for the duration of the with block
+        """
+        ticket = await self.acquire(user_key, priority)
+        try:
+            yield ticket
+        finally:
+            ticket.release()
+
+    def stats(self) -> dict:
+        """
+        Get current slot usage and queue length
+        """
+        return {
+            "active": self._active,
+            "waiting": len(self._waiting),
+            "users": len(self._per_user),
+            "avg_hold_s": self._avg_hold,
+        }
+
+def turn_priority(question: str) -> int:
+    """
+    Turns that are part of a purchase or payment go ahead of browsing
+    """
+    return PRIORITY_ORDER if has_order_intent(question) else PRIORITY_NORMAL
+
+admission = AdmissionController()
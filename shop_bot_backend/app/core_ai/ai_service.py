@@ -2,37 +2,102 @@ import sys, os
 project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
 sys.path.insert(0, project_root)
 
-from typing import AsyncGenerator
+import asyncio
+import time
+import logging
+from collections import deque
+from functools import lru_cache
+from typing import AsyncGenerator, AsyncIterator, Callable
 from dotenv import load_dotenv
 from app.core_ai.tools import ProductSearchTool, CreateOrderTool, UpdateOrderStatusTool
-from app.core_ai.prompts import system_prompt
+from app.core_ai.prompts import system_prompt, history_summary_prompt
+from app.core_ai import response_cache, fast_path
+from app.core_ai.instrumentation import TurnInstrumentation
+from app.core_ai.admission import admission, turn_priority, PRIORITY_BACKGROUND
+from app.core_ai.thread_locks import thread_locks
+from app.core_ai.history_compaction import CompactedHistory, compact_history, acompact_history, count_prompt_tokens
+from app.core_ai.resilient_model import ResilientChatModel, LLM_CALL_TIMEOUT
+from langchain_core.language_models import BaseChatModel
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain.agents import create_tool_calling_agent, AgentExecutor
 from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain.callbacks.base import BaseCallbackHandler
 
-from app.db.chat_history_service import get_recent_chat_history, save_chat_history
+from app.db.chat_history_service import (
+    get_recent_chat_history, save_chat_history,
+    aget_recent_chat_history, asave_chat_history
+)
 
 load_dotenv(override=True)
 
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 MODEL_NAME = os.getenv("GOOGLE_MODEL_NAME", "gemini-pro")
+AGENT_VERBOSE = os.getenv("AGENT_VERBOSE", "false").lower() == "true"
+LLM_WARMUP = os.getenv("LLM_WARMUP", "false").lower() == "true"
+CHAT_BATCH_CONCURRENCY = int(os.getenv("CHAT_BATCH_CONCURRENCY", "8"))
 
-if not GOOGLE_API_KEY:
-    raise ValueError("GOOGLE_API_KEY not found in environment variables")
+logger = logging.getLogger(__name__)
+
+# Appended to a streamed answer that was cut off by a client disconnect
+INTERRUPTED_ANSWER_NOTE = "[Câu trả lời bị gián đoạn do khách hàng ngắt kết nối]"
 
 product_search_tool = ProductSearchTool()
 create_order_tool = CreateOrderTool()
 update_order_status_tool = UpdateOrderStatusTool()
 
-def get_llm_and_agent() -> AgentExecutor:
-    chat = ChatGoogleGenerativeAI(
-        model=MODEL_NAME,
+def create_gemini_model(model_name: str) -> ChatGoogleGenerativeAI:
+    """Create the Gemini chat model client"""
+    if not GOOGLE_API_KEY:
+        raise ValueError("GOOGLE_API_KEY not found in environment variables")
+    return ChatGoogleGenerativeAI(
+        model=model_name,
         google_api_key=GOOGLE_API_KEY,
         temperature=0,
+        # Retries are left to ResilientChatModel, which bounds them by a
+        # deadline and never repeats a call after a side-effecting tool ran
+        max_retries=1,
+        timeout=LLM_CALL_TIMEOUT,
         # convert_system_message_to_human=True,
         # streaming=True
     )
+
+_chat_model_factory: Callable[[str], BaseChatModel] = create_gemini_model
+
+def set_chat_model_factory(factory: Callable[[str], BaseChatModel]):
+    """
+    Replace the function that creates the chat model, e.g. with a scripted
+    fake model for offline benchmarks, and drop the already built model and agent
+
+    Args:
+        factory (Callable[[str], BaseChatModel]): Takes a model name, returns a chat model
+    """
+    global _chat_model_factory
+    _chat_model_factory = factory
+    get_chat_model.cache_clear()
+    get_llm_and_agent.cache_clear()
+
+@lru_cache(maxsize=None)
+def get_chat_model(model_name: str = MODEL_NAME) -> BaseChatModel:
+    """
+    Get the process-wide chat model client for a model name
+
+    The client (and its HTTP connection pool to the model API) is created on
+    first use and reused by every request afterwards. It is wrapped in a
+    ResilientChatModel, which adds the call deadline, retries and hedging.
+
+    Raises:
+        ValueError: If GOOGLE_API_KEY is not set and no other model factory is installed
+    """
+    return ResilientChatModel(model=_chat_model_factory(model_name), model_name=model_name)
+
+@lru_cache(maxsize=None)
+def get_llm_and_agent(model_name: str = MODEL_NAME) -> AgentExecutor:
+    """
+    Get the process-wide agent executor for a model name
+
+    The prompt, tool-calling agent and executor hold no per-request state,
+    so they are built once and shared across requests.
+    """
+    chat = get_chat_model(model_name)
     
     tools = [
         product_search_tool,
@@ -56,12 +121,26 @@ def get_llm_and_agent() -> AgentExecutor:
     agent_executor = AgentExecutor(
         agent=agent,
         tools=tools,
-        verbose=True,
+        verbose=AGENT_VERBOSE,
         return_intermediate_steps=True
     )
 
     return agent_executor
 
+async def warm_up_agent(model_name: str = MODEL_NAME):
+    """
+    Build the agent at startup and, if LLM_WARMUP is enabled, send a dummy
+    request so the first user does not pay for the cold connection to the model API
+    """
+    get_llm_and_agent(model_name)
+    if not LLM_WARMUP:
+        return
+    try:
+        await get_chat_model(model_name).ainvoke("ping")
+        logger.info(f"Warmed up model {model_name}")
+    except Exception as e:
+        logger.warning(f"Model warm-up failed: {e}")
+
 def format_chat_history(history: list) -> list:
     """Format chat history into a list of message tuples"""
     formatted_history = []
@@ -72,6 +151,36 @@ def format_chat_history(history: list) -> list:
         ])
     return formatted_history
 
+def build_agent_input(question: str, compacted: CompactedHistory) -> dict:
+    """Build the agent input from the question and the compacted chat history"""
+    return {
+        "input": question,
+        "chat_history": format_chat_history(compacted.turns),
+        "history_summary": history_summary_prompt.format(summary=compacted.summary) if compacted.summary else "",
+    }
+
+def tools_used(result: dict) -> list[str]:
+    """Names of the tools the agent called while producing a result"""
+    return [action.tool for action, _ in result.get("intermediate_steps", [])]
+
+async def save_interrupted_answer(thread_id: str, question: str, partial_answer: str, called_tools: list[str]):
+    """
+    Persist what is left of a streamed turn after the client disconnected
+
+    The partial answer is kept, marked as interrupted, so the next turn sees
+    what the customer was shown. A turn with no text is dropped unless a
+    side-effecting tool already ran (an order may exist), in which case the
+    note alone is kept so the agent can follow up on it. Interrupted answers
+    never enter the response cache.
+    """
+    if not partial_answer and not response_cache.SIDE_EFFECT_TOOLS.intersection(called_tools):
+        return
+    answer = f"{partial_answer}\n\n{INTERRUPTED_ANSWER_NOTE}" if partial_answer else INTERRUPTED_ANSWER_NOTE
+    try:
+        await asave_chat_history(thread_id, question, answer)
+    except Exception as e:
+        logger.error(f"Error saving interrupted answer of thread {thread_id}: {e}")
+
 def get_answer(question: str, thread_id: str) -> dict:
     """
     Get answer for a question
@@ -81,61 +190,248 @@ def get_answer(question: str, thread_id: str) -> dict:
         thread_id (str): ID of the conversation
         
     Returns:
-        dict: Answer from AI
+        dict: Answer from AI, with the estimated "prompt_tokens" of the request
     """
     agent = get_llm_and_agent()
+    turn = TurnInstrumentation(thread_id)
     
-    history = get_recent_chat_history(thread_id)
-    chat_history = format_chat_history(history)
+    with turn.stage("history_load"):
+        history = get_recent_chat_history(thread_id)
+    cache_key = response_cache.lookup_key(question, history)
+    cached = response_cache.get_cached_answer(cache_key)
+    if cached is not None:
+        with turn.stage("persist"):
+            save_chat_history(thread_id, question, cached)
+        turn.finish("cache")
+        return {"input": question, "output": cached, "cached": True, "prompt_tokens": 0}
     
-    result = agent.invoke({
-        "input": question,
-        "chat_history": chat_history
-    })
+    templated = fast_path.answer(question)
+    if templated is not None:
+        with turn.stage("persist"):
+            save_chat_history(thread_id, question, templated)
+        turn.finish("fast_path")
+        return {"input": question, "output": templated, "fast_path": True, "prompt_tokens": 0}
+    
+    with turn.stage("compaction"):
+        compacted = compact_history(thread_id, history, get_chat_model())
+    
+    with turn.stage("agent"):
+        result = agent.invoke(build_agent_input(question, compacted), config={"callbacks": [turn]})
     
     if isinstance(result, dict) and "output" in result:
-        save_chat_history(thread_id, question, result["output"])
+        with turn.stage("persist"):
+            save_chat_history(thread_id, question, result["output"])
+        result["prompt_tokens"] = count_prompt_tokens(compacted, question)
+        response_cache.cache_answer(cache_key, result["output"], tools_used(result))
+    turn.finish("agent")
     
     return result
 
-async def get_answer_stream(question: str, thread_id: str) -> AsyncGenerator[str, None]:
+async def aget_answer(question: str, thread_id: str, user_key: str | None = None, priority: int | None = None) -> dict:
+    """
+    Get answer for a question without blocking the event loop
+
+    Cached and templated answers are returned at once; a turn that needs the
+    agent first waits for an agent slot from admission control.
+    
+    Args:
+        question (str): Question from user
+        thread_id (str): ID of the conversation
+        user_key (str | None): User for the per-user admission limit, the thread if None
+        priority (int | None): Admission priority, turn_priority(question) if None
+        
+    Returns:
+        dict: Answer from AI, with the estimated "prompt_tokens" of the request
+
+    Raises:
+        AdmissionRejected: If no agent slot frees up in time
+    """
+    agent = get_llm_and_agent()
+    turn = TurnInstrumentation(thread_id)
+    
+    with turn.stage("history_load"):
+        history = await aget_recent_chat_history(thread_id)
+    cache_key = response_cache.lookup_key(question, history)
+    cached = response_cache.get_cached_answer(cache_key)
+    if cached is not None:
+        with turn.stage("persist"):
+            await asave_chat_history(thread_id, question, cached)
+        turn.finish("cache")
+        return {"input": question, "output": cached, "cached": True, "prompt_tokens": 0}
+    
+    templated = await fast_path.aanswer(question)
+    if templated is not None:
+        with turn.stage("persist"):
+            await asave_chat_history(thread_id, question, templated)
+        turn.finish("fast_path")
+        return {"input": question, "output": templated, "fast_path": True, "prompt_tokens": 0}
+    
+    async with admission.admit(user_key or thread_id, turn_priority(question) if priority is None else priority):
+        with turn.stage("compaction"):
+            compacted = await acompact_history(thread_id, history, get_chat_model())
+        
+        with turn.stage("agent"):
+            result = await agent.ainvoke(build_agent_input(question, compacted), config={"callbacks": [turn]})
+    
+    if isinstance(result, dict) and "output" in result:
+        with turn.stage("persist"):
+            await asave_chat_history(thread_id, question, result["output"])
+        result["prompt_tokens"] = count_prompt_tokens(compacted, question)
+        response_cache.cache_answer(cache_key, result["output"], tools_used(result))
+    turn.finish("agent")
+    
+    return result
+
+async def get_answer_stream(
+    question: str,
+    thread_id: str,
+    user_key: str | None = None,
+    priority: int | None = None,
+    usage: dict | None = None,
+) -> AsyncGenerator[str, None]:
     """
     Get answer for a question in stream format
+
+    Cached and templated answers are streamed at once; a turn that needs the
+    agent first waits for an agent slot from admission control and yields an
+    empty chunk once it has one, so a caller can tell a rejected turn from a
+    slow answer before it starts responding.
     
     Args:
         question (str): Question from user
         thread_id (str): ID of the conversation
+        user_key (str | None): User for the per-user admission limit, the thread if None
+        priority (int | None): Admission priority, turn_priority(question) if None
+        usage (dict | None): Filled with the estimated "prompt_tokens" of the
+                             request, 0 for cached and templated answers
         
     Returns:
         AsyncGenerator[str, None]: Generator that yields each part of the answer
+
+    Raises:
+        AdmissionRejected: If no agent slot frees up in time
     """
     agent = get_llm_and_agent()
+    turn = TurnInstrumentation(thread_id)
+    usage = {} if usage is None else usage
+    usage["prompt_tokens"] = 0
     
-    history = get_recent_chat_history(thread_id)
-    chat_history = format_chat_history(history)
-    
-    final_answer = ""
-    
-    async for event in agent.astream_events(
-        {
-            "input": question,
-            "chat_history": chat_history,
-        },
-        version="v2"
-    ):       
-        kind = event["event"]
-        if kind == "on_chat_model_stream":
-            content = event['data']['chunk'].content
-            if content:
-                final_answer += content
-                yield content
+    with turn.stage("history_load"):
+        history = await aget_recent_chat_history(thread_id)
+    cache_key = response_cache.lookup_key(question, history)
+    cached = response_cache.get_cached_answer(cache_key)
+    if cached is not None:
+        for chunk in response_cache.iter_chunks(cached):
+            yield chunk
+        with turn.stage("persist"):
+            await asave_chat_history(thread_id, question, cached)
+        turn.finish("cache")
+        return
     
+    templated = await fast_path.aanswer(question)
+    if templated is not None:
+        for chunk in response_cache.iter_chunks(templated):
+            yield chunk
+        with turn.stage("persist"):
+            await asave_chat_history(thread_id, question, templated)
+        turn.finish("fast_path")
+        return
+    
+    async with admission.admit(user_key or thread_id, turn_priority(question) if priority is None else priority):
+        yield ""
+        with turn.stage("compaction"):
+            compacted = await acompact_history(thread_id, history, get_chat_model())
+        usage["prompt_tokens"] = count_prompt_tokens(compacted, question)
+    
+        answer_parts = []
+        called_tools = []
+    
+        # Includes the time the client takes to consume each chunk
+        try:
+            with turn.stage("agent"):
+                async for event in agent.astream_events(
+                    build_agent_input(question, compacted),
+                    config={"callbacks": [turn]},
+                    version="v2"
+                ):       
+                    kind = event["event"]
+                    if kind == "on_chat_model_stream":
+                        content = event['data']['chunk'].content
+                        if content:
+                            answer_parts.append(content)
+                            yield content
+                    elif kind == "on_tool_start":
+                        called_tools.append(event["name"])
+        except (asyncio.CancelledError, GeneratorExit):
+            # Client went away: the agent run and any tool call in flight are cancelled with us
+            await asyncio.shield(save_interrupted_answer(thread_id, question, "".join(answer_parts), called_tools))
+            turn.finish("cancelled")
+            raise
+    
+    final_answer = "".join(answer_parts)
     if final_answer:
-        save_chat_history(thread_id, question, final_answer)
+        with turn.stage("persist"):
+            await asave_chat_history(thread_id, question, final_answer)
+        response_cache.cache_answer(cache_key, final_answer, called_tools)
+    turn.finish("agent")
+
+async def aget_answers_batch(items: list[tuple[str, str, str]], concurrency: int = CHAT_BATCH_CONCURRENCY) -> AsyncIterator[dict]:
+    """
+    Answer many questions with bounded concurrency, yielding results as they complete
+
+    Each worker takes a whole thread and answers its turns in input order, so
+    a thread's history is built as in a live conversation; up to concurrency
+    threads are processed at once, each turn taking a background-priority
+    slot from admission control, within its user's limit, so live traffic goes
+    first. A failing item is reported with its error
+    and does not stop the batch. Closing the iterator early cancels the
+    remaining work.
+
+    Args:
+        items (list[tuple[str, str, str]]): (question, thread_id, user_key) triples
+        concurrency (int): Maximum number of threads processed at once
+
+    Returns:
+        AsyncIterator[dict]: For each item, its "index" in items, "thread_id" and
+                             "elapsed_ms", plus "answer" and "prompt_tokens" or "error"
+    """
+    threads: dict[str, list[int]] = {}
+    for index, (_, thread_id, _) in enumerate(items):
+        threads.setdefault(thread_id, []).append(index)
+    pending = deque(threads.values())
+    results: asyncio.Queue = asyncio.Queue()
+
+    async def answer_item(index: int) -> dict:
+        question, thread_id, user_key = items[index]
+        start = time.perf_counter()
+        result = {"index": index, "thread_id": thread_id}
+        try:
+            # Live turns of the same thread may be running; wait for them without a deadline
+            async with thread_locks.hold(thread_id, timeout=None):
+                answer = await aget_answer(question, thread_id, user_key, PRIORITY_BACKGROUND)
+            result["answer"] = answer["output"]
+            result["prompt_tokens"] = answer.get("prompt_tokens")
+        except Exception as e:
+            logger.error(f"Error answering batch item {index} of thread {thread_id}: {e}")
+            result["error"] = str(e)
+        result["elapsed_ms"] = (time.perf_counter() - start) * 1000
+        return result
+
+    async def worker():
+        while pending:
+            for index in pending.popleft():
+                await results.put(await answer_item(index))
+
+    workers = [asyncio.create_task(worker()) for _ in range(max(1, min(concurrency, len(threads))))]
+    try:
+        for _ in range(len(items)):
+            yield await results.get()
+    finally:
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
 
 if __name__ == "__main__":
-    import asyncio
-    
     async def test():
         async for event in get_answer_stream("tôi muốn mua 1 cái Xiaomi 14 Pro", "3"):
             print(event)
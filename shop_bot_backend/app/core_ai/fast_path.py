@@ -0,0 +1,144 @@
+import sys, os
+import re
+import json
+from decimal import Decimal
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, project_root)
+
+from app.core_ai.response_cache import has_order_intent
+from app.db.product_service import search_products, asearch_products
+from app.utils.metrics import Counter
+from app.utils.text import normalize_text
+
+FAST_PATH_ENABLED = os.getenv("FAST_PATH_ENABLED", "false").lower() == "true"
+# word_similarity of the best match, and its lead over the runner-up
+FAST_PATH_MIN_SCORE = float(os.getenv("FAST_PATH_MIN_SCORE", "0.8"))
+FAST_PATH_MIN_MARGIN = float(os.getenv("FAST_PATH_MIN_MARGIN", "0.1"))
+
+# All patterns are matched against normalized (lowercased, diacritic-free) questions
+INTENTS = {
+    "price": re.compile(r"\b(gia|bao nhieu tien|may tien|bao tien)\b"),
+    "stock": re.compile(r"\b(con hang|het hang|ton kho|co hang|con khong|con bao nhieu)\b"),
+    "spec": re.compile(r"\b(thong so|cau hinh|specs?|chip|ram|pin|man hinh|camera|bo nho)\b"),
+}
+# Comparisons and recommendations need the agent even when an intent matches
+NEEDS_AGENT = re.compile(r"\b(so sanh|voi|hay la|khac nhau|nen|tot hon|re hon|tu van|goi y)\b")
+FILLER = re.compile(
+    r"\b(cho (toi|minh|em|anh|chi) hoi|shop oi|ban oi|oi|xin hoi|hoi|vay|nhi|a|ak|ah|nhe|the nao|"
+    r"la|cua|dien thoai|san pham|may|co|khong|ko|k|bao nhieu|tien|hien|hien tai|bay gio|con|"
+    r"gia|hang|het|ton kho|thong so|cau hinh|specs?|ky thuat|chip|ram|pin|man hinh|camera|bo nho|the|sao|nhu)\b"
+)
+PUNCTUATION = re.compile(r"[?!.,;:]+")
+
+fast_path_requests = Counter(
+    "fast_path_requests_total",
+    "Questions seen by the fast path, by result (answered, no_intent, needs_agent, unresolved, ambiguous)",
+    ("result",)
+)
+
+def format_vnd(amount: Decimal | int | float) -> str:
+    """
+    Format an amount as VND, e.g. 31990000 -> "31.990.000 VND"
+    """
+    return f"{int(amount):,}".replace(",", ".") + " VND"
+
+def route(question: str) -> tuple[list[str], str] | None:
+    """
+    Recognize a price, stock or spec question about a single product
+
+    Args:
+        question (str): Question from user
+
+    Returns:
+        tuple[list[str], str] | None: Matched intents and the product query,
+                                      None if the question is for the agent
+    """
+    text = PUNCTUATION.sub(" ", normalize_text(question))
+    intents = [intent for intent, pattern in INTENTS.items() if pattern.search(text)]
+    if not intents:
+        fast_path_requests.inc(result="no_intent")
+        return None
+    if NEEDS_AGENT.search(text) or has_order_intent(text):
+        fast_path_requests.inc(result="needs_agent")
+        return None
+    query = " ".join(FILLER.sub(" ", text).split())
+    if not query:
+        fast_path_requests.inc(result="unresolved")
+        return None
+    return intents, query
+
+def _resolve(candidates: list[dict]) -> dict | None:
+    if not candidates or candidates[0]["score"] < FAST_PATH_MIN_SCORE:
+        fast_path_requests.inc(result="unresolved")
+        return None
+    if len(candidates) > 1 and candidates[0]["score"] - candidates[1]["score"] < FAST_PATH_MIN_MARGIN:
+        fast_path_requests.inc(result="ambiguous")
+        return None
+    return candidates[0]
+
+def _specifications(product: dict) -> dict:
+    specifications = product.get("specifications") or {}
+    if isinstance(specifications, str):
+        specifications = json.loads(specifications)
+    return specifications
+
+def render_answer(intents: list[str], product: dict) -> str | None:
+    """
+    Answer from a template with the product's current data
+
+    Returns:
+        str | None: Answer in Vietnamese, None if the product lacks the asked data
+    """
+    name = product["name"]
+    lines = []
+    if "price" in intents:
+        lines.append(f"{name} hiện có giá {format_vnd(product['price'])}.")
+    if "stock" in intents:
+        if product["stock"] > 0:
+            lines.append(f"{name} hiện còn {product['stock']} sản phẩm trong kho.")
+        else:
+            lines.append(f"{name} hiện đã hết hàng.")
+    if "spec" in intents:
+        specifications = _specifications(product)
+        if not specifications:
+            fast_path_requests.inc(result="unresolved")
+            return None
+        lines.append(f"Thông số của {name}:")
+        lines.extend(f"- {key}: {value}" for key, value in specifications.items())
+    if product["stock"] > 0:
+        lines.append("Bạn có muốn đặt mua không? Nếu có, hãy cho mình biết số lượng nhé.")
+    fast_path_requests.inc(result="answered")
+    return "\n".join(lines)
+
+def answer(question: str) -> str | None:
+    """
+    Answer a simple catalog question without the LLM
+
+    Args:
+        question (str): Question from user
+
+    Returns:
+        str | None: Templated answer, None to fall back to the agent
+    """
+    if not FAST_PATH_ENABLED:
+        return None
+    routed = route(question)
+    if routed is None:
+        return None
+    intents, query = routed
+    product = _resolve(search_products(query, limit=2))
+    return render_answer(intents, product) if product else None
+
+async def aanswer(question: str) -> str | None:
+    """
+    Async version of answer
+    """
+    if not FAST_PATH_ENABLED:
+        return None
+    routed = route(question)
+    if routed is None:
+        return None
+    intents, query = routed
+    product = _resolve(await asearch_products(query, limit=2))
+    return render_answer(intents, product) if product else None
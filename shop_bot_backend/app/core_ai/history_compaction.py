@@ -0,0 +1,169 @@
+import sys, os
+import math
+import logging
+from dataclasses import dataclass, field
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, project_root)
+
+from langchain_core.language_models import BaseChatModel
+
+from app.db.chat_history_service import (
+    get_thread_summary, save_thread_summary,
+    aget_thread_summary, asave_thread_summary
+)
+from app.core_ai.prompts import system_prompt
+from app.utils.metrics import Histogram
+
+logger = logging.getLogger(__name__)
+
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "2000"))
+HISTORY_SUMMARY_MIN_TURNS = int(os.getenv("HISTORY_SUMMARY_MIN_TURNS", "2"))
+# Rough chars-per-token ratio for Vietnamese text; avoids a count_tokens API call per turn
+HISTORY_CHARS_PER_TOKEN = float(os.getenv("HISTORY_CHARS_PER_TOKEN", "3"))
+
+SUMMARY_PROMPT = """Tóm tắt ngắn gọn cuộc trò chuyện giữa khách hàng và trợ lý bán hàng dưới đây.
+Giữ lại các thông tin cần cho các lượt sau: sản phẩm khách quan tâm, giá, số lượng,
+mã đơn hàng, trạng thái đơn hàng và thanh toán, yêu cầu còn dang dở.
+Trả lời bằng tiếng Việt, tối đa 150 từ.
+
+Tóm tắt trước đó:
+{previous_summary}
+
+Các lượt trò chuyện mới:
+{turns}
+"""
+
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000)
+
+history_tokens = Histogram(
+    "chat_history_tokens",
+    "Estimated tokens of chat history sent to the model, before and after compaction",
+    ("stage",),
+    buckets=TOKEN_BUCKETS
+)
+prompt_tokens = Histogram(
+    "chat_prompt_tokens",
+    "Estimated prompt tokens per request (system prompt, history and question)",
+    buckets=TOKEN_BUCKETS
+)
+
+@dataclass
+class CompactedHistory:
+    """
+    Chat history that fits the token budget.
+
+    turns are the newest messages kept verbatim (newest first, like
+    get_recent_chat_history); summary covers the older ones.
+    """
+    turns: list[dict] = field(default_factory=list)
+    summary: str = ""
+    tokens_before: int = 0
+    tokens: int = 0
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimate the number of model tokens in a text
+    """
+    return math.ceil(len(text) / HISTORY_CHARS_PER_TOKEN) if text else 0
+
+def _turn_tokens(message: dict) -> int:
+    return estimate_tokens(message["question"]) + estimate_tokens(message["answer"])
+
+def _split(history: list[dict], summary: dict | None, budget: int) -> tuple[list[dict], list[dict]]:
+    """
+    Keep the newest turns that fit the budget; return them and the older
+    turns that are not yet covered by the summary (oldest first)
+    """
+    kept, used = [], estimate_tokens(summary["summary"]) if summary else 0
+    for index, message in enumerate(history):
+        if summary and message["created_at"] <= summary["summarized_until"]:
+            overflow = []
+            break
+        cost = _turn_tokens(message)
+        if used + cost > budget:
+            overflow = history[index:]
+            break
+        kept.append(message)
+        used += cost
+    else:
+        overflow = []
+    if summary:
+        overflow = [m for m in overflow if m["created_at"] > summary["summarized_until"]]
+    return kept, list(reversed(overflow))
+
+def _keep_unfolded(kept: list[dict], to_fold: list[dict]) -> list[dict]:
+    """Verbatim turns plus the older ones the summary does not cover yet, newest first"""
+    return kept + list(reversed(to_fold))
+
+def _summary_input(summary: dict | None, turns: list[dict]) -> str:
+    formatted = "\n".join(f"Khách: {m['question']}\nTrợ lý: {m['answer']}" for m in turns)
+    return SUMMARY_PROMPT.format(
+        previous_summary=summary["summary"] if summary else "(chưa có)",
+        turns=formatted
+    )
+
+def _result(history: list[dict], kept: list[dict], summary: dict | None) -> CompactedHistory:
+    compacted = CompactedHistory(
+        turns=kept,
+        summary=summary["summary"] if summary else "",
+        tokens_before=sum(_turn_tokens(m) for m in history),
+    )
+    compacted.tokens = estimate_tokens(compacted.summary) + sum(_turn_tokens(m) for m in kept)
+    history_tokens.observe(compacted.tokens_before, stage="raw")
+    history_tokens.observe(compacted.tokens, stage="compacted")
+    return compacted
+
+def count_prompt_tokens(compacted: CompactedHistory, question: str) -> int:
+    """
+    Estimate and record the prompt tokens of a request: system prompt,
+    compacted history and question (tool schemas excluded)
+    """
+    tokens = estimate_tokens(system_prompt) + compacted.tokens + estimate_tokens(question)
+    prompt_tokens.observe(tokens)
+    return tokens
+
+def compact_history(thread_id: str, history: list[dict], llm: BaseChatModel, budget: int = HISTORY_TOKEN_BUDGET) -> CompactedHistory:
+    """
+    Fit the chat history of a thread into a token budget
+
+    The newest turns are kept verbatim while they fit. Older turns are folded
+    into the thread's rolling summary once at least HISTORY_SUMMARY_MIN_TURNS
+    of them are not yet covered, so the summarizer runs every few turns rather
+    than on every turn; until then (or if summarizing fails) those few turns
+    stay verbatim, past the budget, so no turn is ever dropped from the prompt.
+
+    Args:
+        thread_id (str): ID of the conversation
+        history (list[dict]): Recent messages, newest first
+        llm (BaseChatModel): Model used to write the summary
+        budget (int): Token budget for summary plus verbatim turns
+
+    Returns:
+        CompactedHistory: Verbatim turns, summary and token counts
+    """
+    summary = get_thread_summary(thread_id)
+    kept, to_fold = _split(history, summary, budget)
+    if len(to_fold) >= HISTORY_SUMMARY_MIN_TURNS:
+        try:
+            text = llm.invoke(_summary_input(summary, to_fold)).content
+            summary = save_thread_summary(thread_id, text, to_fold[-1]["created_at"])
+            kept, to_fold = _split(history, summary, budget)
+        except Exception as e:
+            logger.warning(f"Error summarizing chat history of thread {thread_id}: {e}")
+    return _result(history, _keep_unfolded(kept, to_fold), summary)
+
+async def acompact_history(thread_id: str, history: list[dict], llm: BaseChatModel, budget: int = HISTORY_TOKEN_BUDGET) -> CompactedHistory:
+    """
+    Async version of compact_history
+    """
+    summary = await aget_thread_summary(thread_id)
+    kept, to_fold = _split(history, summary, budget)
+    if len(to_fold) >= HISTORY_SUMMARY_MIN_TURNS:
+        try:
+            text = (await llm.ainvoke(_summary_input(summary, to_fold))).content
+            summary = await asave_thread_summary(thread_id, text, to_fold[-1]["created_at"])
+            kept, to_fold = _split(history, summary, budget)
+        except Exception as e:
+            logger.warning(f"Error summarizing chat history of thread {thread_id}: {e}")
+    return _result(history, _keep_unfolded(kept, to_fold), summary)
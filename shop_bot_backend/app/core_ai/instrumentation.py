@@ -0,0 +1,149 @@
+import sys, os
+import time
+import logging
+from contextlib import contextmanager
+from typing import Any
+from uuid import UUID
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, project_root)
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+
+from app.utils.metrics import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+SLOW_TURN_SECONDS = float(os.getenv("SLOW_TURN_SECONDS", "10"))
+
+answer_seconds = Histogram(
+    "chat_answer_seconds",
+    "Time to answer a question, by path (cache, fast_path, agent, cancelled)",
+    ("path",)
+)
+stage_seconds = Histogram(
+    "chat_stage_seconds",
+    "Time spent in each stage of a chat turn (history_load, compaction, agent, persist)",
+    ("stage",)
+)
+llm_call_seconds = Histogram(
+    "chat_llm_call_seconds",
+    "Latency of one chat model call",
+    ("model", "status")
+)
+llm_tokens = Counter(
+    "chat_llm_tokens_total",
+    "Tokens reported by the chat model, by type (input, output)",
+    ("model", "type")
+)
+tool_seconds = Histogram(
+    "chat_tool_seconds",
+    "Latency of one tool invocation",
+    ("tool", "status")
+)
+
+class TurnInstrumentation(BaseCallbackHandler):
+    """
+    Timings of one chat turn.
+
+    Stages are timed with stage(); model and tool calls inside the agent are
+    timed through the callback events when the handler is passed in the
+    agent's config. Everything is recorded in the histograms above, and the
+    per-turn breakdown is logged when the turn is slower than SLOW_TURN_SECONDS.
+    """
+    # Record in the caller's thread/event loop instead of a thread pool hop per event
+    run_inline = True
+
+    def __init__(self, thread_id: str):
+        self.thread_id = thread_id
+        self.timings: dict[str, float] = {}
+        self._start = time.perf_counter()
+        self._runs: dict[UUID, tuple[str, float]] = {}
+
+    def _add(self, name: str, elapsed: float):
+        self.timings[name] = self.timings.get(name, 0.0) + elapsed
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        Time a stage of the turn
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            stage_seconds.observe(elapsed, stage=name)
+            self._add(name, elapsed)
+
+    def finish(self, path: str) -> float:
+        """
+        Record the total time of the turn
+
+        Args:
+            path (str): How the turn was answered (cache, fast_path, agent, cancelled)
+
+        Returns:
+            float: Duration of the turn in seconds
+        """
+        elapsed = time.perf_counter() - self._start
+        answer_seconds.observe(elapsed, path=path)
+        if elapsed >= SLOW_TURN_SECONDS:
+            breakdown = ", ".join(f"{name}={seconds:.3f}s" for name, seconds in self.timings.items())
+            logger.warning(f"Slow chat turn in thread {self.thread_id}: {elapsed:.3f}s via {path} ({breakdown})")
+        return elapsed
+
+    def _model_start(self, serialized: dict, run_id: UUID, kwargs: dict):
+        metadata = kwargs.get("metadata") or {}
+        model = metadata.get("ls_model_name") or (serialized or {}).get("name") or "unknown"
+        self._runs[run_id] = (model, time.perf_counter())
+
+    def on_chat_model_start(self, serialized: dict, messages: list, *, run_id: UUID, **kwargs: Any):
+        self._model_start(serialized, run_id, kwargs)
+
+    def on_llm_start(self, serialized: dict, prompts: list[str], *, run_id: UUID, **kwargs: Any):
+        self._model_start(serialized, run_id, kwargs)
+
+    def _model_end(self, run_id: UUID, status: str) -> str | None:
+        run = self._runs.pop(run_id, None)
+        if run is None:
+            return None
+        model, start = run
+        elapsed = time.perf_counter() - start
+        llm_call_seconds.observe(elapsed, model=model, status=status)
+        self._add("llm", elapsed)
+        return model
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any):
+        model = self._model_end(run_id, "ok")
+        if model is None:
+            return
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if usage:
+                    llm_tokens.inc(usage.get("input_tokens", 0), model=model, type="input")
+                    llm_tokens.inc(usage.get("output_tokens", 0), model=model, type="output")
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any):
+        self._model_end(run_id, "error")
+
+    def on_tool_start(self, serialized: dict, input_str: str, *, run_id: UUID, **kwargs: Any):
+        name = (serialized or {}).get("name") or kwargs.get("name") or "unknown"
+        self._runs[run_id] = (name, time.perf_counter())
+
+    def _tool_end(self, run_id: UUID, status: str):
+        run = self._runs.pop(run_id, None)
+        if run is None:
+            return
+        name, start = run
+        elapsed = time.perf_counter() - start
+        tool_seconds.observe(elapsed, tool=name, status=status)
+        self._add(f"tool:{name}", elapsed)
+
+    def on_tool_end(self, output: Any, *, run_id: UUID, **kwargs: Any):
+        self._tool_end(run_id, "ok")
+
+    def on_tool_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any):
+        self._tool_end(run_id, "error")
@@ -0,0 +1,298 @@
+import sys, os
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, AsyncIterator, Awaitable, Callable
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, project_root)
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGenerationChunk, ChatResult
+from pydantic import PrivateAttr
+
+from app.core_ai.response_cache import SIDE_EFFECT_TOOLS
+from app.utils.metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+# Time one attempt may take (for streams: until the first chunk), and the
+# budget of a whole call including retries and backoff
+LLM_CALL_TIMEOUT = float(os.getenv("LLM_CALL_TIMEOUT", "30"))
+LLM_CALL_DEADLINE = float(os.getenv("LLM_CALL_DEADLINE", "60"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+# Full jitter: each retry waits a random time up to backoff * 2^(retry - 1), capped
+LLM_RETRY_BACKOFF = float(os.getenv("LLM_RETRY_BACKOFF", "0.5"))
+LLM_RETRY_BACKOFF_MAX = float(os.getenv("LLM_RETRY_BACKOFF_MAX", "4"))
+# Send a second, hedged request when the first has not answered by this
+# percentile of recent latencies, and take whichever answers first
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "false").lower() == "true"
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+LLM_HEDGE_WINDOW = int(os.getenv("LLM_HEDGE_WINDOW", "200"))
+
+# HTTP status of errors worth another attempt (google.api_core errors carry it as .code)
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+llm_resilience_events = Counter(
+    "chat_llm_resilience_events_total",
+    "Chat model call events: timeout, error, retry, hedge, hedge_won, gave_up, not_repeated",
+    ("model", "event")
+)
+
+# Sync calls cannot be cancelled: an attempt that timed out keeps its thread
+# until the model client gives up (create_gemini_model sets its timeout)
+_sync_executor = ThreadPoolExecutor(thread_name_prefix="llm-call")
+
+def is_retryable(error: BaseException) -> bool:
+    """
+    Check whether a failed model call may succeed when sent again
+    """
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    return getattr(error, "code", None) in RETRYABLE_STATUS
+
+def side_effect_ran(messages: list[BaseMessage]) -> bool:
+    """
+    Check whether the agent already called a side-effecting tool in this turn
+
+    The agent scratchpad of the turn is part of every model call, so a tool
+    call the model asked for before is in its messages.
+    """
+    return any(
+        call["name"] in SIDE_EFFECT_TOOLS
+        for message in messages if isinstance(message, AIMessage)
+        for call in message.tool_calls
+    )
+
+class ResilientChatModel(BaseChatModel):
+    """
+    Chat model wrapper with a deadline, retries and hedged requests.
+
+    Each attempt gets at most timeout seconds (streams: until their first
+    chunk) and the whole call at most deadline seconds. Timeouts and errors
+    accepted by is_retryable() are retried up to max_retries times with full
+    jitter backoff. With hedging enabled, a second attempt is started when the
+    first has not answered by the hedge_percentile of recent latencies; the
+    first to answer wins and the other is cancelled.
+
+    A call is never repeated (neither retried nor hedged) once a
+    side-effecting tool has run in the turn, so a slow or failed answer after
+    an order was placed is reported instead of being asked for again.
+    Every timeout, retry and hedge is counted in chat_llm_resilience_events_total.
+    """
+    model: BaseChatModel
+    model_name: str = ""
+    timeout: float = LLM_CALL_TIMEOUT
+    deadline: float = LLM_CALL_DEADLINE
+    max_retries: int = LLM_MAX_RETRIES
+    backoff: float = LLM_RETRY_BACKOFF
+    backoff_max: float = LLM_RETRY_BACKOFF_MAX
+    hedge: bool = LLM_HEDGE_ENABLED
+    hedge_percentile: float = LLM_HEDGE_PERCENTILE
+    hedge_min_samples: int = LLM_HEDGE_MIN_SAMPLES
+
+    # Latencies of successful attempts, per kind ("generate", "stream")
+    _latencies: dict[str, deque] = PrivateAttr(default_factory=dict)
+
+    @property
+    def _llm_type(self) -> str:
+        return f"resilient-{self.model._llm_type}"
+
+    @property
+    def _identifying_params(self) -> dict[str, Any]:
+        return {"model": self.model._identifying_params, "timeout": self.timeout, "max_retries": self.max_retries}
+
+    def bind_tools(self, tools: list, **kwargs: Any):
+        # Let the wrapped model format the tools, then pass its kwargs through
+        bound = self.model.bind_tools(tools, **kwargs)
+        return self.bind(**getattr(bound, "kwargs", {}))
+
+    def _event(self, event: str):
+        llm_resilience_events.inc(model=self.model_name, event=event)
+
+    def _record_latency(self, kind: str, elapsed: float):
+        self._latencies.setdefault(kind, deque(maxlen=LLM_HEDGE_WINDOW)).append(elapsed)
+
+    def hedge_delay(self, kind: str) -> float | None:
+        """
+        Seconds after which a hedged attempt is started, None when not hedging yet
+        """
+        latencies = self._latencies.get(kind)
+        if not self.hedge or latencies is None or len(latencies) < self.hedge_min_samples:
+            return None
+        ordered = sorted(latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * self.hedge_percentile / 100))]
+
+    def _backoff_delay(self, retry: int) -> float:
+        return random.uniform(0, min(self.backoff_max, self.backoff * 2 ** (retry - 1)))
+
+    def _give_up(self, error: BaseException, retry: int, repeatable: bool, remaining: float) -> float | None:
+        """Backoff before the next attempt, None when the error must be raised"""
+        if not is_retryable(error):
+            return None
+        if not repeatable:
+            self._event("not_repeated")
+            return None
+        delay = self._backoff_delay(retry)
+        if retry > self.max_retries or delay >= remaining:
+            self._event("gave_up")
+            return None
+        self._event("retry")
+        logger.warning(f"Retrying {self.model_name} call in {delay:.2f}s after {type(error).__name__}: {error}")
+        return delay
+
+    async def _arace(
+        self,
+        kind: str,
+        start_attempt: Callable[[], Awaitable[Any]],
+        discard: Callable[[Any], Awaitable[None]] | None,
+        timeout: float,
+        hedge_delay: float | None,
+    ) -> Any:
+        """One attempt, plus a hedged one when the first is slower than hedge_delay"""
+        started = time.perf_counter()
+        first = asyncio.ensure_future(start_attempt())
+        attempts = {first: started}
+        try:
+            if hedge_delay is not None and hedge_delay < timeout:
+                done, _ = await asyncio.wait(attempts, timeout=hedge_delay)
+                if not done:
+                    self._event("hedge")
+                    attempts[asyncio.ensure_future(start_attempt())] = time.perf_counter()
+            error: BaseException | None = None
+            while attempts:
+                remaining = started + timeout - time.perf_counter()
+                done, _ = await asyncio.wait(attempts, timeout=max(remaining, 0), return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    self._event("timeout")
+                    raise TimeoutError(f"{self.model_name} did not answer within {timeout:.1f}s")
+                for attempt in done:
+                    attempt_started = attempts.pop(attempt)
+                    if attempt.exception() is None:
+                        self._record_latency(kind, time.perf_counter() - attempt_started)
+                        if attempt is not first:
+                            self._event("hedge_won")
+                        for other in done - {attempt}:
+                            if other.exception() is None and discard is not None:
+                                await discard(other.result())
+                        return attempt.result()
+                    error = attempt.exception()
+                    self._event("error")
+            raise error
+        finally:
+            for attempt in attempts:
+                attempt.cancel()
+            if attempts:
+                await asyncio.gather(*attempts, return_exceptions=True)
+
+    async def _acall(
+        self,
+        kind: str,
+        messages: list[BaseMessage],
+        start_attempt: Callable[[], Awaitable[Any]],
+        discard: Callable[[Any], Awaitable[None]] | None = None,
+    ) -> Any:
+        repeatable = not side_effect_ran(messages)
+        deadline = time.perf_counter() + self.deadline
+        retry = 0
+        while True:
+            remaining = deadline - time.perf_counter()
+            hedge_delay = self.hedge_delay(kind) if repeatable else None
+            try:
+                return await self._arace(kind, start_attempt, discard, min(self.timeout, remaining), hedge_delay)
+            except Exception as e:
+                retry += 1
+                delay = self._give_up(e, retry, repeatable, deadline - time.perf_counter())
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+
+    def _race(self, kind: str, start_attempt: Callable[[], Any], timeout: float, hedge_delay: float | None) -> Any:
+        """Sync version of _arace; attempts run in threads"""
+        started = time.perf_counter()
+        first = _sync_executor.submit(start_attempt)
+        attempts: dict[Future, float] = {first: started}
+        if hedge_delay is not None and hedge_delay < timeout:
+            done, _ = wait(attempts, timeout=hedge_delay)
+            if not done:
+                self._event("hedge")
+                attempts[_sync_executor.submit(start_attempt)] = time.perf_counter()
+        error: BaseException | None = None
+        while attempts:
+            remaining = started + timeout - time.perf_counter()
+            done, _ = wait(attempts, timeout=max(remaining, 0), return_when=FIRST_COMPLETED)
+            if not done:
+                for attempt in attempts:
+                    attempt.cancel()
+                self._event("timeout")
+                raise TimeoutError(f"{self.model_name} did not answer within {timeout:.1f}s")
+            for attempt in done:
+                attempt_started = attempts.pop(attempt)
+                if attempt.exception() is None:
+                    self._record_latency(kind, time.perf_counter() - attempt_started)
+                    if attempt is not first:
+                        self._event("hedge_won")
+                    for other in attempts:
+                        other.cancel()
+                    return attempt.result()
+                error = attempt.exception()
+                self._event("error")
+        raise error
+
+    def _generate(self, messages: list[BaseMessage], stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        repeatable = not side_effect_ran(messages)
+        deadline = time.perf_counter() + self.deadline
+        retry = 0
+        while True:
+            remaining = deadline - time.perf_counter()
+            hedge_delay = self.hedge_delay("generate") if repeatable else None
+            try:
+                # Callbacks are reported once, by this wrapper, not per attempt
+                return self._race(
+                    "generate",
+                    lambda: self.model._generate(messages, stop=stop, **kwargs),
+                    min(self.timeout, remaining),
+                    hedge_delay,
+                )
+            except Exception as e:
+                retry += 1
+                delay = self._give_up(e, retry, repeatable, deadline - time.perf_counter())
+                if delay is None:
+                    raise
+                time.sleep(delay)
+
+    async def _agenerate(self, messages: list[BaseMessage], stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        return await self._acall(
+            "generate",
+            messages,
+            lambda: self.model._agenerate(messages, stop=stop, **kwargs),
+        )
+
+    async def _astream(self, messages: list[BaseMessage], stop=None, run_manager=None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        async def start_attempt() -> tuple[ChatGenerationChunk | None, AsyncIterator[ChatGenerationChunk]]:
+            stream = self.model._astream(messages, stop=stop, **kwargs)
+            try:
+                return await anext(stream, None), stream
+            except BaseException:
+                await stream.aclose()
+                raise
+
+        async def discard(attempt):
+            await attempt[1].aclose()
+
+        # Only the wait for the first chunk is retried or hedged: once a chunk
+        # is out, the customer has seen the answer start
+        first_chunk, stream = await self._acall("stream", messages, start_attempt, discard)
+        try:
+            if first_chunk is None:
+                return
+            yield first_chunk
+            async for chunk in stream:
+                yield chunk
+        finally:
+            await stream.aclose()
@@ -0,0 +1,92 @@
+import sys, os
+import re
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, project_root)
+
+from app.db.product_service import get_catalog_version
+from app.utils.cache import LRUCache
+from app.utils.metrics import Counter
+from app.utils.text import normalize_text
+
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "false").lower() == "true"
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "1000"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "300"))
+RESPONSE_CACHE_CHUNK_SIZE = int(os.getenv("RESPONSE_CACHE_CHUNK_SIZE", "40"))
+
+# Tools whose effects must never be replayed from a cached answer
+SIDE_EFFECT_TOOLS = {"create_order", "update_order_status"}
+
+# Matched against normalized (lowercased, diacritic-free) questions
+ORDER_INTENT = re.compile(
+    r"\b(mua|dat hang|dat mua|dat don|order|thanh toan|tra tien|chot don|huy don|xac nhan|don hang)\b"
+    r"|\b\d+\s*(cai|chiec|may)\b"
+)
+
+_cache = LRUCache(maxsize=RESPONSE_CACHE_SIZE if RESPONSE_CACHE_ENABLED else 0, ttl=RESPONSE_CACHE_TTL)
+
+cache_requests = Counter(
+    "response_cache_requests_total",
+    "Answer cache lookups by result (hit, miss, bypass)",
+    ("result",)
+)
+
+def has_order_intent(question: str) -> bool:
+    """
+    Check whether a question looks like part of a purchase or payment
+    """
+    return bool(ORDER_INTENT.search(normalize_text(question)))
+
+def lookup_key(question: str, history: list[dict]) -> tuple | None:
+    """
+    Get the cache key of a turn, or None if the turn must not use the cache
+
+    Turns in an ongoing conversation or with order-taking intent depend on
+    more than the question text, so they always go to the agent. The key
+    includes the catalog version: any price or stock change makes older
+    product answers unreachable.
+
+    Args:
+        question (str): Question from user
+        history (list[dict]): Recent chat history of the thread
+
+    Returns:
+        tuple | None: Cache key, None to bypass the cache
+    """
+    if not RESPONSE_CACHE_ENABLED:
+        return None
+    if history or has_order_intent(question):
+        cache_requests.inc(result="bypass")
+        return None
+    return (normalize_text(question), get_catalog_version())
+
+def get_cached_answer(key: tuple | None) -> str | None:
+    """
+    Get the cached answer for a key from lookup_key
+    """
+    if key is None:
+        return None
+    answer = _cache.get(key)
+    cache_requests.inc(result="hit" if answer is not None else "miss")
+    return answer
+
+def cache_answer(key: tuple | None, answer: str, tools_used: list[str]):
+    """
+    Store an answer unless the agent ran a side-effecting tool to produce it
+    """
+    if key is None or not answer or SIDE_EFFECT_TOOLS.intersection(tools_used):
+        return
+    _cache.set(key, answer)
+
+def iter_chunks(answer: str, size: int = RESPONSE_CACHE_CHUNK_SIZE):
+    """
+    Split a cached answer into chunks so it streams like a model answer
+    """
+    for start in range(0, len(answer), size):
+        yield answer[start:start + size]
+
+def get_response_cache_stats() -> dict:
+    """
+    Get hit/miss counters of the answer cache
+    """
+    return _cache.stats()
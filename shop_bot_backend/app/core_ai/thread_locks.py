@@ -0,0 +1,219 @@
+import sys, os
+import asyncio
+import hashlib
+import math
+import time
+import logging
+from contextlib import asynccontextmanager
+
+import psycopg
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, project_root)
+
+from app.core_ai.admission import AdmissionRejected, admission_rejected
+from app.db.chat_history_service import invalidate_thread
+from app.db.chat_history_writer import CHAT_HISTORY_WRITE_BEHIND
+from app.db.connection import get_conninfo
+from app.utils.metrics import Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+# "local" serializes turns within this process; "advisory" also takes a
+# PostgreSQL advisory lock per thread, for several workers behind one database
+THREAD_LOCK_MODE = os.getenv("THREAD_LOCK_MODE", "local").lower()
+THREAD_LOCK_TIMEOUT = float(os.getenv("THREAD_LOCK_TIMEOUT", "60"))
+THREAD_LOCK_POLL_SECONDS = float(os.getenv("THREAD_LOCK_POLL_SECONDS", "0.2"))
+
+if THREAD_LOCK_MODE not in ("local", "advisory"):
+    raise ValueError(f"THREAD_LOCK_MODE must be 'local' or 'advisory', got {THREAD_LOCK_MODE!r}")
+
+thread_lock_wait_seconds = Histogram(
+    "thread_lock_wait_seconds",
+    "Time a chat turn waited for the previous turn of its thread, by mode (local, advisory)",
+    ("mode",)
+)
+thread_locks_active = Gauge(
+    "thread_locks_active",
+    "Threads with a turn running or waiting in this process"
+)
+
+def advisory_key(thread_id: str) -> int:
+    """
+    Map a thread_id to the signed 64-bit key of its advisory lock
+    """
+    digest = hashlib.blake2b(f"chat_thread:{thread_id}".encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True)
+
+class _Entry:
+    __slots__ = ("lock", "users")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        # Turns holding or waiting for the lock; the entry is dropped at zero
+        self.users = 0
+
+class ThreadLease:
+    """
+    The right to run the next turn of one thread; release() is idempotent
+    """
+
+    def __init__(self, locks: "ThreadLocks", thread_id: str, key: int | None):
+        self._locks = locks
+        self.thread_id = thread_id
+        self.key = key
+        self.started = time.monotonic()
+        self.released = False
+
+    async def release(self):
+        if not self.released:
+            self.released = True
+            await self._locks._release(self)
+
+class ThreadLocks:
+    """
+    Runs the turns of one thread one at a time, in arrival order, while turns
+    of different threads run in parallel.
+
+    Each thread gets an asyncio.Lock that lives only while a turn holds or
+    waits for it, so memory is bounded by the turns in flight. In advisory
+    mode the holder of the local lock also takes pg_try_advisory_lock on a
+    dedicated autocommit connection shared by all threads of this process,
+    so workers serving the same database exclude each other without tying up
+    a pooled connection per turn. The thread's cached history is dropped once
+    the lock is held, since another worker may have answered the last turn.
+    """
+
+    def __init__(
+        self,
+        mode: str = THREAD_LOCK_MODE,
+        poll_interval: float = THREAD_LOCK_POLL_SECONDS,
+    ):
+        self.mode = mode
+        self.poll_interval = poll_interval
+        self._entries: dict[str, _Entry] = {}
+        self._conn: psycopg.AsyncConnection | None = None
+        self._conn_lock = asyncio.Lock()
+        # Moving average of how long a turn holds its thread, for Retry-After
+        self._avg_hold = 1.0
+
+    async def _execute(self, query: str, key: int) -> bool:
+        async with self._conn_lock:
+            if self._conn is None or self._conn.closed:
+                if CHAT_HISTORY_WRITE_BEHIND:
+                    logger.warning("Advisory thread locks with CHAT_HISTORY_WRITE_BEHIND: "
+                                   "a turn may still be queued when the next worker reads the thread")
+                self._conn = await psycopg.AsyncConnection.connect(get_conninfo(), autocommit=True)
+            try:
+                cursor = await self._conn.execute(query, (key,))
+                return (await cursor.fetchone())[0]
+            except psycopg.OperationalError:
+                # Locks held by the lost session are released by the server
+                await self._conn.close()
+                self._conn = None
+                raise
+
+    async def _lock_advisory(self, key: int):
+        delay = 0.01
+        while not await self._execute("SELECT pg_try_advisory_lock(%s)", key):
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.poll_interval)
+
+    async def acquire(self, thread_id: str, timeout: float | None = THREAD_LOCK_TIMEOUT) -> ThreadLease:
+        """
+        Wait until the earlier turns of a thread are done
+
+        Args:
+            thread_id (str): Thread the turn belongs to
+            timeout (float | None): Longest wait in seconds, None to wait for as long as it takes
+
+        Returns:
+            ThreadLease: The thread's lock; release it when the turn is saved
+
+        Raises:
+            AdmissionRejected: If the wait times out (reason "thread_busy")
+        """
+        start = time.perf_counter()
+        entry = self._entries.get(thread_id)
+        if entry is None:
+            entry = self._entries[thread_id] = _Entry()
+            thread_locks_active.set(len(self._entries))
+        entry.users += 1
+        key = advisory_key(thread_id) if self.mode == "advisory" else None
+        locked = False
+        try:
+            async with asyncio.timeout(timeout):
+                await entry.lock.acquire()
+                locked = True
+                if key is not None:
+                    await self._lock_advisory(key)
+        except BaseException as e:
+            if locked:
+                if key is not None:
+                    # The wait may have been cut off after the server granted the lock
+                    try:
+                        await asyncio.shield(self._execute("SELECT pg_advisory_unlock(%s)", key))
+                    except Exception:
+                        pass
+                entry.lock.release()
+            self._leave(thread_id, entry)
+            if isinstance(e, TimeoutError):
+                admission_rejected.inc(reason="thread_busy")
+                raise AdmissionRejected("thread_busy", max(1, math.ceil(self._avg_hold)))
+            raise
+        if key is not None:
+            invalidate_thread(thread_id)
+        thread_lock_wait_seconds.observe(time.perf_counter() - start, mode=self.mode)
+        return ThreadLease(self, thread_id, key)
+
+    @asynccontextmanager
+    async def hold(self, thread_id: str, timeout: float | None = THREAD_LOCK_TIMEOUT):
+        """
+        Hold a thread's lock for the duration of the with block
+        """
+        lease = await self.acquire(thread_id, timeout)
+        try:
+            yield lease
+        finally:
+            await lease.release()
+
+    def _leave(self, thread_id: str, entry: _Entry):
+        entry.users -= 1
+        if not entry.users:
+            del self._entries[thread_id]
+            thread_locks_active.set(len(self._entries))
+
+    async def _release(self, lease: ThreadLease):
+        entry = self._entries[lease.thread_id]
+        try:
+            if lease.key is not None:
+                if not await self._execute("SELECT pg_advisory_unlock(%s)", lease.key):
+                    logger.warning(f"Advisory lock of thread {lease.thread_id} was already gone")
+        except Exception as e:
+            logger.error(f"Error releasing advisory lock of thread {lease.thread_id}: {e}")
+        finally:
+            self._avg_hold = 0.9 * self._avg_hold + 0.1 * (time.monotonic() - lease.started)
+            entry.lock.release()
+            self._leave(lease.thread_id, entry)
+
+    async def close(self):
+        """
+        Close the advisory lock connection, releasing any locks still held on it
+        """
+        async with self._conn_lock:
+            if self._conn is not None:
+                await self._conn.close()
+                self._conn = None
+
+    def stats(self) -> dict:
+        """
+        Get the number of threads with turns in flight
+        """
+        return {
+            "mode": self.mode,
+            "threads": len(self._entries),
+            "waiting": sum(entry.users - entry.lock.locked() for entry in self._entries.values()),
+            "avg_hold_s": self._avg_hold,
+        }
+
+thread_locks = ThreadLocks()
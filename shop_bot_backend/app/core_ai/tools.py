@@ -7,9 +7,11 @@ import sys, os
 project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
 sys.path.insert(0, project_root)
 
-from app.db.product_service import get_product_by_name, check_product_stock, update_product_stock
-from app.db.order_service import create_order, update_order_status
-from app.db.wallet_service import get_wallet, update_balance
+from app.db.product_service import search_products, asearch_products
+from app.db.order_service import (
+    ORDER_FLOW, place_order, reserve_order, update_order_status,
+    aplace_order, areserve_order, aupdate_order_status,
+)
 
 class ProductSearchInput(BaseModel):
     """
@@ -22,14 +24,23 @@ class ProductSearchTool(BaseTool):
     Tool for searching product information by name.
     """
     name: Annotated[str, Field(description="Tool name")] = "product_search"
-    description: Annotated[str, Field(description="Tool description")] = "Search for product information by name."
+    description: Annotated[str, Field(description="Tool description")] = (
+        "Search for product information by name. The name may be partial or written without diacritics. "
+        "Returns a list of candidate products, best match first, each with a relevance score between 0 and 1."
+    )
     args_schema: type[ProductSearchInput] = ProductSearchInput
     
-    def _run(self, product_name: str) -> dict | None:
+    def _run(self, product_name: str) -> list[dict]:
         """
         Run the product search tool.
         """
-        return get_product_by_name(product_name)
+        return search_products(product_name)
+
+    async def _arun(self, product_name: str) -> list[dict]:
+        """
+        Run the product search tool asynchronously.
+        """
+        return await asearch_products(product_name)
     
 class CreateOrderInput(BaseModel):
     """
@@ -40,6 +51,47 @@ class CreateOrderInput(BaseModel):
     quantity: int = Field(..., description="The quantity of the product being ordered")
     total_amount: float = Field(..., description="The total amount of the order")
 
+def _order_result_message(result: dict) -> dict:
+    """
+    Turn a place_order or reserve_order result into the message returned to the agent.
+    """
+    status = result["status"]
+    if status == "ok" and "reserved_until" in result["order"]:
+        return {
+            "success": True,
+            "order": result["order"],
+            "message": (
+                f"Order created and stock reserved until {result['order']['reserved_until']:%H:%M}. "
+                "Payment is taken when the customer confirms: set the order status to paid"
+            )
+        }
+    if status == "ok":
+        return {
+            "success": True,
+            "order": result["order"],
+            "message": f"Order created and payment successful. Remaining balance: {result['balance']:,.0f} VND"
+        }
+    if status == "insufficient_stock":
+        return {
+            "error": "Insufficient stock",
+            "message": "Product is out of stock"
+        }
+    if status == "wallet_not_found":
+        return {
+            "error": "Wallet not found",
+            "message": "Wallet not found"
+        }
+    if status == "insufficient_balance":
+        return {
+            "error": "Insufficient balance",
+            "message": f"Insufficient balance. Current balance: {result['balance']:,.0f} VND",
+            "balance": result["balance"]
+        }
+    return {
+        "error": "Order creation failed",
+        "message": "Cannot create order"
+    }
+
 class CreateOrderTool(BaseTool):
     """
     Tool for creating a new order for a product.
@@ -52,59 +104,27 @@ class CreateOrderTool(BaseTool):
         """
         Run the create order tool.
         """
-        if not check_product_stock(product_id, quantity):
-            return {
-                "error": "Insufficient stock",
-                "message": "Product is out of stock"
-            }
-        
-        wallet = get_wallet(user_id)
-        if not wallet:
-            return {
-                "error": "Wallet not found",
-                "message": "Wallet not found"
-            }
-        
-        if wallet['balance'] < Decimal(str(total_amount)):
-            return {
-                "error": "Insufficient balance",
-                "message": f"Insufficient balance. Current balance: {wallet['balance']:,.0f} VND",
-                "balance": wallet['balance']
-            }
-        
-        if not update_product_stock(product_id, quantity):
-            return {
-                "error": "Stock update failed",
-                "message": "Cannot update stock"
-            }
-            
-        updated_wallet = update_balance(user_id, Decimal(str(-total_amount)))
-        if not updated_wallet:
-            return {
-                "error": "Payment failed",
-                "message": "Cannot process payment"
-            }
-        
-        order = create_order(
+        create = reserve_order if ORDER_FLOW == "reserve" else place_order
+        result = create(
             user_id=user_id,
             product_id=product_id,
             quantity=quantity,
             total_amount=Decimal(str(total_amount))
         )
-        
-        if order:
-            return {
-                "success": True,
-                "order": order,
-                "message": f"Order created and payment successful. Remaining balance: {updated_wallet['balance']:,.0f} VND"
-            }
-        
-        update_balance(user_id, Decimal(str(total_amount)))
-        update_product_stock(product_id, -quantity)
-        return {
-            "error": "Order creation failed",
-            "message": "Cannot create order"
-        }
+        return _order_result_message(result)
+
+    async def _arun(self, user_id: str, product_id: int, quantity: int, total_amount: float) -> dict | None:
+        """
+        Run the create order tool asynchronously.
+        """
+        create = areserve_order if ORDER_FLOW == "reserve" else aplace_order
+        result = await create(
+            user_id=user_id,
+            product_id=product_id,
+            quantity=quantity,
+            total_amount=Decimal(str(total_amount))
+        )
+        return _order_result_message(result)
         
 class UpdateOrderStatusInput(BaseModel):
     """
@@ -113,6 +133,58 @@ class UpdateOrderStatusInput(BaseModel):
     order_id: int = Field(..., description="The ID of the order to update")
     status: str = Field(..., description="The new status of the order: (pending, confirmed, paid, cancelled)")
 
+def _status_result_message(result: dict, status: str) -> dict:
+    """
+    Turn an update_order_status result into the message returned to the agent.
+    """
+    outcome = result["status"]
+    if outcome == "ok" and status == "paid" and result["balance"] is not None:
+        return {
+            "success": True,
+            "message": f"Payment successful. Remaining balance: {result['balance']:,.0f} VND"
+        }
+    if outcome == "ok":
+        # An order placed before reservations existed is marked paid without a debit
+        return {
+            "success": True,
+            "message": f"Order status updated to {status}"
+        }
+    if outcome == "already_paid":
+        return {
+            "success": True,
+            "message": "Order was already paid, the wallet was not debited again"
+        }
+    if outcome == "order_not_found":
+        return {
+            "error": "Order not found",
+            "message": "Order not found"
+        }
+    if outcome == "order_not_pending":
+        return {
+            "error": "Order not pending",
+            "message": "This order is no longer pending (it may have been cancelled) and cannot be paid"
+        }
+    if outcome == "reservation_expired":
+        return {
+            "error": "Reservation expired",
+            "message": "The stock reservation of this order has expired. Create a new order"
+        }
+    if outcome == "wallet_not_found":
+        return {
+            "error": "Wallet not found",
+            "message": "Wallet not found"
+        }
+    if outcome == "insufficient_balance":
+        return {
+            "error": "Insufficient balance",
+            "message": f"Insufficient balance. Current balance: {result['balance']:,.0f} VND",
+            "balance": result["balance"]
+        }
+    return {
+        "error": "Order update failed",
+        "message": "Cannot update order status"
+    }
+
 class UpdateOrderStatusTool(BaseTool):
     """
     Tool for updating the status of an order.
@@ -121,8 +193,14 @@ class UpdateOrderStatusTool(BaseTool):
     description: Annotated[str, Field(description="Tool description")] = "Update the status of an order"
     args_schema: type[BaseModel] = UpdateOrderStatusInput
 
-    def _run(self, order_id: int, status: str) -> bool:
+    def _run(self, order_id: int, status: str) -> dict:
         """
         Run the update order status tool.
         """
-        return update_order_status(order_id, status)
\ No newline at end of file
+        return _status_result_message(update_order_status(order_id, status), status)
+
+    async def _arun(self, order_id: int, status: str) -> dict:
+        """
+        Run the update order status tool asynchronously.
+        """
+        return _status_result_message(await aupdate_order_status(order_id, status), status)
\ No newline at end of file
@@ -0,0 +1,270 @@
+import sys, os
+import argparse
+import csv
+import gzip
+import json
+import time
+import logging
+from dataclasses import dataclass
+from decimal import Decimal
+from itertools import islice
+from typing import Callable, Iterable, Iterator
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, project_root)
+
+from app.db.connection import get_db_connection
+from app.db.product_service import CATALOG_CHANNEL, BULK_LOAD_SETTING
+
+logger = logging.getLogger(__name__)
+
+IMPORT_BATCH_SIZE = int(os.getenv('IMPORT_BATCH_SIZE', '50000'))
+
+# Staging tables are per session and emptied at every commit, so each batch
+# starts from an empty table and nothing is left behind in pooled connections
+CREATE_PRODUCT_STAGING = """
+    CREATE TEMP TABLE IF NOT EXISTS product_staging (
+        record BIGINT NOT NULL,
+        name VARCHAR(255) NOT NULL,
+        description TEXT,
+        price DECIMAL(10, 2) NOT NULL,
+        stock INTEGER NOT NULL,
+        specifications JSONB
+    ) ON COMMIT DELETE ROWS
+"""
+
+COPY_PRODUCT_STAGING = "COPY product_staging (record, name, description, price, stock, specifications) FROM STDIN"
+
+# The last record wins when a name appears twice in a batch; unchanged rows are not rewritten
+UPSERT_PRODUCTS = """
+    WITH upserted AS (
+        INSERT INTO product (name, description, price, stock, specifications)
+        SELECT DISTINCT ON (name) name, description, price, stock, specifications
+        FROM product_staging
+        ORDER BY name, record DESC
+        ON CONFLICT (name) DO UPDATE
+        SET description = EXCLUDED.description,
+            price = EXCLUDED.price,
+            stock = EXCLUDED.stock,
+            specifications = EXCLUDED.specifications,
+            updated_at = CURRENT_TIMESTAMP
+        WHERE (product.description, product.price, product.stock, product.specifications)
+              IS DISTINCT FROM (EXCLUDED.description, EXCLUDED.price, EXCLUDED.stock, EXCLUDED.specifications)
+        RETURNING xmax = 0 AS inserted
+    )
+    SELECT count(*) FILTER (WHERE inserted) AS inserted,
+           count(*) FILTER (WHERE NOT inserted) AS updated
+    FROM upserted
+"""
+
+CREATE_WALLET_STAGING = """
+    CREATE TEMP TABLE IF NOT EXISTS wallet_staging (
+        record BIGINT NOT NULL,
+        user_id VARCHAR(255) NOT NULL,
+        balance DECIMAL(15,2) NOT NULL
+    ) ON COMMIT DELETE ROWS
+"""
+
+COPY_WALLET_STAGING = "COPY wallet_staging (record, user_id, balance) FROM STDIN"
+
+UPSERT_WALLETS = """
+    WITH upserted AS (
+        INSERT INTO user_wallet (user_id, balance)
+        SELECT DISTINCT ON (user_id) user_id, balance
+        FROM wallet_staging
+        ORDER BY user_id, record DESC
+        ON CONFLICT (user_id) DO UPDATE
+        SET balance = EXCLUDED.balance,
+            ledger_id = (SELECT COALESCE(max(l.id), 0) FROM wallet_ledger l WHERE l.user_id = EXCLUDED.user_id),
+            updated_at = CURRENT_TIMESTAMP
+        -- The imported balance replaces wallet ledger entries not yet compacted
+        WHERE user_wallet.balance IS DISTINCT FROM EXCLUDED.balance
+           OR EXISTS (SELECT 1 FROM wallet_ledger l WHERE l.user_id = EXCLUDED.user_id AND l.id > user_wallet.ledger_id)
+        RETURNING xmax = 0 AS inserted
+    )
+    SELECT count(*) FILTER (WHERE inserted) AS inserted,
+           count(*) FILTER (WHERE NOT inserted) AS updated
+    FROM upserted
+"""
+
+@dataclass
+class ImportStats:
+    """
+    Progress of one import; updated after every committed batch
+    """
+    table: str
+    records: int = 0
+    inserted: int = 0
+    updated: int = 0
+    batches: int = 0
+    seconds: float = 0.0
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.records / self.seconds if self.seconds else 0.0
+
+    def __str__(self) -> str:
+        return (f"{self.table}: {self.records} records, {self.inserted} inserted, "
+                f"{self.updated} updated, {self.seconds:.1f}s, {self.rows_per_second:.0f} rows/s")
+
+def read_records(path: str) -> Iterator[dict]:
+    """
+    Stream records from a CSV file with a header row or a JSON Lines file
+
+    Args:
+        path (str): .csv or .jsonl file, optionally gzipped (.csv.gz, .jsonl.gz)
+
+    Returns:
+        Iterator[dict]: One dict per record, read lazily
+    """
+    opener = gzip.open if path.endswith(".gz") else open
+    name = path[:-3] if path.endswith(".gz") else path
+    if name.endswith(".jsonl"):
+        with opener(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    elif name.endswith(".csv"):
+        with opener(path, "rt", newline="", encoding="utf-8") as f:
+            yield from csv.DictReader(f)
+    else:
+        raise ValueError(f"Unsupported file type: {path} (expected .csv or .jsonl)")
+
+def product_rows(records: Iterable[dict]) -> Iterator[tuple]:
+    """
+    Convert product records (name, description, price, stock, specifications)
+    into staging rows; specifications may be a dict or a JSON string
+
+    Raises:
+        ValueError: If a record is missing a field or has an invalid value
+    """
+    for number, record in enumerate(records, 1):
+        try:
+            specifications = record.get("specifications")
+            if specifications is not None and not isinstance(specifications, str):
+                specifications = json.dumps(specifications, ensure_ascii=False)
+            yield (
+                number,
+                record["name"].strip(),
+                record.get("description") or None,
+                Decimal(str(record["price"])),
+                int(record.get("stock") or 0),
+                specifications or None,
+            )
+        except (KeyError, TypeError, ValueError, ArithmeticError, AttributeError) as e:
+            raise ValueError(f"Invalid product record {number}: {e!r}") from e
+
+def wallet_rows(records: Iterable[dict]) -> Iterator[tuple]:
+    """
+    Convert wallet records (user_id, balance) into staging rows
+
+    Raises:
+        ValueError: If a record is missing a field or has an invalid value
+    """
+    for number, record in enumerate(records, 1):
+        try:
+            yield (number, str(record["user_id"]).strip(), Decimal(str(record["balance"])))
+        except (KeyError, TypeError, ValueError, ArithmeticError) as e:
+            raise ValueError(f"Invalid wallet record {number}: {e!r}") from e
+
+def _import(
+    stats: ImportStats,
+    rows: Iterable[tuple],
+    create_staging: str,
+    copy_staging: str,
+    upsert: str,
+    batch_size: int,
+    progress: Callable[[ImportStats], None] | None,
+    notify_catalog: bool = False,
+) -> ImportStats:
+    rows = iter(rows)
+    start = time.perf_counter()
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(create_staging)
+            while True:
+                copied = 0
+                with cur.copy(copy_staging) as copy:
+                    for row in islice(rows, batch_size):
+                        copy.write_row(row)
+                        copied += 1
+                if not copied:
+                    break
+                if notify_catalog:
+                    # One cache flush per batch instead of a notification per row
+                    cur.execute("SELECT set_config(%s, 'on', true)", (BULK_LOAD_SETTING,))
+                    cur.execute("SELECT pg_notify(%s, '')", (CATALOG_CHANNEL,))
+                result = cur.execute(upsert).fetchone()
+                conn.commit()
+                stats.records += copied
+                stats.inserted += result["inserted"]
+                stats.updated += result["updated"]
+                stats.batches += 1
+                stats.seconds = time.perf_counter() - start
+                if progress is not None:
+                    progress(stats)
+            if stats.inserted > stats.records // 10:
+                cur.execute(f"ANALYZE {stats.table}")
+        conn.commit()
+    stats.seconds = time.perf_counter() - start
+    return stats
+
+def import_products(
+    records: Iterable[dict],
+    batch_size: int = IMPORT_BATCH_SIZE,
+    progress: Callable[[ImportStats], None] | None = None,
+) -> ImportStats:
+    """
+    Insert or update products by name from a stream of records
+
+    Records are copied into a staging table and upserted into product one
+    batch per transaction, so memory use does not grow with the input and
+    existing products (and the orders pointing at them) are kept. Products
+    missing from the input are left untouched.
+
+    Args:
+        records (Iterable[dict]): Product records, e.g. from read_records
+        batch_size (int): Records per transaction
+        progress (Callable[[ImportStats], None] | None): Called after every batch
+
+    Returns:
+        ImportStats: Number of records read, inserted and updated, and the time taken
+    """
+    return _import(
+        ImportStats("product"), product_rows(records),
+        CREATE_PRODUCT_STAGING, COPY_PRODUCT_STAGING, UPSERT_PRODUCTS,
+        batch_size, progress, notify_catalog=True,
+    )
+
+def import_wallets(
+    records: Iterable[dict],
+    batch_size: int = IMPORT_BATCH_SIZE,
+    progress: Callable[[ImportStats], None] | None = None,
+) -> ImportStats:
+    """
+    Create wallets or reset their balance by user_id from a stream of records
+
+    Works like import_products.
+    """
+    return _import(
+        ImportStats("user_wallet"), wallet_rows(records),
+        CREATE_WALLET_STAGING, COPY_WALLET_STAGING, UPSERT_WALLETS,
+        batch_size, progress,
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import products and wallets from CSV or JSON Lines files")
+    parser.add_argument("--products", help="Product file (.csv, .jsonl, optionally .gz)")
+    parser.add_argument("--wallets", help="Wallet file (.csv, .jsonl, optionally .gz)")
+    parser.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE, help="Records per transaction")
+    args = parser.parse_args()
+    if not args.products and not args.wallets:
+        parser.error("nothing to import, give --products and/or --wallets")
+
+    if args.products:
+        print(import_products(read_records(args.products), args.batch_size, progress=print))
+    if args.wallets:
+        print(import_wallets(read_records(args.wallets), args.batch_size, progress=print))
+
+if __name__ == "__main__":
+    main()
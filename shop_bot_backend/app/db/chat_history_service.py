@@ -1,47 +1,128 @@
 import sys, os
+import time
+import uuid
+import asyncio
 import logging
+from datetime import datetime
 
 project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
 sys.path.insert(0, project_root)
 
-from app.db.product_service import get_db_connection
+from app.db.connection import get_db_connection, get_async_db_connection
+from app.db.chat_history_writer import ChatHistoryWriter, get_chat_history_writer
+from app.utils.cache import LRUCache
+from app.utils.metrics import Histogram
 
 logger = logging.getLogger(__name__)
 
-def init_chat_history_table():
+HISTORY_CACHE_THREADS = int(os.getenv('HISTORY_CACHE_THREADS', '10000'))
+HISTORY_CACHE_TURNS = int(os.getenv('HISTORY_CACHE_TURNS', '10'))
+HISTORY_CACHE_TTL = float(os.getenv('HISTORY_CACHE_TTL', '600'))
+# Recent history only looks this far back, so loading it scans the partitions
+# of the last months of message instead of every month ever kept. Turns of a
+# thread resumed after a longer pause live on in its rolling summary.
+HISTORY_LOOKBACK_DAYS = int(os.getenv('HISTORY_LOOKBACK_DAYS', '90'))
+
+# thread_id -> (recent messages newest first, whether the thread has no older messages).
+# save_chat_history writes through, so in a single worker the cache never goes stale;
+# the TTL bounds staleness when several workers serve the same thread.
+_history_cache = LRUCache(maxsize=HISTORY_CACHE_THREADS, ttl=HISTORY_CACHE_TTL)
+
+# thread_id -> rolling summary row (or None when the thread has no summary yet)
+_summary_cache = LRUCache(maxsize=HISTORY_CACHE_THREADS, ttl=HISTORY_CACHE_TTL)
+_NOT_CACHED = object()
+
+history_load_seconds = Histogram(
+    "chat_history_load_seconds",
+    "Time to load the recent chat history of a thread",
+    ("source",)
+)
+
+INSERT_MESSAGE = """
+    INSERT INTO message (thread_id, question, answer)
+    VALUES (%s, %s, %s)
+    RETURNING id::text, thread_id, question, answer, created_at
+"""
+
+SELECT_THREAD_SUMMARY = """
+    SELECT thread_id, summary, summarized_until, updated_at
+    FROM thread_summary
+    WHERE thread_id = %s
+"""
+
+UPSERT_THREAD_SUMMARY = """
+    INSERT INTO thread_summary (thread_id, summary, summarized_until)
+    VALUES (%s, %s, %s)
+    ON CONFLICT (thread_id) DO UPDATE
+    SET summary = EXCLUDED.summary,
+        summarized_until = EXCLUDED.summarized_until,
+        updated_at = CURRENT_TIMESTAMP
+    RETURNING thread_id, summary, summarized_until, updated_at
+"""
+
+SELECT_RECENT_MESSAGES = """
+    SELECT 
+        id::text,
+        thread_id,
+        question,
+        answer,
+        created_at
+    FROM message 
+    WHERE thread_id = %s 
+      AND created_at >= LOCALTIMESTAMP - make_interval(days => %s)
+    ORDER BY created_at DESC 
+    LIMIT %s
+"""
+
+def _get_cached_history(thread_id: str, limit: int) -> list[dict] | None:
+    entry = _history_cache.get(thread_id)
+    if entry is None:
+        return None
+    messages, complete = entry
+    if len(messages) >= limit or complete:
+        return list(messages[:limit])
+    return None
+
+def _cache_history(thread_id: str, messages: list[dict], fetch_limit: int):
+    complete = len(messages) < fetch_limit
+    if len(messages) > HISTORY_CACHE_TURNS:
+        messages, complete = messages[:HISTORY_CACHE_TURNS], False
+    _history_cache.set(thread_id, (tuple(messages), complete))
+
+def _append_cached_history(message: dict):
+    entry = _history_cache.peek(message['thread_id'])
+    if entry is None:
+        return
+    messages, complete = entry
+    messages = (message,) + messages
+    if len(messages) > HISTORY_CACHE_TURNS:
+        messages, complete = messages[:HISTORY_CACHE_TURNS], False
+    _history_cache.set(message['thread_id'], (messages, complete))
+
+def _new_message(writer: ChatHistoryWriter, thread_id: str, question: str, answer: str) -> dict:
+    # Rows written behind get their id and timestamp here rather than from
+    # column defaults, so the cache and the table agree on both. The timestamp
+    # comes from the database clock, like the default of rows inserted directly
+    return {
+        "id": str(uuid.uuid4()),
+        "thread_id": thread_id,
+        "question": question,
+        "answer": answer,
+        "created_at": writer.now(),
+    }
+
+def invalidate_thread(thread_id: str):
     """
-    Initialize the message table in the database if it does not exist.
-    This table stores chat history including:
-    - Message ID (UUID)
-    - Conversation ID
-    - Question
-    - Answer
-    - Creation time
+    Drop a thread's cached history and summary, e.g. when another worker may have written to it
     """
-    try:
-        with get_db_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute("CREATE EXTENSION IF NOT EXISTS \"uuid-ossp\"")
-                
-                cur.execute("""
-                    CREATE TABLE IF NOT EXISTS message (
-                        id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
-                        thread_id VARCHAR(255) NOT NULL,
-                        question TEXT NOT NULL,
-                        answer TEXT NOT NULL,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
-                """)
-                
-                cur.execute("""
-                    CREATE INDEX IF NOT EXISTS idx_message_thread_id 
-                    ON message(thread_id)
-                """)
-            conn.commit()
-            logger.info("Chat history table initialized successfully")
-    except Exception as e:
-        logger.error(f"Error initializing chat history table: {e}")
-        raise
+    _history_cache.pop(thread_id)
+    _summary_cache.pop(thread_id)
+
+def get_history_cache_stats() -> dict:
+    """
+    Get hit/miss counters of the recent history cache
+    """
+    return _history_cache.stats()
 
 def save_chat_history(thread_id: str, question: str, answer: str) -> dict:
     """
@@ -55,15 +136,22 @@ def save_chat_history(thread_id: str, question: str, answer: str) -> dict:
     Returns:
         dict: Information about the saved chat history
     """
+    writer = get_chat_history_writer()
+    if writer is not None:
+        message = _new_message(writer, thread_id, question, answer)
+        _append_cached_history(message)
+        writer.submit(message)
+        return message['id']
     try:
         with get_db_connection() as conn:
             with conn.cursor() as cur:
                 cur.execute(
-                    "INSERT INTO message (thread_id, question, answer) VALUES (%s, %s, %s) RETURNING id::text",
+                    INSERT_MESSAGE,
                     (thread_id, question, answer)
                 )
                 result = cur.fetchone()
             conn.commit()
+            _append_cached_history(result)
             return result['id']
     except Exception as e:
         logger.error(f"Error saving chat history: {e}")
@@ -80,31 +168,139 @@ def get_recent_chat_history(thread_id: str, limit: int = 10) -> list[dict]:
     Returns:
         list[dict]: List of recent messages
     """
+    start = time.perf_counter()
+    cached = _get_cached_history(thread_id, limit)
+    if cached is not None:
+        history_load_seconds.observe(time.perf_counter() - start, source="cache")
+        return cached
+    fetch_limit = max(limit, HISTORY_CACHE_TURNS)
     try:
         with get_db_connection() as conn:
             with conn.cursor() as cur:
                 cur.execute(
-                    """
-                    SELECT 
-                        id::text,
-                        thread_id,
-                        question,
-                        answer,
-                        created_at
-                    FROM message 
-                    WHERE thread_id = %s 
-                    ORDER BY created_at DESC 
-                    LIMIT %s
-                    """,
-                    (thread_id, limit)
+                    SELECT_RECENT_MESSAGES,
+                    (thread_id, HISTORY_LOOKBACK_DAYS, fetch_limit)
                 )
-                return cur.fetchall() or []
+                messages = cur.fetchall() or []
+        _cache_history(thread_id, messages, fetch_limit)
+        history_load_seconds.observe(time.perf_counter() - start, source="db")
+        return messages[:limit]
     except Exception as e:
         logger.error(f"Error getting chat history: {e}")
         return []
 
-def main():
-    init_chat_history_table() 
-    
+async def asave_chat_history(thread_id: str, question: str, answer: str) -> str:
+    """
+    Async version of save_chat_history
+    """
+    writer = get_chat_history_writer()
+    if writer is not None:
+        message = _new_message(writer, thread_id, question, answer)
+        _append_cached_history(message)
+        if not writer.try_submit(message):
+            await asyncio.to_thread(writer.submit, message)
+        return message['id']
+    try:
+        async with get_async_db_connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(INSERT_MESSAGE, (thread_id, question, answer))
+                result = await cur.fetchone()
+            await conn.commit()
+            _append_cached_history(result)
+            return result['id']
+    except Exception as e:
+        logger.error(f"Error saving chat history: {e}")
+        raise
+
+async def aget_recent_chat_history(thread_id: str, limit: int = 10) -> list[dict]:
+    """
+    Async version of get_recent_chat_history
+    """
+    start = time.perf_counter()
+    cached = _get_cached_history(thread_id, limit)
+    if cached is not None:
+        history_load_seconds.observe(time.perf_counter() - start, source="cache")
+        return cached
+    fetch_limit = max(limit, HISTORY_CACHE_TURNS)
+    try:
+        async with get_async_db_connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(SELECT_RECENT_MESSAGES, (thread_id, HISTORY_LOOKBACK_DAYS, fetch_limit))
+                messages = await cur.fetchall() or []
+        _cache_history(thread_id, messages, fetch_limit)
+        history_load_seconds.observe(time.perf_counter() - start, source="db")
+        return messages[:limit]
+    except Exception as e:
+        logger.error(f"Error getting chat history: {e}")
+        return []
+
+def get_thread_summary(thread_id: str) -> dict | None:
+    """
+    Get the rolling summary of a conversation
+
+    Args:
+        thread_id (str): ID of the conversation
+
+    Returns:
+        dict | None: summary and summarized_until (creation time of the newest
+                     message folded into it), None if the thread has no summary
+    """
+    cached = _summary_cache.get(thread_id, _NOT_CACHED)
+    if cached is not _NOT_CACHED:
+        return cached
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(SELECT_THREAD_SUMMARY, (thread_id,))
+            result = cur.fetchone()
+    _summary_cache.set(thread_id, result)
+    return result
+
+def save_thread_summary(thread_id: str, summary: str, summarized_until: datetime) -> dict:
+    """
+    Save the rolling summary of a conversation
+
+    Args:
+        thread_id (str): ID of the conversation
+        summary (str): Summary text
+        summarized_until (datetime): Creation time of the newest message folded into the summary
+
+    Returns:
+        dict: The saved summary
+    """
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(UPSERT_THREAD_SUMMARY, (thread_id, summary, summarized_until))
+            result = cur.fetchone()
+        conn.commit()
+    _summary_cache.set(thread_id, result)
+    return result
+
+async def aget_thread_summary(thread_id: str) -> dict | None:
+    """
+    Async version of get_thread_summary
+    """
+    cached = _summary_cache.get(thread_id, _NOT_CACHED)
+    if cached is not _NOT_CACHED:
+        return cached
+    async with get_async_db_connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(SELECT_THREAD_SUMMARY, (thread_id,))
+            result = await cur.fetchone()
+    _summary_cache.set(thread_id, result)
+    return result
+
+async def asave_thread_summary(thread_id: str, summary: str, summarized_until: datetime) -> dict:
+    """
+    Async version of save_thread_summary
+    """
+    async with get_async_db_connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(UPSERT_THREAD_SUMMARY, (thread_id, summary, summarized_until))
+            result = await cur.fetchone()
+        await conn.commit()
+    _summary_cache.set(thread_id, result)
+    return result
+
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    from app.db.migrations import migrate
+    migrate()
\ No newline at end of file
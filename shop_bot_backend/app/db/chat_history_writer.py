@@ -0,0 +1,248 @@
+import sys, os
+import queue
+import threading
+import time
+import logging
+from datetime import datetime, timedelta
+
+import psycopg
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, project_root)
+
+from app.db.connection import get_db_connection
+from app.utils.metrics import Counter, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+CHAT_HISTORY_WRITE_BEHIND = os.getenv('CHAT_HISTORY_WRITE_BEHIND', 'false').lower() == 'true'
+CHAT_HISTORY_BATCH_SIZE = int(os.getenv('CHAT_HISTORY_BATCH_SIZE', '200'))
+CHAT_HISTORY_FLUSH_INTERVAL_MS = int(os.getenv('CHAT_HISTORY_FLUSH_INTERVAL_MS', '200'))
+CHAT_HISTORY_QUEUE_SIZE = int(os.getenv('CHAT_HISTORY_QUEUE_SIZE', '10000'))
+CHAT_HISTORY_ENQUEUE_TIMEOUT = float(os.getenv('CHAT_HISTORY_ENQUEUE_TIMEOUT', '5'))
+# Failed writes of a batch before it is written one turn at a time, so a turn
+# the database rejects (a NUL byte, no partition for its month) is skipped
+# instead of holding up every turn behind it
+CHAT_HISTORY_MAX_ATTEMPTS = int(os.getenv('CHAT_HISTORY_MAX_ATTEMPTS', '3'))
+
+# How often the database clock is read again; in between it is followed with
+# the local monotonic clock
+CHAT_HISTORY_CLOCK_RESYNC = 300
+
+COPY_MESSAGES = "COPY message (id, thread_id, question, answer, created_at) FROM STDIN"
+# The value CURRENT_TIMESTAMP stores in a TIMESTAMP column, read now
+SELECT_DB_TIME = "SELECT clock_timestamp()::timestamp AS now"
+
+queue_depth = Gauge(
+    "chat_history_queue_depth",
+    "Chat turns waiting to be written by the write-behind writer"
+)
+flush_seconds = Histogram(
+    "chat_history_flush_seconds",
+    "Time to write one batch of chat turns"
+)
+flushed_messages = Counter(
+    "chat_history_flushed_messages_total",
+    "Chat turns written by the write-behind writer"
+)
+flush_errors = Counter(
+    "chat_history_flush_errors_total",
+    "Failed write-behind batch writes"
+)
+dropped_messages = Counter(
+    "chat_history_dropped_messages_total",
+    "Chat turns the database rejected, skipped by the write-behind writer"
+)
+
+class ChatHistoryWriter:
+    """
+    Write-behind persistence for chat turns.
+
+    Turns are queued in memory and written by a background thread with one
+    COPY per batch, flushed when CHAT_HISTORY_BATCH_SIZE turns are waiting or
+    CHAT_HISTORY_FLUSH_INTERVAL_MS has passed. The queue is bounded: when the
+    database falls behind, submit() blocks the caller (backpressure) and
+    finally writes the turn itself if the queue stays full. A batch that fails
+    CHAT_HISTORY_MAX_ATTEMPTS times is written one turn at a time; turns the
+    database still rejects are logged and skipped.
+
+    Turns are stamped with now(), which follows the database clock, so they
+    sort and fall into partitions like turns inserted directly.
+    """
+
+    def __init__(
+        self,
+        batch_size: int = CHAT_HISTORY_BATCH_SIZE,
+        flush_interval: float = CHAT_HISTORY_FLUSH_INTERVAL_MS / 1000,
+        max_queue_size: int = CHAT_HISTORY_QUEUE_SIZE,
+        enqueue_timeout: float = CHAT_HISTORY_ENQUEUE_TIMEOUT,
+        max_attempts: int = CHAT_HISTORY_MAX_ATTEMPTS,
+    ):
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.flush_interval = flush_interval
+        self.enqueue_timeout = enqueue_timeout
+        self._queue: queue.Queue[dict] = queue.Queue(maxsize=max_queue_size)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="chat-history-writer", daemon=True)
+        # (database time, monotonic time) of the last clock read
+        self._clock: tuple[datetime, float] | None = None
+
+    def start(self):
+        self._sync_clock()
+        self._thread.start()
+
+    def now(self) -> datetime:
+        """
+        Current time on the database clock, as the created_at default would store it
+        """
+        db_time, anchor = self._clock
+        return db_time + timedelta(seconds=time.monotonic() - anchor)
+
+    def _sync_clock(self):
+        with get_db_connection() as conn:
+            db_time = conn.execute(SELECT_DB_TIME).fetchone()['now']
+        self._clock = (db_time, time.monotonic())
+
+    def stop(self, timeout: float = 30):
+        """
+        Stop the background thread after it has flushed everything still queued
+        """
+        self._stop.set()
+        self._thread.join(timeout=timeout)
+        if self._thread.is_alive():
+            logger.error(f"Chat history writer did not stop, {self._queue.qsize()} turns not flushed")
+
+    def submit(self, message: dict):
+        """
+        Queue a turn for writing, blocking while the queue is full
+
+        Args:
+            message (dict): id, thread_id, question, answer and created_at of the turn
+        """
+        try:
+            self._queue.put(message, timeout=self.enqueue_timeout)
+        except queue.Full:
+            logger.warning("Chat history queue full, writing turn synchronously")
+            self._write([message])
+        queue_depth.set(self._queue.qsize())
+
+    def try_submit(self, message: dict) -> bool:
+        """
+        Queue a turn without blocking
+
+        Returns:
+            bool: False if the queue is full
+        """
+        try:
+            self._queue.put_nowait(message)
+        except queue.Full:
+            return False
+        queue_depth.set(self._queue.qsize())
+        return True
+
+    def _next_batch(self) -> list[dict]:
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch: list[dict]):
+        with flush_seconds.time():
+            with get_db_connection() as conn:
+                with conn.cursor() as cur:
+                    with cur.copy(COPY_MESSAGES) as copy:
+                        for message in batch:
+                            copy.write_row((
+                                message['id'],
+                                message['thread_id'],
+                                message['question'],
+                                message['answer'],
+                                message['created_at'],
+                            ))
+                conn.commit()
+        flushed_messages.inc(len(batch))
+
+    def _write_each(self, batch: list[dict]) -> list[dict]:
+        """
+        Write a batch one turn at a time, skipping the turns the database rejects
+
+        Returns:
+            list[dict]: Turns not written because the database could not be reached
+        """
+        for index, message in enumerate(batch):
+            try:
+                self._write([message])
+            except psycopg.OperationalError:
+                # Connection lost or pool exhausted, not a bad turn: retry later
+                return batch[index:]
+            except Exception as e:
+                dropped_messages.inc()
+                logger.error(f"Dropping chat turn {message['id']} of thread {message['thread_id']}: {e}")
+        return []
+
+    def _run(self):
+        batch: list[dict] = []
+        attempts = 0
+        while not (self._stop.is_set() and self._queue.empty() and not batch):
+            if time.monotonic() - self._clock[1] >= CHAT_HISTORY_CLOCK_RESYNC:
+                try:
+                    self._sync_clock()
+                except Exception as e:
+                    # Keep following the last reading; retried on the next pass
+                    logger.warning(f"Error reading the database clock: {e}")
+            if not batch:
+                batch = self._next_batch()
+                queue_depth.set(self._queue.qsize())
+                if not batch:
+                    continue
+            try:
+                self._write(batch)
+                batch, attempts = [], 0
+            except Exception as e:
+                # Keep the batch and retry; the bounded queue pushes back on callers meanwhile
+                flush_errors.inc()
+                attempts += 1
+                logger.error(f"Error flushing {len(batch)} chat turns: {e}")
+                if attempts >= self.max_attempts or self._stop.is_set():
+                    batch, attempts = self._write_each(batch), 0
+                    if not batch:
+                        continue
+                if self._stop.is_set():
+                    logger.error(f"Dropping {len(batch) + self._queue.qsize()} chat turns on shutdown")
+                    return
+                self._stop.wait(1)
+
+_writer: ChatHistoryWriter | None = None
+
+def get_chat_history_writer() -> ChatHistoryWriter | None:
+    """
+    Get the running write-behind writer, or None when turns are written synchronously
+    """
+    return _writer
+
+def start_chat_history_writer():
+    """
+    Start the write-behind writer if CHAT_HISTORY_WRITE_BEHIND is enabled
+    """
+    global _writer
+    if CHAT_HISTORY_WRITE_BEHIND and _writer is None:
+        _writer = ChatHistoryWriter()
+        _writer.start()
+        logger.info("Chat history write-behind enabled")
+
+def stop_chat_history_writer():
+    """
+    Flush queued turns and stop the write-behind writer
+    """
+    global _writer
+    if _writer is not None:
+        writer, _writer = _writer, None
+        writer.stop()
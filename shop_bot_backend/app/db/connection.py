@@ -0,0 +1,232 @@
+import os
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from psycopg import Cursor, AsyncCursor
+from psycopg.conninfo import make_conninfo
+from psycopg.rows import dict_row
+from psycopg_pool import ConnectionPool, AsyncConnectionPool
+from dotenv import load_dotenv
+
+from app.utils.metrics import Counter
+
+load_dotenv(override=True)
+
+DB_NAME = os.getenv('DB_NAME')
+DB_USERNAME = os.getenv('DB_USERNAME')
+DB_PASSWORD = os.getenv('DB_PASSWORD')
+DB_HOST = os.getenv('DB_HOST')
+DB_PORT = os.getenv('DB_PORT')
+
+DB_POOL_MIN_SIZE = int(os.getenv('DB_POOL_MIN_SIZE', '2'))
+DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', '10'))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '30'))
+DB_POOL_MAX_IDLE = float(os.getenv('DB_POOL_MAX_IDLE', '300'))
+DB_POOL_MAX_LIFETIME = float(os.getenv('DB_POOL_MAX_LIFETIME', '3600'))
+
+logger = logging.getLogger(__name__)
+
+db_queries = Counter(
+    "db_queries_total",
+    "SQL statements (including COPY) sent to PostgreSQL through the shared pools"
+)
+
+class CountingCursor(Cursor):
+    """
+    Cursor that counts the statements it runs in db_queries_total
+    """
+
+    def execute(self, query, params=None, **kwargs):
+        # The pool's connection check runs an empty query on every checkout
+        if query:
+            db_queries.inc()
+        return super().execute(query, params, **kwargs)
+
+    def executemany(self, query, params_seq, **kwargs):
+        db_queries.inc()
+        return super().executemany(query, params_seq, **kwargs)
+
+    def copy(self, statement, params=None, **kwargs):
+        db_queries.inc()
+        return super().copy(statement, params, **kwargs)
+
+class AsyncCountingCursor(AsyncCursor):
+    """
+    Async version of CountingCursor
+    """
+
+    async def execute(self, query, params=None, **kwargs):
+        if query:
+            db_queries.inc()
+        return await super().execute(query, params, **kwargs)
+
+    async def executemany(self, query, params_seq, **kwargs):
+        db_queries.inc()
+        return await super().executemany(query, params_seq, **kwargs)
+
+    def copy(self, statement, params=None, **kwargs):
+        db_queries.inc()
+        return super().copy(statement, params, **kwargs)
+
+_pool: ConnectionPool | None = None
+_async_pool: AsyncConnectionPool | None = None
+_async_pool_lock = asyncio.Lock()
+
+def get_conninfo() -> str:
+    """
+    Build the libpq connection string from the DB_* environment variables
+    """
+    params = {
+        "dbname": DB_NAME,
+        "user": DB_USERNAME,
+        "password": DB_PASSWORD,
+        "host": DB_HOST,
+        "port": DB_PORT,
+    }
+    return make_conninfo(**{key: value for key, value in params.items() if value})
+
+def init_db_pool() -> ConnectionPool:
+    """
+    Create and open the shared connection pool if it does not exist yet
+
+    The pool is created once at application startup (see main.py) and shared by
+    all app/db/*_service modules. Scripts that never call this explicitly get the
+    pool lazily on their first query.
+
+    Returns:
+        ConnectionPool: The process-wide connection pool
+
+    Raises:
+        RuntimeError: If the pool cannot connect to PostgreSQL
+    """
+    global _pool
+    if _pool is None:
+        pool = ConnectionPool(
+            conninfo=get_conninfo(),
+            kwargs={"row_factory": dict_row, "cursor_factory": CountingCursor},
+            min_size=DB_POOL_MIN_SIZE,
+            max_size=DB_POOL_MAX_SIZE,
+            timeout=DB_POOL_TIMEOUT,
+            max_idle=DB_POOL_MAX_IDLE,
+            max_lifetime=DB_POOL_MAX_LIFETIME,
+            check=ConnectionPool.check_connection,
+            name="shop_bot",
+            open=False,
+        )
+        try:
+            pool.open(wait=True, timeout=DB_POOL_TIMEOUT)
+        except Exception as e:
+            pool.close()
+            raise RuntimeError(f"Error connecting to PostgreSQL: {e}")
+        logger.info(f"Database pool opened (min_size={DB_POOL_MIN_SIZE}, max_size={DB_POOL_MAX_SIZE})")
+        _pool = pool
+    return _pool
+
+def close_db_pool():
+    """
+    Close the shared connection pool, waiting for checked-out connections to return
+    """
+    global _pool
+    if _pool is not None:
+        _pool.close()
+        _pool = None
+        logger.info("Database pool closed")
+
+def get_db_connection():
+    """
+    Borrow a connection from the shared pool
+
+    Use as a context manager: the connection is returned to the pool on exit,
+    committed if the block succeeded and rolled back if it raised.
+
+    Returns:
+        ContextManager[Connection]: Pooled connection to PostgreSQL database
+    """
+    return init_db_pool().connection()
+
+async def init_async_db_pool() -> AsyncConnectionPool:
+    """
+    Create and open the shared async connection pool if it does not exist yet
+
+    The async pool is used by the a*-prefixed service functions called from the
+    FastAPI event loop. It must be opened from inside a running event loop.
+
+    Returns:
+        AsyncConnectionPool: The process-wide async connection pool
+
+    Raises:
+        RuntimeError: If the pool cannot connect to PostgreSQL
+    """
+    global _async_pool
+    if _async_pool is not None:
+        return _async_pool
+    async with _async_pool_lock:
+        if _async_pool is None:
+            pool = AsyncConnectionPool(
+                conninfo=get_conninfo(),
+                kwargs={"row_factory": dict_row, "cursor_factory": AsyncCountingCursor},
+                min_size=DB_POOL_MIN_SIZE,
+                max_size=DB_POOL_MAX_SIZE,
+                timeout=DB_POOL_TIMEOUT,
+                max_idle=DB_POOL_MAX_IDLE,
+                max_lifetime=DB_POOL_MAX_LIFETIME,
+                check=AsyncConnectionPool.check_connection,
+                name="shop_bot_async",
+                open=False,
+            )
+            try:
+                await pool.open(wait=True, timeout=DB_POOL_TIMEOUT)
+            except Exception as e:
+                await pool.close()
+                raise RuntimeError(f"Error connecting to PostgreSQL: {e}")
+            logger.info(f"Async database pool opened (min_size={DB_POOL_MIN_SIZE}, max_size={DB_POOL_MAX_SIZE})")
+            _async_pool = pool
+    return _async_pool
+
+async def close_async_db_pool():
+    """
+    Close the shared async connection pool
+    """
+    global _async_pool
+    if _async_pool is not None:
+        await _async_pool.close()
+        _async_pool = None
+        logger.info("Async database pool closed")
+
+@asynccontextmanager
+async def get_async_db_connection():
+    """
+    Borrow a connection from the shared async pool
+
+    Use as an async context manager, with the same commit/rollback semantics
+    as get_db_connection.
+
+    Yields:
+        AsyncConnection: Pooled async connection to PostgreSQL database
+    """
+    pool = await init_async_db_pool()
+    async with pool.connection() as conn:
+        yield conn
+
+def _pool_stats(pool) -> dict:
+    stats = pool.get_stats()
+    requests_num = stats.get("requests_num", 0)
+    stats["requests_avg_wait_ms"] = (
+        stats.get("requests_wait_ms", 0) / requests_num if requests_num else 0.0
+    )
+    return stats
+
+def get_db_pool_stats() -> dict:
+    """
+    Get pool-level statistics for every open pool
+
+    Returns:
+        dict: Pool name mapped to its size, idle and waiting clients, cumulative
+              checkout counters (see psycopg_pool's get_stats) and the average
+              checkout latency in milliseconds
+    """
+    return {
+        pool.name: _pool_stats(pool)
+        for pool in (_pool, _async_pool)
+        if pool is not None
+    }
@@ -0,0 +1,389 @@
+import sys, os
+import argparse
+import gzip
+import logging
+import re
+import tempfile
+import threading
+from datetime import date
+
+import psycopg
+from psycopg.rows import dict_row
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, project_root)
+
+from app.db.connection import get_db_connection, get_conninfo
+
+logger = logging.getLogger(__name__)
+
+# Months of chat history kept in the database besides the current one; older
+# monthly partitions of message are archived to MESSAGE_ARCHIVE_DIR and dropped.
+# 0 keeps everything.
+MESSAGE_RETENTION_MONTHS = int(os.getenv('MESSAGE_RETENTION_MONTHS', '12'))
+MESSAGE_ARCHIVE_DIR = os.getenv('MESSAGE_ARCHIVE_DIR', os.path.join(project_root, 'archive', 'messages'))
+# Partitions are created this many months ahead, so a maintenance run that
+# fails or a worker that is down at the turn of a month loses no turns
+MESSAGE_PARTITIONS_AHEAD = int(os.getenv('MESSAGE_PARTITIONS_AHEAD', '3'))
+MESSAGE_MAINTENANCE_INTERVAL = float(os.getenv('MESSAGE_MAINTENANCE_INTERVAL', '3600'))
+
+# Key of the advisory lock that lets one process at a time maintain partitions
+MESSAGE_MAINTENANCE_LOCK_KEY = 0x73686F705F6D7367  # "shop_msg"
+
+# Creating or detaching a partition locks message; give up rather than queue
+# every chat history write behind a long running query
+PARTITION_LOCK_TIMEOUT = "5s"
+
+PARTITION_NAME = re.compile(r"^message_(\d{4})_(\d{2})$")
+ARCHIVE_NAME = re.compile(r"^(message_\d{4}_\d{2})\.tsv\.gz$")
+MESSAGE_COLUMNS = "id, thread_id, question, answer, created_at"
+
+_maintenance_stop = threading.Event()
+_maintenance_thread: threading.Thread | None = None
+
+CREATE_PARTITIONS = """
+    SELECT create_message_partition(
+        (date_trunc('month', LOCALTIMESTAMP) + make_interval(months => i))::date
+    ) AS created
+    FROM generate_series(0, %s) AS i
+"""
+
+# Attached partitions and tables left detached by an interrupted archive run
+SELECT_PARTITIONS = """
+    SELECT
+        c.relname AS name,
+        to_date(substr(c.relname, 9), 'YYYY_MM') AS month,
+        i.inhrelid IS NOT NULL AS attached,
+        GREATEST(c.reltuples, 0)::bigint AS estimated_rows,
+        pg_table_size(c.oid) AS table_bytes,
+        pg_indexes_size(c.oid) AS index_bytes
+    FROM pg_class c
+    LEFT JOIN pg_inherits i ON i.inhrelid = c.oid AND i.inhparent = 'message'::regclass
+    WHERE c.relkind = 'r'
+      AND c.relname ~ '^message_[0-9]{4}_[0-9]{2}$'
+      AND pg_table_is_visible(c.oid)
+    ORDER BY c.relname
+"""
+
+# Partitions whose whole month is older than the retention period
+SELECT_EXPIRED_PARTITIONS = f"""
+    SELECT name FROM ({SELECT_PARTITIONS}) AS partitions
+    WHERE NOT attached
+       OR month + interval '1 month' <= date_trunc('month', LOCALTIMESTAMP) - make_interval(months => %s)
+"""
+
+def _partition_month(name: str) -> date:
+    match = PARTITION_NAME.match(name)
+    if match is None:
+        raise ValueError(f"{name} is not a message partition")
+    return date(int(match[1]), int(match[2]), 1)
+
+def _archive_path(name: str, archive_dir: str) -> str:
+    return os.path.join(archive_dir, f"{name}.tsv.gz")
+
+def _connect():
+    # DETACH ... CONCURRENTLY cannot run in a transaction block, so
+    # maintenance uses its own autocommit connection rather than the pool
+    return psycopg.connect(get_conninfo(), row_factory=dict_row, autocommit=True)
+
+def ensure_message_partitions(months_ahead: int = MESSAGE_PARTITIONS_AHEAD) -> list[str]:
+    """
+    Create the partitions of message for the current month and the months ahead
+
+    Args:
+        months_ahead (int): Number of months after the current one to create
+
+    Returns:
+        list[str]: Partitions created by this call
+    """
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(f"SET LOCAL lock_timeout = '{PARTITION_LOCK_TIMEOUT}'")
+            cur.execute(CREATE_PARTITIONS, (months_ahead,))
+            created = [row["created"] for row in cur.fetchall() if row["created"]]
+        conn.commit()
+    for name in created:
+        logger.info(f"Created message partition {name}")
+    return created
+
+def list_message_partitions() -> list[dict]:
+    """
+    List the monthly partitions of message
+
+    Returns:
+        list[dict]: name, month, attached, estimated_rows, table_bytes and
+                    index_bytes of each partition, oldest first
+    """
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(SELECT_PARTITIONS)
+            return cur.fetchall()
+
+def archive_message_partition(name: str, archive_dir: str = MESSAGE_ARCHIVE_DIR) -> str:
+    """
+    Detach a monthly partition of message, write it to a gzipped COPY file and drop it
+
+    The partition is only dropped once the file is complete and holds every
+    row; if anything fails it stays as a detached table that the next call
+    (or apply_message_retention) picks up again.
+
+    Args:
+        name (str): Partition name, message_YYYY_MM
+        archive_dir (str): Directory of the archive files
+
+    Returns:
+        str: Path of the archive file
+
+    Raises:
+        ValueError: If name is not a partition of a past month
+    """
+    month = _partition_month(name)
+    os.makedirs(archive_dir, exist_ok=True)
+    path = _archive_path(name, archive_dir)
+    with _connect() as conn:
+        # The database clock decides the month, as for creating and expiring partitions
+        current = conn.execute(
+            "SELECT date_trunc('month', LOCALTIMESTAMP)::date AS month"
+        ).fetchone()["month"]
+        if month >= current:
+            raise ValueError(f"{name} is not a past month, chat history is still written to it")
+        attached = conn.execute(
+            """
+            SELECT inhdetachpending AS pending FROM pg_inherits
+            WHERE inhrelid = to_regclass(%s) AND inhparent = 'message'::regclass
+            """,
+            (name,)
+        ).fetchone()
+        if attached:
+            conn.execute(f"SET lock_timeout = '{PARTITION_LOCK_TIMEOUT}'")
+            # A concurrent detach that was interrupted can only be finished
+            mode = "FINALIZE" if attached["pending"] else "CONCURRENTLY"
+            conn.execute(f"ALTER TABLE message DETACH PARTITION {name} {mode}")
+            conn.execute("RESET lock_timeout")
+        expected = conn.execute(f"SELECT count(*) AS n FROM {name}").fetchone()["n"]
+
+        # A unique temp file: a second archive run of the same partition
+        # must not truncate the file this one is writing
+        with tempfile.NamedTemporaryFile(dir=archive_dir, prefix=f"{name}.", suffix=".tmp", delete=False) as raw:
+            tmp_path = raw.name
+            try:
+                with gzip.GzipFile(fileobj=raw, mode="wb") as out:
+                    with conn.cursor().copy(f"COPY {name} ({MESSAGE_COLUMNS}) TO STDOUT") as copy:
+                        for data in copy:
+                            out.write(data)
+                raw.flush()
+                os.fsync(raw.fileno())
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        try:
+            # Count what is in the file, not what was sent: the table is only
+            # dropped once its rows can be read back. Text format escapes
+            # newlines inside values, one line per row
+            written = 0
+            with gzip.open(tmp_path, "rb") as archive:
+                while data := archive.read(1 << 20):
+                    written += data.count(b"\n")
+            if written != expected:
+                raise RuntimeError(f"Archived {written} of the {expected} rows of {name}, keeping the table")
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+        conn.execute(f"DROP TABLE {name}")
+    logger.info(f"Archived {expected} messages of {name} to {path}")
+    return path
+
+def apply_message_retention(
+    retention_months: int = MESSAGE_RETENTION_MONTHS,
+    archive_dir: str = MESSAGE_ARCHIVE_DIR,
+) -> list[str]:
+    """
+    Archive the partitions of message older than the retention period
+
+    Args:
+        retention_months (int): Months kept besides the current one, 0 keeps everything
+        archive_dir (str): Directory of the archive files
+
+    Returns:
+        list[str]: Paths of the archive files written
+    """
+    if retention_months <= 0:
+        return []
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(SELECT_EXPIRED_PARTITIONS, (retention_months,))
+            expired = [row["name"] for row in cur.fetchall()]
+    return [archive_message_partition(name, archive_dir) for name in expired]
+
+def restore_message_archive(path: str) -> int:
+    """
+    Load an archive file written by archive_message_partition back into message
+
+    The partition of its month is re-created if needed, then filled in one
+    transaction: a file that does not load completely restores nothing. Only
+    an attached, empty partition is filled; a table left detached by an
+    interrupted archive run must be archived (or dropped) first.
+    A restored month older than MESSAGE_RETENTION_MONTHS is archived again by
+    the next retention run; raise the retention to keep it.
+
+    Args:
+        path (str): Path of a message_YYYY_MM.tsv.gz file
+
+    Returns:
+        int: Number of messages restored
+
+    Raises:
+        ValueError: If the file name is not one of an archive, or the partition
+                    is detached or already holds messages
+    """
+    match = ARCHIVE_NAME.match(os.path.basename(path))
+    if match is None:
+        raise ValueError(f"{path} is not a message archive (message_YYYY_MM.tsv.gz)")
+    name = match[1]
+    month = _partition_month(name)
+    restored = 0
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(f"SET LOCAL lock_timeout = '{PARTITION_LOCK_TIMEOUT}'")
+            cur.execute("SELECT create_message_partition(%s)", (month,))
+        # Committed before the load and loaded into the partition rather than
+        # message, so message is only locked while the partition is created
+        conn.commit()
+        with conn.cursor() as cur:
+            # create_message_partition leaves an existing table of that name as it is
+            cur.execute(
+                """
+                SELECT 1 FROM pg_inherits
+                WHERE inhrelid = to_regclass(%s) AND inhparent = 'message'::regclass AND NOT inhdetachpending
+                """,
+                (name,)
+            )
+            if cur.fetchone() is None:
+                raise ValueError(
+                    f"{name} exists but is not attached to message, left by an interrupted archive run: "
+                    f"finish it with --archive {name} (or drop the table) before restoring"
+                )
+            cur.execute(f"SELECT EXISTS (SELECT 1 FROM {name}) AS filled")
+            if cur.fetchone()["filled"]:
+                raise ValueError(f"{name} already holds messages, restoring {path} would load them twice")
+            with gzip.open(path, "rb") as archive:
+                with cur.copy(f"COPY {name} ({MESSAGE_COLUMNS}) FROM STDIN") as copy:
+                    while data := archive.read(1 << 20):
+                        restored += data.count(b"\n")
+                        copy.write(data)
+        conn.commit()
+    logger.info(f"Restored {restored} messages of {name} from {path}")
+    return restored
+
+def _try_maintenance_lock(conn: psycopg.Connection) -> bool:
+    return conn.execute(
+        "SELECT pg_try_advisory_lock(%s) AS locked", (MESSAGE_MAINTENANCE_LOCK_KEY,)
+    ).fetchone()["locked"]
+
+def _release_maintenance_lock(conn: psycopg.Connection):
+    conn.execute("SELECT pg_advisory_unlock(%s)", (MESSAGE_MAINTENANCE_LOCK_KEY,))
+
+def maintain_message_partitions(
+    retention_months: int = MESSAGE_RETENTION_MONTHS,
+    archive_dir: str = MESSAGE_ARCHIVE_DIR,
+) -> tuple[list[str], list[str]] | None:
+    """
+    Create upcoming partitions and archive expired ones, unless another process is doing it
+
+    Args:
+        retention_months (int): Months kept besides the current one, 0 keeps everything
+        archive_dir (str): Directory of the archive files
+
+    Returns:
+        tuple[list[str], list[str]] | None: Partitions created and archive files
+        written, None if another process holds the maintenance lock
+    """
+    with _connect() as conn:
+        if not _try_maintenance_lock(conn):
+            return None
+        try:
+            return ensure_message_partitions(), apply_message_retention(retention_months, archive_dir)
+        finally:
+            _release_maintenance_lock(conn)
+
+def _run_message_maintenance():
+    # First run right away: a worker started late in a month must not wait
+    # an interval before the next month's partition exists
+    while True:
+        try:
+            maintain_message_partitions()
+        except Exception as e:
+            logger.error(f"Error maintaining message partitions: {e}")
+        if _maintenance_stop.wait(MESSAGE_MAINTENANCE_INTERVAL):
+            return
+
+def start_message_maintenance():
+    """
+    Start the background thread that creates and archives message partitions
+    """
+    global _maintenance_thread
+    if _maintenance_thread is not None and _maintenance_thread.is_alive():
+        return
+    _maintenance_stop.clear()
+    _maintenance_thread = threading.Thread(target=_run_message_maintenance, name="message-maintenance", daemon=True)
+    _maintenance_thread.start()
+
+def stop_message_maintenance():
+    """
+    Stop the message partition maintenance thread
+    """
+    global _maintenance_thread
+    _maintenance_stop.set()
+    if _maintenance_thread is not None:
+        _maintenance_thread.join(timeout=5)
+        _maintenance_thread = None
+
+def _format_bytes(size: int) -> str:
+    for unit in ("B", "kB", "MB", "GB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Maintain the monthly partitions of the message table")
+    parser.add_argument("--maintain", action="store_true",
+                        help="Create upcoming partitions and archive the ones older than the retention")
+    parser.add_argument("--archive", metavar="PARTITION", help="Archive one partition, e.g. message_2025_01")
+    parser.add_argument("--restore", metavar="FILE", help="Load an archive file back into message")
+    parser.add_argument("--retention-months", type=int, default=MESSAGE_RETENTION_MONTHS)
+    parser.add_argument("--archive-dir", default=MESSAGE_ARCHIVE_DIR)
+    args = parser.parse_args()
+
+    if args.maintain:
+        result = maintain_message_partitions(args.retention_months, args.archive_dir)
+        if result is None:
+            sys.exit("Another process is maintaining the message partitions, try again later")
+        created, archived = result
+        for name in created:
+            print(f"Created {name}")
+        for path in archived:
+            print(f"Archived {path}")
+    elif args.archive:
+        # Same lock as the maintenance runs, which may be archiving this partition
+        with _connect() as conn:
+            if not _try_maintenance_lock(conn):
+                sys.exit("Another process is maintaining the message partitions, try again later")
+            try:
+                print(f"Archived {archive_message_partition(args.archive, args.archive_dir)}")
+            finally:
+                _release_maintenance_lock(conn)
+    elif args.restore:
+        print(f"Restored {restore_message_archive(args.restore)} messages")
+
+    for partition in list_message_partitions():
+        state = "attached" if partition["attached"] else "detached"
+        print(f"{partition['name']}  {state:8}  ~{partition['estimated_rows']:>10} rows"
+              f"  table {_format_bytes(partition['table_bytes']):>8}"
+              f"  indexes {_format_bytes(partition['index_bytes']):>8}")
+
+if __name__ == '__main__':
+    main()
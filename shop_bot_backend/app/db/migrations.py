@@ -0,0 +1,1388 @@
+import sys, os
+import argparse
+import logging
+from dataclasses import dataclass
+
+import psycopg
+from psycopg.rows import dict_row
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, project_root)
+
+from app.db.connection import get_db_connection, get_conninfo
+from app.db.product_service import CATALOG_CHANNEL, BULK_LOAD_SETTING
+
+logger = logging.getLogger(__name__)
+
+# Apply pending migrations at startup instead of requiring the CLI; handy for
+# a single local worker, not meant for deployments that start many at once
+DB_MIGRATE_ON_STARTUP = os.getenv('DB_MIGRATE_ON_STARTUP', 'false').lower() == 'true'
+
+# Key of the advisory lock that lets one process at a time migrate
+MIGRATION_LOCK_KEY = 0x73686F705F6D6967  # "shop_mig"
+
+CREATE_SCHEMA_VERSION = """
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+"""
+
+@dataclass(frozen=True)
+class Migration:
+    """
+    One step of the schema; statements run in a single transaction.
+
+    Applied migrations must never be edited: change the schema by appending
+    a new migration to MIGRATIONS.
+    """
+    version: int
+    name: str
+    statements: tuple[str, ...]
+
+# The schema as it was created by the old init_*_table functions. Everything
+# is IF NOT EXISTS / OR REPLACE so databases created by them adopt it as is.
+BASELINE = (
+    """
+    CREATE TABLE IF NOT EXISTS product (
+        id SERIAL PRIMARY KEY,
+        name VARCHAR(255) NOT NULL,
+        description TEXT,
+        price DECIMAL(10, 2) NOT NULL,
+        stock INTEGER NOT NULL DEFAULT 0,
+        specifications JSONB,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    # Bulk imports upsert by name. Catalogs created before the index may hold
+    # duplicate names; stop with the list of them instead of a bare unique
+    # violation, and leave merging them (orders point at the ids) to a human
+    """
+    DO $$
+    DECLARE
+        v_duplicates TEXT;
+    BEGIN
+        IF to_regclass('idx_product_name') IS NOT NULL THEN
+            RETURN;
+        END IF;
+        SELECT string_agg(format('%L (ids %s)', d.name, d.ids), ', ') INTO v_duplicates
+        FROM (
+            SELECT name, array_to_string(array_agg(id ORDER BY id), ', ') AS ids
+            FROM product
+            GROUP BY name
+            HAVING count(*) > 1
+            ORDER BY name
+            LIMIT 20
+        ) d;
+        IF v_duplicates IS NOT NULL THEN
+            RAISE EXCEPTION 'Product names must be unique before idx_product_name can be created; duplicates: %', v_duplicates
+                USING HINT = 'Rename the duplicates, or move their orders and stock to one id and delete the others, '
+                             'then run the migrations again. All of them: '
+                             'SELECT name, array_agg(id) FROM product GROUP BY name HAVING count(*) > 1';
+        END IF;
+    END $$
+    """,
+    "CREATE UNIQUE INDEX IF NOT EXISTS idx_product_name ON product (name)",
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE EXTENSION IF NOT EXISTS unaccent",
+    # unaccent() is only STABLE, so wrap it to be usable in an index expression
+    """
+    CREATE OR REPLACE FUNCTION immutable_unaccent(text)
+    RETURNS text
+    LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT
+    AS $$ SELECT public.unaccent('public.unaccent'::regdictionary, $1) $$
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_product_name_trgm
+    ON product USING gin (immutable_unaccent(lower(name)) gin_trgm_ops)
+    """,
+    # Tell every worker's catalog cache about changes, whoever made them
+    f"""
+    CREATE OR REPLACE FUNCTION notify_product_changed()
+    RETURNS trigger
+    LANGUAGE plpgsql AS $$
+    BEGIN
+        IF current_setting('{BULK_LOAD_SETTING}', true) = 'on' THEN
+            RETURN NULL;
+        END IF;
+        IF TG_LEVEL = 'ROW' THEN
+            PERFORM pg_notify('{CATALOG_CHANNEL}', COALESCE(NEW.id, OLD.id)::text);
+        ELSE
+            PERFORM pg_notify('{CATALOG_CHANNEL}', '');
+        END IF;
+        RETURN NULL;
+    END
+    $$
+    """,
+    """
+    CREATE OR REPLACE TRIGGER product_changed_row
+    AFTER UPDATE OR DELETE ON product
+    FOR EACH ROW EXECUTE FUNCTION notify_product_changed()
+    """,
+    """
+    CREATE OR REPLACE TRIGGER product_changed_statement
+    AFTER INSERT OR TRUNCATE ON product
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_product_changed()
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS user_wallet (
+        id SERIAL PRIMARY KEY,
+        user_id VARCHAR(255) NOT NULL UNIQUE,
+        balance DECIMAL(15,2) NOT NULL DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS "order" (
+        id SERIAL PRIMARY KEY,
+        user_id VARCHAR(255) NOT NULL,
+        product_id INTEGER NOT NULL REFERENCES product(id),
+        quantity INTEGER NOT NULL,
+        total_amount DECIMAL(10,2) NOT NULL,
+        status VARCHAR(50) NOT NULL DEFAULT 'pending',
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    # Stock decrement, wallet debit and order insert in one transaction.
+    # The product row is locked before the wallet row so concurrent
+    # orders always take locks in the same order and cannot deadlock.
+    """
+    CREATE OR REPLACE FUNCTION place_order(
+        p_user_id VARCHAR,
+        p_product_id INTEGER,
+        p_quantity INTEGER,
+        p_total_amount DECIMAL
+    )
+    RETURNS TABLE (
+        result TEXT,
+        wallet_balance DECIMAL,
+        order_id INTEGER,
+        order_status VARCHAR,
+        order_created_at TIMESTAMP
+    )
+    LANGUAGE plpgsql AS $$
+    DECLARE
+        v_stock INTEGER;
+    BEGIN
+        IF p_quantity <= 0 OR p_total_amount < 0 THEN
+            result := 'invalid_order';
+            RETURN NEXT;
+            RETURN;
+        END IF;
+
+        SELECT p.stock INTO v_stock
+        FROM product p
+        WHERE p.id = p_product_id
+        FOR UPDATE;
+        IF v_stock IS NULL OR v_stock < p_quantity THEN
+            result := 'insufficient_stock';
+            RETURN NEXT;
+            RETURN;
+        END IF;
+
+        SELECT w.balance INTO wallet_balance
+        FROM user_wallet w
+        WHERE w.user_id = p_user_id
+        FOR UPDATE;
+        IF NOT FOUND THEN
+            result := 'wallet_not_found';
+            RETURN NEXT;
+            RETURN;
+        END IF;
+        IF wallet_balance < p_total_amount THEN
+            result := 'insufficient_balance';
+            RETURN NEXT;
+            RETURN;
+        END IF;
+
+        UPDATE product
+        SET stock = stock - p_quantity,
+            updated_at = CURRENT_TIMESTAMP
+        WHERE id = p_product_id;
+
+        UPDATE user_wallet
+        SET balance = balance - p_total_amount,
+            updated_at = CURRENT_TIMESTAMP
+        WHERE user_id = p_user_id
+        RETURNING balance INTO wallet_balance;
+
+        INSERT INTO "order" (user_id, product_id, quantity, total_amount)
+        VALUES (p_user_id, p_product_id, p_quantity, p_total_amount)
+        RETURNING id, status, created_at
+        INTO order_id, order_status, order_created_at;
+
+        result := 'ok';
+        RETURN NEXT;
+    END
+    $$
+    """,
+    'CREATE EXTENSION IF NOT EXISTS "uuid-ossp"',
+    """
+    CREATE TABLE IF NOT EXISTS message (
+        id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+        thread_id VARCHAR(255) NOT NULL,
+        question TEXT NOT NULL,
+        answer TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    # Serves "latest N messages of a thread" without sorting the thread
+    """
+    CREATE INDEX IF NOT EXISTS idx_message_thread_created
+    ON message (thread_id, created_at DESC)
+    """,
+    "DROP INDEX IF EXISTS idx_message_thread_id",
+    # Rolling summary of the turns folded out of the prompt
+    """
+    CREATE TABLE IF NOT EXISTS thread_summary (
+        thread_id VARCHAR(255) PRIMARY KEY,
+        summary TEXT NOT NULL,
+        summarized_until TIMESTAMP NOT NULL,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+)
+
+# Wallet changes as appended rows instead of updates of one user_wallet row.
+# user_wallet.balance becomes a snapshot that includes every ledger entry up
+# to ledger_id; the balance is the snapshot plus the entries after it, and
+# wallet_compact() folds those entries into the snapshot.
+#
+# Two advisory locks per wallet (two-key form, keyed by hashtext(user_id)):
+#   21572 ("TD") exclusive per debit, so each debit sees the debits before
+#         it and the overdraft check holds; credits never take it
+#   21580 ("TL") shared by every transaction that appends entries, taken
+#         exclusively by wallet_compact() so no entry below the new
+#         watermark can still be uncommitted when it moves. Debits take it
+#         after 21572, so debits queued behind each other do not hold up
+#         compaction.
+# wallet_ledger.user_id has no foreign key: the check would lock the hot
+# user_wallet row on every insert. The functions refuse unknown wallets.
+WALLET_LEDGER = (
+    "ALTER TABLE user_wallet ADD COLUMN IF NOT EXISTS ledger_id BIGINT NOT NULL DEFAULT 0",
+    """
+    CREATE TABLE IF NOT EXISTS wallet_ledger (
+        id BIGSERIAL PRIMARY KEY,
+        user_id VARCHAR(255) NOT NULL,
+        amount DECIMAL(15, 2) NOT NULL,
+        reason VARCHAR(50) NOT NULL,
+        order_id INTEGER REFERENCES "order" (id) ON DELETE SET NULL,
+        created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    # Entries after a wallet's watermark, and its history newest first
+    "CREATE INDEX IF NOT EXISTS idx_wallet_ledger_user ON wallet_ledger (user_id, id)",
+    "CREATE INDEX IF NOT EXISTS idx_wallet_ledger_order ON wallet_ledger (order_id) WHERE order_id IS NOT NULL",
+    """
+    CREATE OR REPLACE FUNCTION current_wallet_balance(p_user_id VARCHAR)
+    RETURNS DECIMAL
+    LANGUAGE sql STABLE AS $$
+        SELECT w.balance + COALESCE((
+            SELECT sum(l.amount)
+            FROM wallet_ledger l
+            WHERE l.user_id = w.user_id AND l.id > w.ledger_id
+        ), 0)
+        FROM user_wallet w
+        WHERE w.user_id = p_user_id
+    $$
+    """,
+    # Append one entry; debits that would overdraw the wallet are refused
+    """
+    CREATE OR REPLACE FUNCTION wallet_post(
+        p_user_id VARCHAR,
+        p_amount DECIMAL,
+        p_reason VARCHAR,
+        p_order_id INTEGER DEFAULT NULL
+    )
+    RETURNS TABLE (
+        result TEXT,
+        wallet_balance DECIMAL,
+        entry_id BIGINT
+    )
+    LANGUAGE plpgsql AS $$
+    BEGIN
+        IF p_amount < 0 THEN
+            PERFORM pg_advisory_xact_lock(21572, hashtext(p_user_id));
+        END IF;
+        PERFORM pg_advisory_xact_lock_shared(21580, hashtext(p_user_id));
+
+        wallet_balance := current_wallet_balance(p_user_id);
+        IF wallet_balance IS NULL THEN
+            result := 'wallet_not_found';
+            RETURN NEXT;
+            RETURN;
+        END IF;
+        IF p_amount < 0 AND wallet_balance + p_amount < 0 THEN
+            result := 'insufficient_balance';
+            RETURN NEXT;
+            RETURN;
+        END IF;
+
+        INSERT INTO wallet_ledger (user_id, amount, reason, order_id)
+        VALUES (p_user_id, p_amount, p_reason, p_order_id)
+        RETURNING id INTO entry_id;
+        wallet_balance := wallet_balance + p_amount;
+
+        result := 'ok';
+        RETURN NEXT;
+    END
+    $$
+    """,
+    # Set the balance to an absolute value with an entry for the difference
+    """
+    CREATE OR REPLACE FUNCTION wallet_reset(p_user_id VARCHAR, p_balance DECIMAL)
+    RETURNS TABLE (
+        user_id VARCHAR,
+        balance DECIMAL
+    )
+    LANGUAGE plpgsql AS $$
+    DECLARE
+        v_balance DECIMAL;
+    BEGIN
+        PERFORM pg_advisory_xact_lock(21572, hashtext(p_user_id));
+        PERFORM pg_advisory_xact_lock_shared(21580, hashtext(p_user_id));
+        v_balance := current_wallet_balance(p_user_id);
+        IF v_balance IS NULL THEN
+            RETURN;
+        END IF;
+        IF v_balance <> p_balance THEN
+            INSERT INTO wallet_ledger (user_id, amount, reason)
+            VALUES (p_user_id, p_balance - v_balance, 'reset');
+        END IF;
+        user_id := p_user_id;
+        balance := p_balance;
+        RETURN NEXT;
+    END
+    $$
+    """,
+    # Fold a wallet's new entries into its snapshot; returns how many were folded
+    """
+    CREATE OR REPLACE FUNCTION wallet_compact(p_user_id VARCHAR)
+    RETURNS INTEGER
+    LANGUAGE plpgsql AS $$
+    DECLARE
+        v_folded INTEGER;
+    BEGIN
+        PERFORM pg_advisory_xact_lock(21580, hashtext(p_user_id));
+        UPDATE user_wallet w
+        SET balance = w.balance + pending.total,
+            ledger_id = pending.last_id,
+            updated_at = CURRENT_TIMESTAMP
+        FROM (
+            SELECT sum(l.amount) AS total, max(l.id) AS last_id, count(*) AS entries
+            FROM wallet_ledger l
+            JOIN user_wallet s ON s.user_id = l.user_id
+            WHERE l.user_id = p_user_id AND l.id > s.ledger_id
+        ) AS pending
+        WHERE w.user_id = p_user_id AND pending.last_id IS NOT NULL
+        RETURNING pending.entries INTO v_folded;
+        RETURN COALESCE(v_folded, 0);
+    END
+    $$
+    """,
+    # place_order as in the baseline, with entries not yet folded into the
+    # snapshot counted in the balance check
+    """
+    CREATE OR REPLACE FUNCTION place_order(
+        p_user_id VARCHAR,
+        p_product_id INTEGER,
+        p_quantity INTEGER,
+        p_total_amount DECIMAL
+    )
+    RETURNS TABLE (
+        result TEXT,
+        wallet_balance DECIMAL,
+        order_id INTEGER,
+        order_status VARCHAR,
+        order_created_at TIMESTAMP
+    )
+    LANGUAGE plpgsql AS $$
+    DECLARE
+        v_stock INTEGER;
+    BEGIN
+        IF p_quantity <= 0 OR p_total_amount < 0 THEN
+            result := 'invalid_order';
+            RETURN NEXT;
+            RETURN;
+        END IF;
+
+        SELECT p.stock INTO v_stock
+        FROM product p
+        WHERE p.id = p_product_id
+        FOR UPDATE;
+        IF v_stock IS NULL OR v_stock < p_quantity THEN
+            result := 'insufficient_stock';
+            RETURN NEXT;
+            RETURN;
+        END IF;
+
+        PERFORM 1
+        FROM user_wallet w
+        WHERE w.user_id = p_user_id
+        FOR UPDATE;
+        IF NOT FOUND THEN
+            result := 'wallet_not_found';
+            RETURN NEXT;
+            RETURN;
+        END IF;
+        wallet_balance := current_wallet_balance(p_user_id);
+        IF wallet_balance < p_total_amount THEN
+            result := 'insufficient_balance';
+            RETURN NEXT;
+            RETURN;
+        END IF;
+
+        UPDATE product
+        SET stock = stock - p_quantity,
+            updated_at = CURRENT_TIMESTAMP
+        WHERE id = p_product_id;
+
+        UPDATE user_wallet
+        SET balance = balance - p_total_amount,
+            updated_at = CURRENT_TIMESTAMP
+        WHERE user_id = p_user_id;
+        wallet_balance := wallet_balance - p_total_amount;
+
+        INSERT INTO "order" (user_id, product_id, quantity, total_amount)
+        VALUES (p_user_id, p_product_id, p_quantity, p_total_amount)
+        RETURNING id, status, created_at
+        INTO order_id, order_status, order_created_at;
+
+        result := 'ok';
+        RETURN NEXT;
+    END
+    $$
+    """,
+    # place_order for ledger mode: the payment is a ledger entry tied to the
+    # order instead of an update of the wallet row. Locks are still taken
+    # product first, then wallet.
+    """
+    CREATE OR REPLACE FUNCTION place_order_ledger(
+        p_user_id VARCHAR,
+        p_product_id INTEGER,
+        p_quantity INTEGER,
+        p_total_amount DECIMAL
+    )
+    RETURNS TABLE (
+        result TEXT,
+        wallet_balance DECIMAL,
+        order_id INTEGER,
+        order_status VARCHAR,
+        order_created_at TIMESTAMP
+    )
+    LANGUAGE plpgsql AS $$
+    DECLARE
+        v_stock INTEGER;
+    BEGIN
+        IF p_quantity <= 0 OR p_total_amount < 0 THEN
+            result := 'invalid_order';
+            RETURN NEXT;
+            RETURN;
+        END IF;
+
+        SELECT p.stock INTO v_stock
+        FROM product p
+        WHERE p.id = p_product_id
+        FOR UPDATE;
+        IF v_stock IS NULL OR v_stock < p_quantity THEN
+            result := 'insufficient_stock';
+            RETURN NEXT;
+            RETURN;
+        END IF;
+
+        PERFORM pg_advisory_xact_lock(21572, hashtext(p_user_id));
+        PERFORM pg_advisory_xact_lock_shared(21580, hashtext(p_user_id));
+        wallet_balance := current_wallet_balance(p_user_id);
+        IF wallet_balance IS NULL THEN
+            result := 'wallet_not_found';
+            RETURN NEXT;
+            RETURN;
+        END IF;
+        IF wallet_balance < p_total_amount THEN
+            result := 'insufficient_balance';
+            RETURN NEXT;
+            RETURN;
+        END IF;
+
+        UPDATE product
+        SET stock = stock - p_quantity,
+            updated_at = CURRENT_TIMESTAMP
+        WHERE id = p_product_id;
+
+        INSERT INTO "order" (user_id, product_id, quantity, total_amount)
+        VALUES (p_user_id, p_product_id, p_quantity, p_total_amount)
+        RETURNING id, status, created_at
+        INTO order_id, order_status, order_created_at;
+
+        INSERT INTO wallet_ledger (user_id, amount, reason, order_id)
+        VALUES (p_user_id, -p_total_amount, 'order', order_id);
+        wallet_balance := wallet_balance - p_total_amount;
+
+        result := 'ok';
+        RETURN NEXT;
+    END
+    $$
+    """,
+)
+
+# Stock reservations and hot-product stock shards.
+#
+# take_stock() removes stock from the product row, or for a product with
+# stock_shards > 0 from one of its product_stock_shard rows, picked at random
+# among those not locked by another buyer, so concurrent buyers of a hot
+# product do not all queue on one row. Product.stock of a sharded product is
+# only the total for display, refreshed by the reservation sweeper.
+#
+# reserve_order() takes the stock for a pending order and records where it
+# came from in stock_reservation; pay_order() debits the wallet and commits
+# the reservation, and release_reservations() gives back the stock of
+# reservations that expired or whose order was cancelled.
+#
+# Locks are taken reservations, then order, then wallet in pay_order();
+# product / shards, then wallet in place_order(); reservations, then orders,
+# then product / shards in release_reservations(). Shards are locked in
+# shard order whenever more than one is locked.
+STOCK_RESERVATIONS = (
+    "ALTER TABLE product ADD COLUMN IF NOT EXISTS stock_shards INTEGER NOT NULL DEFAULT 0",
+    """
+    CREATE TABLE IF NOT EXISTS product_stock_shard (
+        product_id INTEGER NOT NULL REFERENCES product (id) ON DELETE CASCADE,
+        shard INTEGER NOT NULL,
+        stock INTEGER NOT NULL CHECK (stock >= 0),
+        PRIMARY KEY (product_id, shard)
+    )
+    """,
+    # No foreign key on product_id: the check would lock the hot product row
+    """
+    CREATE TABLE IF NOT EXISTS stock_reservation (
+        id BIGSERIAL PRIMARY KEY,
+        order_id INTEGER NOT NULL REFERENCES "order" (id),
+        product_id INTEGER NOT NULL,
+        shard INTEGER,
+        quantity INTEGER NOT NULL,
+        status VARCHAR(20) NOT NULL DEFAULT 'held',
+        expires_at TIMESTAMP NOT NULL,
+        created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_stock_reservation_order ON stock_reservation (order_id)",
+    "CREATE INDEX IF NOT EXISTS idx_stock_reservation_held ON stock_reservation (expires_at) WHERE status = 'held'",
+    # Returns where the stock was taken from (shard NULL for the product row),
+    # no rows if there is not enough
+    """
+    CREATE OR REPLACE FUNCTION take_stock(p_product_id INTEGER, p_quantity INTEGER)
+    RETURNS TABLE (
+        shard INTEGER,
+        quantity INTEGER
+    )
+    LANGUAGE plpgsql AS $$
+    DECLARE
+        v_shards INTEGER;
+        v_start INTEGER;
+        v_shard INTEGER;
+        v_total INTEGER;
+        v_left INTEGER := p_quantity;
+        r RECORD;
+    BEGIN
+        -- KEY SHARE keeps shard_product_stock() from resharding meanwhile
+        SELECT p.stock_shards INTO v_shards
+        FROM product p
+        WHERE p.id = p_product_id
+        FOR KEY SHARE;
+        IF v_shards IS NULL THEN
+            RETURN;
+        END IF;
+
+        IF v_shards = 0 THEN
+            UPDATE product p
+            SET stock = p.stock - p_quantity,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE p.id = p_product_id AND p.stock >= p_quantity;
+            IF FOUND THEN
+                shard := NULL;
+                quantity := p_quantity;
+                RETURN NEXT;
+            END IF;
+            RETURN;
+        END IF;
+
+        -- Any one shard that is not locked and holds the whole quantity,
+        -- starting from a random one
+        v_start := floor(random() * v_shards)::INTEGER;
+        SELECT s.shard INTO v_shard
+        FROM product_stock_shard s
+        WHERE s.product_id = p_product_id AND s.stock >= p_quantity
+        ORDER BY (s.shard + v_shards - v_start) % v_shards
+        LIMIT 1
+        FOR UPDATE SKIP LOCKED;
+        IF FOUND THEN
+            UPDATE product_stock_shard s
+            SET stock = s.stock - p_quantity
+            WHERE s.product_id = p_product_id AND s.shard = v_shard;
+            shard := v_shard;
+            quantity := p_quantity;
+            RETURN NEXT;
+            RETURN;
+        END IF;
+
+        -- Sold out buyers leave without waiting for the shards
+        SELECT COALESCE(sum(s.stock), 0) INTO v_total
+        FROM product_stock_shard s
+        WHERE s.product_id = p_product_id;
+        IF v_total < p_quantity THEN
+            RETURN;
+        END IF;
+
+        -- The shards that could serve it are busy, or none holds the whole
+        -- quantity: wait for all of them and take from several
+        PERFORM 1
+        FROM product_stock_shard s
+        WHERE s.product_id = p_product_id
+        ORDER BY s.shard
+        FOR UPDATE;
+        SELECT COALESCE(sum(s.stock), 0) INTO v_total
+        FROM product_stock_shard s
+        WHERE s.product_id = p_product_id;
+        IF v_total < p_quantity THEN
+            RETURN;
+        END IF;
+        FOR r IN
+            SELECT s.shard AS shard_no, s.stock AS available
+            FROM product_stock_shard s
+            WHERE s.product_id = p_product_id AND s.stock > 0
+            ORDER BY s.stock DESC, s.shard
+        LOOP
+            EXIT WHEN v_left = 0;
+            shard := r.shard_no;
+            quantity := LEAST(r.available, v_left);
+            UPDATE product_stock_shard s
+            SET stock = s.stock - LEAST(r.available, v_left)
+            WHERE s.product_id = p_product_id AND s.shard = r.shard_no;
+            v_left := v_left - quantity;
+            RETURN NEXT;
+        END LOOP;
+    END
+    $$
+    """,
+    # Give back stock taken by take_stock(); stock from a shard that no longer
+    # exists after resharding goes to another shard
+    """
+    CREATE OR REPLACE FUNCTION return_stock(p_product_id INTEGER, p_shard INTEGER, p_quantity INTEGER)
+    RETURNS VOID
+    LANGUAGE plpgsql AS $$
+    DECLARE
+        v_shards INTEGER;
+    BEGIN
+        SELECT p.stock_shards INTO v_shards
+        FROM product p
+        WHERE p.id = p_product_id
+        FOR KEY SHARE;
+        IF v_shards IS NULL THEN
+            RETURN;
+        END IF;
+        IF v_shards = 0 THEN
+            UPDATE product p
+            SET stock = p.stock + p_quantity,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE p.id = p_product_id;
+        ELSE
+            UPDATE product_stock_shard s
+            SET stock = s.stock + p_quantity
+            WHERE s.product_id = p_product_id AND s.shard = COALESCE(p_shard, 0) % v_shards;
+        END IF;
+    END
+    $$
+    """,
+    # Spread a product's stock over p_shards shard rows, or gather it back
+    # into the product row with p_shards = 0
+    """
+    CREATE OR REPLACE FUNCTION shard_product_stock(p_product_id INTEGER, p_shards INTEGER)
+    RETURNS INTEGER
+    LANGUAGE plpgsql AS $$
+    DECLARE
+        v_shards INTEGER;
+        v_total INTEGER;
+    BEGIN
+        SELECT p.stock_shards, p.stock INTO v_shards, v_total
+        FROM product p
+        WHERE p.id = p_product_id
+        FOR UPDATE;
+        IF v_shards IS NULL THEN
+            RETURN NULL;
+        END IF;
+        IF v_shards > 0 THEN
+            SELECT COALESCE(sum(s.stock), 0) INTO v_total
+            FROM product_stock_shard s
+            WHERE s.product_id = p_product_id;
+            DELETE FROM product_stock_shard s WHERE s.product_id = p_product_id;
+        END IF;
+        IF p_shards > 0 THEN
+            INSERT INTO product_stock_shard (product_id, shard, stock)
+            SELECT p_product_id, i, v_total / p_shards + CASE WHEN i < v_total % p_shards THEN 1 ELSE 0 END
+            FROM generate_series(0, p_shards - 1) AS i;
+        END IF;
+        UPDATE product p
+        SET stock_shards = GREATEST(p_shards, 0),
+            stock = v_total,
+            updated_at = CURRENT_TIMESTAMP
+        WHERE p.id = p_product_id;
+        RETURN v_total;
+    END
+    $$
+    """,
+    # Pending order with its stock held until p_ttl_seconds from now
+    """
+    CREATE OR REPLACE FUNCTION reserve_order(
+        p_user_id VARCHAR,
+        p_product_id INTEGER,
+        p_quantity INTEGER,
+        p_total_amount DECIMAL,
+        p_ttl_seconds DOUBLE PRECISION
+    )
+    RETURNS TABLE (
+        result TEXT,
+        order_id INTEGER,
+        order_status VARCHAR,
+        order_created_at TIMESTAMP,
+        reserved_until TIMESTAMP
+    )
+    LANGUAGE plpgsql AS $$
+    DECLARE
+        v_shards INTEGER[];
+        v_quantities INTEGER[];
+    BEGIN
+        IF p_quantity <= 0 OR p_total_amount < 0 THEN
+            result := 'invalid_order';
+            RETURN NEXT;
+            RETURN;
+        END IF;
+        PERFORM 1 FROM user_wallet w WHERE w.user_id = p_user_id;
+        IF NOT FOUND THEN
+            result := 'wallet_not_found';
+            RETURN NEXT;
+            RETURN;
+        END IF;
+
+        SELECT array_agg(t.shard), array_agg(t.quantity) INTO v_shards, v_quantities
+        FROM take_stock(p_product_id, p_quantity) t;
+        IF v_quantities IS NULL THEN
+            result := 'insufficient_stock';
+            RETURN NEXT;
+            RETURN;
+        END IF;
+
+        INSERT INTO "order" (user_id, product_id, quantity, total_amount)
+        VALUES (p_user_id, p_product_id, p_quantity, p_total_amount)
+        RETURNING id, status, created_at
+        INTO order_id, order_status, order_created_at;
+
+        reserved_until := order_created_at + make_interval(secs => p_ttl_seconds);
+        INSERT INTO stock_reservation (order_id, product_id, shard, quantity, expires_at)
+        SELECT order_id, p_product_id, u.shard_no, u.taken, reserved_until
+        FROM unnest(v_shards, v_quantities) AS u(shard_no, taken);
+
+        result := 'ok';
+        RETURN NEXT;
+    END
+    $$
+    """,
+    # Debit the wallet for a reserved order and commit its reservation.
+    # Orders without reservations (paid by place_order) only change status.
+    """
+    CREATE OR REPLACE FUNCTION pay_order(p_order_id INTEGER, p_ledger BOOLEAN)
+    RETURNS TABLE (
+        result TEXT,
+        wallet_balance DECIMAL
+    )
+    LANGUAGE plpgsql AS $$
+    DECLARE
+        v_order RECORD;
+        v_held INTEGER;
+        v_expired BOOLEAN;
+    BEGIN
+        PERFORM 1
+        FROM stock_reservation r
+        WHERE r.order_id = p_order_id AND r.status = 'held'
+        ORDER BY r.id
+        FOR UPDATE;
+        SELECT count(*), COALESCE(bool_or(r.expires_at < CURRENT_TIMESTAMP), false)
+        INTO v_held, v_expired
+        FROM stock_reservation r
+        WHERE r.order_id = p_order_id AND r.status = 'held';
+
+        SELECT o.user_id, o.total_amount, o.status INTO v_order
+        FROM "order" o
+        WHERE o.id = p_order_id
+        FOR UPDATE;
+        IF NOT FOUND THEN
+            result := 'order_not_found';
+            RETURN NEXT;
+            RETURN;
+        END IF;
+        IF v_order.status = 'paid' THEN
+            result := 'already_paid';
+            RETURN NEXT;
+            RETURN;
+        END IF;
+        IF v_held = 0 THEN
+            IF EXISTS (SELECT 1 FROM stock_reservation r WHERE r.order_id = p_order_id) THEN
+                result := 'reservation_expired';
+                RETURN NEXT;
+                RETURN;
+            END IF;
+            UPDATE "order" o
+            SET status = 'paid',
+                updated_at = CURRENT_TIMESTAMP
+            WHERE o.id = p_order_id;
+            result := 'ok';
+            RETURN NEXT;
+            RETURN;
+        END IF;
+        IF v_expired OR v_order.status = 'cancelled' THEN
+            result := 'reservation_expired';
+            RETURN NEXT;
+            RETURN;
+        END IF;
+
+        IF p_ledger THEN
+            PERFORM pg_advisory_xact_lock(21572, hashtext(v_order.user_id));
+            PERFORM pg_advisory_xact_lock_shared(21580, hashtext(v_order.user_id));
+        ELSE
+            PERFORM 1 FROM user_wallet w WHERE w.user_id = v_order.user_id FOR UPDATE;
+        END IF;
+        wallet_balance := current_wallet_balance(v_order.user_id);
+        IF wallet_balance IS NULL THEN
+            result := 'wallet_not_found';
+            RETURN NEXT;
+            RETURN;
+        END IF;
+        IF wallet_balance < v_order.total_amount THEN
+            result := 'insufficient_balance';
+            RETURN NEXT;
+            RETURN;
+        END IF;
+        IF p_ledger THEN
+            INSERT INTO wallet_ledger (user_id, amount, reason, order_id)
+            VALUES (v_order.user_id, -v_order.total_amount, 'order', p_order_id);
+        ELSE
+            UPDATE user_wallet w
+            SET balance = w.balance - v_order.total_amount,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE w.user_id = v_order.user_id;
+        END IF;
+        wallet_balance := wallet_balance - v_order.total_amount;
+
+        UPDATE stock_reservation r
+        SET status = 'committed'
+        WHERE r.order_id = p_order_id AND r.status = 'held';
+        UPDATE "order" o
+        SET status = 'paid',
+            updated_at = CURRENT_TIMESTAMP
+        WHERE o.id = p_order_id;
+
+        result := 'ok';
+        RETURN NEXT;
+    END
+    $$
+    """,
+    # Give back the stock of up to p_batch_size reservations that expired or
+    # whose order was cancelled, and cancel the expired orders. Reservations
+    # being paid are skipped and picked up by a later batch if still due.
+    """
+    CREATE OR REPLACE FUNCTION release_reservations(p_batch_size INTEGER)
+    RETURNS INTEGER
+    LANGUAGE plpgsql AS $$
+    DECLARE
+        v_products INTEGER[];
+        v_shards INTEGER[];
+        v_quantities INTEGER[];
+        v_released INTEGER;
+    BEGIN
+        WITH due AS (
+            SELECT r.id
+            FROM stock_reservation r
+            JOIN "order" o ON o.id = r.order_id
+            WHERE r.status = 'held'
+              AND (r.expires_at < CURRENT_TIMESTAMP OR o.status = 'cancelled')
+            ORDER BY r.id
+            LIMIT p_batch_size
+            FOR UPDATE OF r SKIP LOCKED
+        ), released AS (
+            UPDATE stock_reservation r
+            SET status = 'released'
+            FROM due
+            WHERE r.id = due.id
+            RETURNING r.order_id, r.product_id, r.shard, r.quantity
+        ), cancelled AS (
+            UPDATE "order" o
+            SET status = 'cancelled',
+                updated_at = CURRENT_TIMESTAMP
+            WHERE o.id IN (SELECT released.order_id FROM released) AND o.status = 'pending'
+        ), returned AS (
+            SELECT released.product_id, released.shard, sum(released.quantity)::INTEGER AS quantity
+            FROM released
+            GROUP BY released.product_id, released.shard
+        )
+        SELECT
+            array_agg(returned.product_id ORDER BY returned.product_id, returned.shard),
+            array_agg(returned.shard ORDER BY returned.product_id, returned.shard),
+            array_agg(returned.quantity ORDER BY returned.product_id, returned.shard),
+            (SELECT count(*) FROM released)
+        INTO v_products, v_shards, v_quantities, v_released
+        FROM returned;
+
+        IF v_released = 0 THEN
+            RETURN 0;
+        END IF;
+        FOR i IN 1 .. array_length(v_products, 1) LOOP
+            PERFORM return_stock(v_products[i], v_shards[i], v_quantities[i]);
+        END LOOP;
+        RETURN v_released;
+    END
+    $$
+    """,
+    # place_order and place_order_ledger as before, taking the stock with
+    # take_stock() so sharded products are served from their shards
+    """
+    CREATE OR REPLACE FUNCTION place_order(
+        p_user_id VARCHAR,
+        p_product_id INTEGER,
+        p_quantity INTEGER,
+        p_total_amount DECIMAL
+    )
+    RETURNS TABLE (
+        result TEXT,
+        wallet_balance DECIMAL,
+        order_id INTEGER,
+        order_status VARCHAR,
+        order_created_at TIMESTAMP
+    )
+    LANGUAGE plpgsql AS $$
+    DECLARE
+        v_shards INTEGER[];
+        v_quantities INTEGER[];
+    BEGIN
+        IF p_quantity <= 0 OR p_total_amount < 0 THEN
+            result := 'invalid_order';
+            RETURN NEXT;
+            RETURN;
+        END IF;
+
+        SELECT array_agg(t.shard), array_agg(t.quantity) INTO v_shards, v_quantities
+        FROM take_stock(p_product_id, p_quantity) t;
+        IF v_quantities IS NULL THEN
+            result := 'insufficient_stock';
+            RETURN NEXT;
+            RETURN;
+        END IF;
+
+        PERFORM 1
+        FROM user_wallet w
+        WHERE w.user_id = p_user_id
+        FOR UPDATE;
+        IF NOT FOUND THEN
+            result := 'wallet_not_found';
+        ELSE
+            wallet_balance := current_wallet_balance(p_user_id);
+            IF wallet_balance < p_total_amount THEN
+                result := 'insufficient_balance';
+            END IF;
+        END IF;
+        IF result IS NOT NULL THEN
+            PERFORM return_stock(p_product_id, u.shard_no, u.taken)
+            FROM unnest(v_shards, v_quantities) AS u(shard_no, taken);
+            RETURN NEXT;
+            RETURN;
+        END IF;
+
+        UPDATE user_wallet
+        SET balance = balance - p_total_amount,
+            updated_at = CURRENT_TIMESTAMP
+        WHERE user_id = p_user_id;
+        wallet_balance := wallet_balance - p_total_amount;
+
+        INSERT INTO "order" (user_id, product_id, quantity, total_amount)
+        VALUES (p_user_id, p_product_id, p_quantity, p_total_amount)
+        RETURNING id, status, created_at
+        INTO order_id, order_status, order_created_at;
+
+        result := 'ok';
+        RETURN NEXT;
+    END
+    $$
+    """,
+    """
+    CREATE OR REPLACE FUNCTION place_order_ledger(
+        p_user_id VARCHAR,
+        p_product_id INTEGER,
+        p_quantity INTEGER,
+        p_total_amount DECIMAL
+    )
+    RETURNS TABLE (
+        result TEXT,
+        wallet_balance DECIMAL,
+        order_id INTEGER,
+        order_status VARCHAR,
+        order_created_at TIMESTAMP
+    )
+    LANGUAGE plpgsql AS $$
+    DECLARE
+        v_shards INTEGER[];
+        v_quantities INTEGER[];
+    BEGIN
+        IF p_quantity <= 0 OR p_total_amount < 0 THEN
+            result := 'invalid_order';
+            RETURN NEXT;
+            RETURN;
+        END IF;
+
+        SELECT array_agg(t.shard), array_agg(t.quantity) INTO v_shards, v_quantities
+        FROM take_stock(p_product_id, p_quantity) t;
+        IF v_quantities IS NULL THEN
+            result := 'insufficient_stock';
+            RETURN NEXT;
+            RETURN;
+        END IF;
+
+        PERFORM pg_advisory_xact_lock(21572, hashtext(p_user_id));
+        PERFORM pg_advisory_xact_lock_shared(21580, hashtext(p_user_id));
+        wallet_balance := current_wallet_balance(p_user_id);
+        IF wallet_balance IS NULL THEN
+            result := 'wallet_not_found';
+        ELSIF wallet_balance < p_total_amount THEN
+            result := 'insufficient_balance';
+        END IF;
+        IF result IS NOT NULL THEN
+            PERFORM return_stock(p_product_id, u.shard_no, u.taken)
+            FROM unnest(v_shards, v_quantities) AS u(shard_no, taken);
+            RETURN NEXT;
+            RETURN;
+        END IF;
+
+        INSERT INTO "order" (user_id, product_id, quantity, total_amount)
+        VALUES (p_user_id, p_product_id, p_quantity, p_total_amount)
+        RETURNING id, status, created_at
+        INTO order_id, order_status, order_created_at;
+
+        INSERT INTO wallet_ledger (user_id, amount, reason, order_id)
+        VALUES (p_user_id, -p_total_amount, 'order', order_id);
+        wallet_balance := wallet_balance - p_total_amount;
+
+        result := 'ok';
+        RETURN NEXT;
+    END
+    $$
+    """,
+)
+
+# message partitioned by month of created_at, so old months can be detached
+# and archived as a whole (app/db/message_partitions.py) instead of growing
+# one heap and one index forever. Each partition is named message_YYYY_MM
+# and created ahead of time by create_message_partition(); there is no
+# default partition, a turn outside every partition fails to insert.
+#
+# The primary key of a partitioned table must contain the partition key, so
+# it becomes (id, created_at). Existing rows are copied in this transaction:
+# chat history writes wait for the copy.
+MESSAGE_PARTITIONS = (
+    """
+    CREATE OR REPLACE FUNCTION create_message_partition(p_month DATE)
+    RETURNS TEXT
+    LANGUAGE plpgsql
+    AS $$
+    DECLARE
+        month_start DATE := date_trunc('month', p_month)::date;
+        partition_name TEXT := 'message_' || to_char(p_month, 'YYYY_MM');
+    BEGIN
+        -- Checked first: CREATE ... IF NOT EXISTS would still lock message
+        IF to_regclass(partition_name) IS NOT NULL THEN
+            RETURN NULL;
+        END IF;
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF message FOR VALUES FROM (%L) TO (%L)',
+            partition_name, month_start, (month_start + interval '1 month')::date
+        );
+        RETURN partition_name;
+    END
+    $$
+    """,
+    "DROP INDEX IF EXISTS idx_message_thread_created",
+    "ALTER TABLE message RENAME TO message_unpartitioned",
+    "ALTER TABLE message_unpartitioned RENAME CONSTRAINT message_pkey TO message_unpartitioned_pkey",
+    """
+    CREATE TABLE message (
+        id UUID NOT NULL DEFAULT uuid_generate_v4(),
+        thread_id VARCHAR(255) NOT NULL,
+        question TEXT NOT NULL,
+        answer TEXT NOT NULL,
+        created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (id, created_at)
+    ) PARTITION BY RANGE (created_at)
+    """,
+    """
+    CREATE INDEX idx_message_thread_created
+    ON message (thread_id, created_at DESC)
+    """,
+    # Every month with history, up to three months ahead
+    """
+    SELECT create_message_partition(month::date)
+    FROM (
+        SELECT COALESCE(min(created_at), LOCALTIMESTAMP) AS first_at,
+               GREATEST(max(created_at), LOCALTIMESTAMP) AS last_at
+        FROM message_unpartitioned
+    ) AS bounds,
+    generate_series(
+        date_trunc('month', first_at),
+        date_trunc('month', last_at) + interval '3 months',
+        interval '1 month'
+    ) AS month
+    """,
+    """
+    INSERT INTO message (id, thread_id, question, answer, created_at)
+    SELECT id, thread_id, question, answer, COALESCE(created_at, CURRENT_TIMESTAMP)
+    FROM message_unpartitioned
+    """,
+    "DROP TABLE message_unpartitioned",
+)
+
+# pay_order of STOCK_RESERVATIONS marked any order without reservations as
+# paid, a cancelled one included; only pending orders may be paid
+PAY_PENDING_ORDERS = (
+    """
+    CREATE OR REPLACE FUNCTION pay_order(p_order_id INTEGER, p_ledger BOOLEAN)
+    RETURNS TABLE (
+        result TEXT,
+        wallet_balance DECIMAL
+    )
+    LANGUAGE plpgsql AS $$
+    DECLARE
+        v_order RECORD;
+        v_held INTEGER;
+        v_expired BOOLEAN;
+    BEGIN
+        PERFORM 1
+        FROM stock_reservation r
+        WHERE r.order_id = p_order_id AND r.status = 'held'
+        ORDER BY r.id
+        FOR UPDATE;
+        SELECT count(*), COALESCE(bool_or(r.expires_at < CURRENT_TIMESTAMP), false)
+        INTO v_held, v_expired
+        FROM stock_reservation r
+        WHERE r.order_id = p_order_id AND r.status = 'held';
+
+        SELECT o.user_id, o.total_amount, o.status INTO v_order
+        FROM "order" o
+        WHERE o.id = p_order_id
+        FOR UPDATE;
+        IF NOT FOUND THEN
+            result := 'order_not_found';
+            RETURN NEXT;
+            RETURN;
+        END IF;
+        IF v_order.status = 'paid' THEN
+            result := 'already_paid';
+            RETURN NEXT;
+            RETURN;
+        END IF;
+        IF v_held = 0 THEN
+            IF EXISTS (SELECT 1 FROM stock_reservation r WHERE r.order_id = p_order_id) THEN
+                result := 'reservation_expired';
+                RETURN NEXT;
+                RETURN;
+            END IF;
+            IF v_order.status <> 'pending' THEN
+                result := 'order_not_pending';
+                RETURN NEXT;
+                RETURN;
+            END IF;
+            UPDATE "order" o
+            SET status = 'paid',
+                updated_at = CURRENT_TIMESTAMP
+            WHERE o.id = p_order_id;
+            result := 'ok';
+            RETURN NEXT;
+            RETURN;
+        END IF;
+        IF v_expired OR v_order.status = 'cancelled' THEN
+            result := 'reservation_expired';
+            RETURN NEXT;
+            RETURN;
+        END IF;
+
+        IF p_ledger THEN
+            PERFORM pg_advisory_xact_lock(21572, hashtext(v_order.user_id));
+            PERFORM pg_advisory_xact_lock_shared(21580, hashtext(v_order.user_id));
+        ELSE
+            PERFORM 1 FROM user_wallet w WHERE w.user_id = v_order.user_id FOR UPDATE;
+        END IF;
+        wallet_balance := current_wallet_balance(v_order.user_id);
+        IF wallet_balance IS NULL THEN
+            result := 'wallet_not_found';
+            RETURN NEXT;
+            RETURN;
+        END IF;
+        IF wallet_balance < v_order.total_amount THEN
+            result := 'insufficient_balance';
+            RETURN NEXT;
+            RETURN;
+        END IF;
+        IF p_ledger THEN
+            INSERT INTO wallet_ledger (user_id, amount, reason, order_id)
+            VALUES (v_order.user_id, -v_order.total_amount, 'order', p_order_id);
+        ELSE
+            UPDATE user_wallet w
+            SET balance = w.balance - v_order.total_amount,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE w.user_id = v_order.user_id;
+        END IF;
+        wallet_balance := wallet_balance - v_order.total_amount;
+
+        UPDATE stock_reservation r
+        SET status = 'committed'
+        WHERE r.order_id = p_order_id AND r.status = 'held';
+        UPDATE "order" o
+        SET status = 'paid',
+            updated_at = CURRENT_TIMESTAMP
+        WHERE o.id = p_order_id;
+
+        result := 'ok';
+        RETURN NEXT;
+    END
+    $$
+    """,
+)
+
+MIGRATIONS = [
+    Migration(1, "baseline", BASELINE),
+    Migration(2, "order indexes and wallet foreign key", (
+        # Foreign key columns are not indexed by Postgres: without these, looking
+        # up a user's orders or deleting a product scans the whole order table
+        'CREATE INDEX IF NOT EXISTS idx_order_user_id ON "order" (user_id)',
+        'CREATE INDEX IF NOT EXISTS idx_order_product_id ON "order" (product_id)',
+        # place_order only creates orders for existing wallets. NOT VALID skips
+        # checking old rows, so this cannot fail on data from before the key
+        """
+        ALTER TABLE "order"
+        ADD CONSTRAINT order_user_id_fkey
+        FOREIGN KEY (user_id) REFERENCES user_wallet (user_id) NOT VALID
+        """,
+    )),
+    Migration(3, "order history keyset indexes", (
+        # Keyset pagination compares (created_at, id), which must not be NULL
+        'UPDATE "order" SET created_at = COALESCE(updated_at, CURRENT_TIMESTAMP) WHERE created_at IS NULL',
+        'ALTER TABLE "order" ALTER COLUMN created_at SET NOT NULL',
+        # A user's orders newest first; also covers the lookups idx_order_user_id served
+        """
+        CREATE INDEX IF NOT EXISTS idx_order_user_created
+        ON "order" (user_id, created_at DESC, id DESC)
+        """,
+        "DROP INDEX IF EXISTS idx_order_user_id",
+        # All orders newest first, for exports
+        """
+        CREATE INDEX IF NOT EXISTS idx_order_created
+        ON "order" (created_at DESC, id DESC)
+        """,
+    )),
+    Migration(4, "wallet ledger", WALLET_LEDGER),
+    Migration(5, "stock reservations and shards", STOCK_RESERVATIONS),
+    Migration(6, "monthly message partitions", MESSAGE_PARTITIONS),
+    Migration(7, "pay only pending orders", PAY_PENDING_ORDERS),
+]
+
+LATEST_VERSION = MIGRATIONS[-1].version
+
+def _applied_versions(conn) -> set[int]:
+    exists = conn.execute("SELECT to_regclass('schema_version') IS NOT NULL AS exists").fetchone()
+    if not exists["exists"]:
+        return set()
+    return {row["version"] for row in conn.execute("SELECT version FROM schema_version")}
+
+def get_schema_version() -> int:
+    """
+    Get the newest migration applied to the database
+
+    Returns:
+        int: Schema version, 0 for a database that was never migrated
+    """
+    with get_db_connection() as conn:
+        return max(_applied_versions(conn), default=0)
+
+def migrate(target: int = LATEST_VERSION) -> list[int]:
+    """
+    Apply the pending migrations up to target, each in its own transaction
+
+    A session advisory lock makes concurrent callers wait for each other, so
+    every migration runs exactly once however many processes call this.
+
+    Args:
+        target (int): Last version to apply
+
+    Returns:
+        list[int]: Versions applied by this call
+    """
+    applied_now = []
+    with psycopg.connect(get_conninfo(), row_factory=dict_row, autocommit=True) as conn:
+        conn.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_KEY,))
+        try:
+            conn.execute(CREATE_SCHEMA_VERSION)
+            applied = _applied_versions(conn)
+            for migration in MIGRATIONS:
+                if migration.version in applied or migration.version > target:
+                    continue
+                logger.info(f"Applying migration {migration.version}: {migration.name}")
+                with conn.transaction():
+                    for statement in migration.statements:
+                        conn.execute(statement)
+                    conn.execute(
+                        "INSERT INTO schema_version (version, name) VALUES (%s, %s)",
+                        (migration.version, migration.name)
+                    )
+                applied_now.append(migration.version)
+        finally:
+            conn.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_KEY,))
+    return applied_now
+
+def check_schema_version():
+    """
+    Make sure the database has every migration this code needs
+
+    Raises:
+        RuntimeError: If migrations are pending
+    """
+    if DB_MIGRATE_ON_STARTUP:
+        migrate()
+    version = get_schema_version()
+    if version < LATEST_VERSION:
+        raise RuntimeError(
+            f"Database schema is at version {version}, this code needs {LATEST_VERSION}: "
+            "run python app/db/migrations.py"
+        )
+    if version > LATEST_VERSION:
+        # A newer release is rolling out; its migrations must stay compatible with us
+        logger.warning(f"Database schema is at version {version}, newer than this code ({LATEST_VERSION})")
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Apply pending database migrations")
+    parser.add_argument("--status", action="store_true", help="Show applied and pending migrations and exit")
+    parser.add_argument("--target", type=int, default=LATEST_VERSION, help="Last version to apply")
+    args = parser.parse_args()
+
+    if args.status:
+        with get_db_connection() as conn:
+            applied = _applied_versions(conn)
+        for migration in MIGRATIONS:
+            state = "applied" if migration.version in applied else "pending"
+            print(f"{migration.version:4}  {state:8}  {migration.name}")
+        return
+
+    applied = migrate(args.target)
+    print(f"Applied {applied}" if applied else "Nothing to apply")
+    print(f"Schema version {get_schema_version()}")
+
+if __name__ == '__main__':
+    main()
@@ -2,39 +2,147 @@ import sys, os
 project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
 sys.path.insert(0, project_root)
 
-from app.db.product_service import get_db_connection
+from app.db.connection import get_db_connection, get_async_db_connection
+from app.db.product_service import invalidate_product, refresh_sharded_stock
+from app.db.wallet_service import WALLET_LEDGER_ENABLED
+from datetime import datetime
 from decimal import Decimal
+from typing import AsyncIterator
+import logging
+import threading
 
-def init_order_table():
+logger = logging.getLogger(__name__)
+
+ORDER_EXPORT_BATCH_SIZE = int(os.getenv('ORDER_EXPORT_BATCH_SIZE', '1000'))
+
+# reserve: the create_order tool only reserves the stock; the wallet is
+# debited when the order is set to paid, and unpaid reservations expire.
+# pay: it pays at once with place_order, as before reservations existed.
+ORDER_FLOW = os.getenv('ORDER_FLOW', 'reserve').lower()
+# How long create_order holds the stock of an unpaid order
+ORDER_RESERVATION_TTL = float(os.getenv('ORDER_RESERVATION_TTL', '900'))
+RESERVATION_SWEEP_INTERVAL = float(os.getenv('RESERVATION_SWEEP_INTERVAL', '10'))
+RESERVATION_SWEEP_BATCH_SIZE = int(os.getenv('RESERVATION_SWEEP_BATCH_SIZE', '1000'))
+
+_sweeper_stop = threading.Event()
+_sweeper_thread: threading.Thread | None = None
+
+RESERVE_ORDER = """
+    SELECT result, order_id, order_status, order_created_at, reserved_until
+    FROM reserve_order(%s, %s, %s, %s, %s)
+"""
+
+PAY_ORDER = """
+    SELECT result, wallet_balance
+    FROM pay_order(%s, %s)
+"""
+
+RELEASE_RESERVATIONS = """
+    SELECT release_reservations(%s) AS released
+"""
+
+PLACE_ORDER = """
+    SELECT result, wallet_balance, order_id, order_status, order_created_at
+    FROM place_order(%s, %s, %s, %s)
+"""
+
+# Same result as place_order; the payment is a wallet_ledger entry tied to the order
+PLACE_ORDER_LEDGER = """
+    SELECT result, wallet_balance, order_id, order_status, order_created_at
+    FROM place_order_ledger(%s, %s, %s, %s)
+"""
+
+def _select_orders_page(by_user: bool, after: bool) -> str:
+    conditions = []
+    if by_user:
+        conditions.append("user_id = %(user_id)s")
+    if after:
+        conditions.append("(created_at, id) < (%(created_at)s, %(id)s)")
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    return f"""
+        SELECT
+            id,
+            user_id,
+            product_id,
+            quantity,
+            total_amount,
+            status,
+            created_at,
+            updated_at
+        FROM "order"
+        {where}
+        ORDER BY created_at DESC, id DESC
+        LIMIT %(limit)s
+    """
+
+# Newest first, keyset-paginated on (created_at, id) and served by
+# idx_order_user_created / idx_order_created. The first page and the following
+# ones are separate statements: an "after IS NULL OR ..." condition would keep
+# the planner from using the row comparison as an index bound.
+SELECT_ORDERS_PAGE = {
+    (by_user, after): _select_orders_page(by_user, after)
+    for by_user in (True, False)
+    for after in (True, False)
+}
+
+UPDATE_ORDER_STATUS = """
+    UPDATE "order"
+    SET status = %s,
+        updated_at = CURRENT_TIMESTAMP
+    WHERE id = %s
+    RETURNING id
+"""
+
+def _reserve_order_result(row: dict, user_id: str, product_id: int, quantity: int, total_amount: Decimal) -> dict:
+    order = None
+    if row['result'] == 'ok':
+        order = {
+            "id": row['order_id'],
+            "user_id": user_id,
+            "product_id": product_id,
+            "quantity": quantity,
+            "total_amount": total_amount,
+            "status": row['order_status'],
+            "created_at": row['order_created_at'],
+            "updated_at": row['order_created_at'],
+            "reserved_until": row['reserved_until'],
+        }
+    return {"status": row['result'], "order": order}
+
+
+def reserve_order(user_id: str, product_id: int, quantity: int, total_amount: Decimal, ttl: float = ORDER_RESERVATION_TTL) -> dict:
     """
-    Initialize order table in database if not exists
-    This table stores information about orders, including:
-    - User ID
-    - Product ID
-    - Quantity
-    - Total amount
-    - Status
+    Create a pending order and hold its stock until it is paid or the reservation expires
+
+    The wallet is only debited by update_order_status(order_id, "paid").
+    Reservations that expire, or whose order is cancelled, are released by
+    the reservation sweeper, which also cancels the expired orders.
+
+    Args:
+        user_id (str): ID of the user
+        product_id (int): ID of the product
+        quantity (int): Quantity of the product
+        total_amount (Decimal): Total amount of the order
+        ttl (float): Seconds the stock is held for
+
+    Returns:
+        dict: "status" is one of ok, invalid_order, wallet_not_found or
+              insufficient_stock; "order" is the created order (with
+              reserved_until) or None
     """
     with get_db_connection() as conn:
         with conn.cursor() as cur:
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS "order" (
-                    id SERIAL PRIMARY KEY,
-                    user_id VARCHAR(255) NOT NULL,
-                    product_id INTEGER NOT NULL REFERENCES product(id),
-                    quantity INTEGER NOT NULL,
-                    total_amount DECIMAL(10,2) NOT NULL,
-                    status VARCHAR(50) NOT NULL DEFAULT 'pending',
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-        conn.commit()
+            cur.execute(RESERVE_ORDER, (user_id, product_id, quantity, total_amount, ttl))
+            row = cur.fetchone()
+            conn.commit()
+    if row['result'] == 'ok':
+        invalidate_product(product_id)
+    return _reserve_order_result(row, user_id, product_id, quantity, total_amount)
 
 
 def create_order(user_id: str, product_id: int, quantity: int, total_amount: Decimal) -> dict | None:
     """
-    Create a new order
+    Create a new order, reserving its stock for ORDER_RESERVATION_TTL seconds
 
     Args:
         user_id (str): ID of the user
@@ -45,55 +153,293 @@ def create_order(user_id: str, product_id: int, quantity: int, total_amount: Dec
     Returns:
         dict | None: Order information if creation is successful, None if failed
     """
+    return reserve_order(user_id, product_id, quantity, total_amount)["order"]
+
+
+def _place_order_query() -> str:
+    return PLACE_ORDER_LEDGER if WALLET_LEDGER_ENABLED else PLACE_ORDER
+
+
+def _place_order_result(row: dict, user_id: str, product_id: int, quantity: int, total_amount: Decimal) -> dict:
+    order = None
+    if row['result'] == 'ok':
+        order = {
+            "id": row['order_id'],
+            "user_id": user_id,
+            "product_id": product_id,
+            "quantity": quantity,
+            "total_amount": total_amount,
+            "status": row['order_status'],
+            "created_at": row['order_created_at'],
+            "updated_at": row['order_created_at'],
+        }
+    return {
+        "status": row['result'],
+        "balance": row['wallet_balance'],
+        "order": order,
+    }
+
+
+def place_order(user_id: str, product_id: int, quantity: int, total_amount: Decimal) -> dict:
+    """
+    Atomically reserve stock, debit the wallet and create the order
+
+    Everything happens in one place_order() call on the server, so either all
+    three changes are committed or none are. With WALLET_MODE=ledger the debit
+    is appended to the wallet ledger instead of updating the wallet row.
+
+    Args:
+        user_id (str): ID of the user
+        product_id (int): ID of the product
+        quantity (int): Quantity of the product
+        total_amount (Decimal): Total amount of the order
+
+    Returns:
+        dict: "status" is one of ok, invalid_order, insufficient_stock,
+              wallet_not_found or insufficient_balance; "balance" is the wallet
+              balance (after payment when ok); "order" is the created order or None
+    """
     with get_db_connection() as conn:
         with conn.cursor() as cur:
-            cur.execute(
-                """
-                INSERT INTO "order" (user_id, product_id, quantity, total_amount)
-                VALUES (%s, %s, %s, %s)
-                RETURNING 
-                    id,
-                    user_id,
-                    product_id,
-                    quantity,
-                    total_amount,
-                    status,
-                    created_at,
-                    updated_at
-                """,
-                (user_id, product_id, quantity, total_amount)
-            )
-            result = cur.fetchone()
+            cur.execute(_place_order_query(), (user_id, product_id, quantity, total_amount))
+            row = cur.fetchone()
             conn.commit()
-            return result
+    if row['result'] == 'ok':
+        invalidate_product(product_id)
+    return _place_order_result(row, user_id, product_id, quantity, total_amount)
 
 
-def update_order_status(order_id: int, status: str) -> dict | None:
+def _orders_page_params(user_id: str | None, after: tuple[datetime, int] | None, limit: int) -> tuple[str, dict]:
+    query = SELECT_ORDERS_PAGE[(user_id is not None, after is not None)]
+    params = {"user_id": user_id, "limit": limit}
+    if after is not None:
+        params["created_at"], params["id"] = after
+    return query, params
+
+def list_orders(user_id: str | None = None, after: tuple[datetime, int] | None = None, limit: int = 50) -> list[dict]:
+    """
+    Get one page of orders, newest first
+
+    Args:
+        user_id (str | None): Only orders of this user, None for all orders
+        after (tuple[datetime, int] | None): (created_at, id) of the last order
+                                             of the previous page, None for the first page
+        limit (int): Maximum number of orders
+
+    Returns:
+        list[dict]: Orders; fewer than limit on the last page
+    """
+    query, params = _orders_page_params(user_id, after, limit)
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(query, params)
+            return cur.fetchall()
+
+def pay_order(order_id: int) -> dict:
+    """
+    Debit the wallet for a reserved order, then mark it paid
+
+    Args:
+        order_id (int): The ID of the order
+
+    Returns:
+        dict: "status" is one of ok, order_not_found, already_paid,
+              order_not_pending, reservation_expired, wallet_not_found or
+              insufficient_balance;
+              "balance" is the wallet balance (after payment when ok)
+    """
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(PAY_ORDER, (order_id, WALLET_LEDGER_ENABLED))
+            row = cur.fetchone()
+            conn.commit()
+    return {"status": row['result'], "balance": row['wallet_balance']}
+
+
+def update_order_status(order_id: int, status: str) -> dict:
     """
     Update the status of an order
 
+    "paid" pays for the order with pay_order; the stock of a "cancelled"
+    order is given back by the reservation sweeper.
+
     Args:
         order_id (int): The ID of the order
         status (str): The new status (pending, confirmed, paid, cancelled)
 
     Returns:
-        dict | None: Order information after update, None if failed
+        dict: The pay_order result for "paid"; otherwise "status" is ok or
+              order_not_found
     """
+    if status == 'paid':
+        return pay_order(order_id)
     with get_db_connection() as conn:
         with conn.cursor() as cur:
             cur.execute(
-                """
-                UPDATE "order"
-                SET status = %s,
-                    updated_at = CURRENT_TIMESTAMP
-                WHERE id = %s
-                RETURNING id
-                """,
+                UPDATE_ORDER_STATUS,
                 (status, order_id)
             )
             result = cur.fetchone()
             conn.commit()
-            return bool(result)
+            return {"status": "ok" if result else "order_not_found"}
+
+
+def release_reservations(batch_size: int = RESERVATION_SWEEP_BATCH_SIZE) -> int:
+    """
+    Give back the stock of expired reservations and of cancelled orders
+
+    Works in batches of batch_size reservations, one transaction each, and
+    refreshes the displayed stock of sharded products afterwards.
+
+    Args:
+        batch_size (int): Reservations released per transaction
+
+    Returns:
+        int: Number of reservations released
+    """
+    released = 0
+    while True:
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(RELEASE_RESERVATIONS, (batch_size,))
+                count = cur.fetchone()['released']
+                conn.commit()
+        released += count
+        if count < batch_size:
+            break
+    refresh_sharded_stock()
+    return released
+
+
+def _sweep_reservations():
+    while not _sweeper_stop.wait(RESERVATION_SWEEP_INTERVAL):
+        try:
+            released = release_reservations()
+            if released:
+                logger.info(f"Released {released} stock reservations")
+        except Exception as e:
+            logger.warning(f"Stock reservation sweep failed: {e}")
+
+
+def start_reservation_sweeper():
+    """
+    Start a background thread that releases expired stock reservations
+    """
+    global _sweeper_thread
+    if _sweeper_thread is not None and _sweeper_thread.is_alive():
+        return
+    _sweeper_stop.clear()
+    _sweeper_thread = threading.Thread(target=_sweep_reservations, name="reservation-sweeper", daemon=True)
+    _sweeper_thread.start()
+
+
+def stop_reservation_sweeper():
+    """
+    Stop the reservation sweeper thread
+    """
+    global _sweeper_thread
+    _sweeper_stop.set()
+    if _sweeper_thread is not None:
+        _sweeper_thread.join(timeout=5)
+        _sweeper_thread = None
+
+
+async def areserve_order(user_id: str, product_id: int, quantity: int, total_amount: Decimal, ttl: float = ORDER_RESERVATION_TTL) -> dict:
+    """
+    Async version of reserve_order
+    """
+    async with get_async_db_connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(RESERVE_ORDER, (user_id, product_id, quantity, total_amount, ttl))
+            row = await cur.fetchone()
+            await conn.commit()
+    if row['result'] == 'ok':
+        invalidate_product(product_id)
+    return _reserve_order_result(row, user_id, product_id, quantity, total_amount)
+
+
+async def acreate_order(user_id: str, product_id: int, quantity: int, total_amount: Decimal) -> dict | None:
+    """
+    Async version of create_order
+    """
+    return (await areserve_order(user_id, product_id, quantity, total_amount))["order"]
+
+
+async def aplace_order(user_id: str, product_id: int, quantity: int, total_amount: Decimal) -> dict:
+    """
+    Async version of place_order
+    """
+    async with get_async_db_connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(_place_order_query(), (user_id, product_id, quantity, total_amount))
+            row = await cur.fetchone()
+            await conn.commit()
+    if row['result'] == 'ok':
+        invalidate_product(product_id)
+    return _place_order_result(row, user_id, product_id, quantity, total_amount)
+
+
+async def alist_orders(user_id: str | None = None, after: tuple[datetime, int] | None = None, limit: int = 50) -> list[dict]:
+    """
+    Async version of list_orders
+    """
+    query, params = _orders_page_params(user_id, after, limit)
+    async with get_async_db_connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(query, params)
+            return await cur.fetchall()
+
+async def aiter_orders(user_id: str | None = None, batch_size: int = ORDER_EXPORT_BATCH_SIZE) -> AsyncIterator[dict]:
+    """
+    Iterate over all orders, newest first, fetching them page by page
+
+    Every page is a short query on its own pooled connection, so a slow
+    consumer never holds a connection or a transaction open, and each page
+    costs the same however deep into the history it is.
+
+    Args:
+        user_id (str | None): Only orders of this user, None for all orders
+        batch_size (int): Orders fetched per query
+
+    Returns:
+        AsyncIterator[dict]: Orders
+    """
+    after = None
+    while True:
+        orders = await alist_orders(user_id, after, batch_size)
+        for order in orders:
+            yield order
+        if len(orders) < batch_size:
+            return
+        after = (orders[-1]['created_at'], orders[-1]['id'])
+
+async def apay_order(order_id: int) -> dict:
+    """
+    Async version of pay_order
+    """
+    async with get_async_db_connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(PAY_ORDER, (order_id, WALLET_LEDGER_ENABLED))
+            row = await cur.fetchone()
+            await conn.commit()
+    return {"status": row['result'], "balance": row['wallet_balance']}
+
+async def aupdate_order_status(order_id: int, status: str) -> dict:
+    """
+    Async version of update_order_status
+    """
+    if status == 'paid':
+        return await apay_order(order_id)
+    async with get_async_db_connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                UPDATE_ORDER_STATUS,
+                (status, order_id)
+            )
+            result = await cur.fetchone()
+            await conn.commit()
+            return {"status": "ok" if result else "order_not_found"}
 
 if __name__ == '__main__':
-    init_order_table()
\ No newline at end of file
+    from app.db.migrations import migrate
+    migrate()
\ No newline at end of file
@@ -1,65 +1,228 @@
-import os
+import sys, os
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, project_root)
+
+import logging
+import threading
 import psycopg
-from psycopg.rows import dict_row
-from dotenv import load_dotenv
 
-load_dotenv(override=True)
+from app.db.connection import get_db_connection, get_async_db_connection, get_conninfo
+from app.utils.cache import LRUCache
+from app.utils.text import normalize_text
+
+SEARCH_RESULT_LIMIT = int(os.getenv('SEARCH_RESULT_LIMIT', '5'))
+CATALOG_CACHE_SIZE = int(os.getenv('CATALOG_CACHE_SIZE', '1024'))
+CATALOG_CACHE_TTL = float(os.getenv('CATALOG_CACHE_TTL', '60'))
+
+# Postgres channel the product table triggers notify on: the payload is a
+# product id for row changes, or empty when the whole catalog must be dropped
+CATALOG_CHANNEL = "product_changed"
+# Transaction-local setting that mutes the triggers during a bulk import,
+# which sends one empty notification per batch instead
+BULK_LOAD_SETTING = "shop_bot.bulk_load"
+
+logger = logging.getLogger(__name__)
+
+# Search results are cached as (product_id, score) pairs and product rows by id,
+# so a stock change only has to drop one product row to stay consistent
+_search_cache = LRUCache(maxsize=CATALOG_CACHE_SIZE, ttl=CATALOG_CACHE_TTL)
+_product_cache = LRUCache(maxsize=CATALOG_CACHE_SIZE, ttl=CATALOG_CACHE_TTL)
+_catalog_version = 0
+_listener_stop = threading.Event()
+_listener_thread: threading.Thread | None = None
+
+# Names are compared lowercased and with Vietnamese diacritics folded
+# ("Điện thoại" -> "dien thoai"). The same expression backs idx_product_name_trgm,
+# so the <% (word similarity) filter is served by the trigram index.
+SEARCH_PRODUCTS = """
+    SELECT
+        id,
+        name,
+        description,
+        price,
+        stock,
+        specifications,
+        created_at,
+        updated_at,
+        word_similarity(immutable_unaccent(lower(%(query)s)), immutable_unaccent(lower(name))) AS score
+    FROM product
+    WHERE immutable_unaccent(lower(%(query)s)) <%% immutable_unaccent(lower(name))
+    ORDER BY
+        score DESC,
+        similarity(immutable_unaccent(lower(%(query)s)), immutable_unaccent(lower(name))) DESC,
+        id
+    LIMIT %(limit)s
+"""
+
+SELECT_PRODUCT_BY_ID = """
+    SELECT
+        id,
+        name,
+        description,
+        price,
+        stock,
+        specifications,
+        created_at,
+        updated_at
+    FROM product
+    WHERE id = %s
+"""
+
+# Through take_stock() / return_stock() so sharded products use their shards
+TAKE_PRODUCT_STOCK = """
+    SELECT 1 FROM take_stock(%s, %s) LIMIT 1
+"""
+
+RETURN_PRODUCT_STOCK = """
+    SELECT return_stock(id, NULL, %s) FROM product WHERE id = %s
+"""
+
+SHARD_PRODUCT_STOCK = """
+    SELECT shard_product_stock(%s, %s) AS stock
+"""
+
+# Product.stock of a sharded product is the shard total, kept for display
+REFRESH_SHARDED_STOCK = """
+    UPDATE product p
+    SET stock = totals.stock,
+        updated_at = CURRENT_TIMESTAMP
+    FROM (
+        SELECT s.product_id, sum(s.stock)::INTEGER AS stock
+        FROM product_stock_shard s
+        GROUP BY s.product_id
+    ) AS totals
+    WHERE p.id = totals.product_id AND p.stock_shards > 0 AND p.stock <> totals.stock
+"""
 
-DB_NAME = os.getenv('DB_NAME')
-DB_USERNAME = os.getenv('DB_USERNAME')
-DB_PASSWORD = os.getenv('DB_PASSWORD')
-DB_HOST = os.getenv('DB_HOST')
-DB_PORT = os.getenv('DB_PORT')
+def _update_product_stock_query(product_id: int, quantity: int) -> tuple[str, tuple]:
+    if quantity > 0:
+        return TAKE_PRODUCT_STOCK, (product_id, quantity)
+    return RETURN_PRODUCT_STOCK, (-quantity, product_id)
 
-def get_db_connection():
+def get_catalog_version() -> int:
     """
-    Connect to PostgreSQL database
-    
+    Get a counter that changes every time cached catalog data is invalidated
+    """
+    return _catalog_version
+
+def invalidate_product(product_id: int):
+    """
+    Drop one product from the catalog cache
+    """
+    global _catalog_version
+    _catalog_version += 1
+    _product_cache.pop(product_id)
+
+def invalidate_catalog():
+    """
+    Drop every cached search result and product
+    """
+    global _catalog_version
+    _catalog_version += 1
+    _search_cache.clear()
+    _product_cache.clear()
+
+def get_catalog_cache_stats() -> dict:
+    """
+    Get hit/miss counters of the catalog cache
+
     Returns:
-        Connection: Connection to PostgreSQL database
-    
-    Raises:
-        Exception: If connection to database fails
-    """
-    try:
-        conn = psycopg.connect(
-            dbname=DB_NAME,
-            user=DB_USERNAME,
-            password=DB_PASSWORD,
-            host=DB_HOST,
-            port=DB_PORT,
-            row_factory=dict_row
-        )
-        return conn
-    except Exception as e:
-        raise RuntimeError(f"Error connecting to PostgreSQL: {e}")
-    
-def init_product_table():
+        dict: Counters of the search and product caches and the catalog version
+    """
+    return {
+        "search": _search_cache.stats(),
+        "product": _product_cache.stats(),
+        "version": _catalog_version,
+    }
+
+def _get_cached_search(query: str, limit: int) -> list[dict] | None:
+    hits = _search_cache.get((normalize_text(query), limit))
+    if hits is None:
+        return None
+    results = []
+    for product_id, score in hits:
+        product = _product_cache.get(product_id)
+        if product is None:
+            return None
+        results.append({**product, "score": score})
+    return results
+
+def _cache_search(query: str, limit: int, results: list[dict], version: int):
+    # Skip results read before an invalidation that happened while the query ran
+    if version != _catalog_version:
+        return
+    for row in results:
+        _product_cache.set(row["id"], {key: value for key, value in row.items() if key != "score"})
+    _search_cache.set((normalize_text(query), limit), [(row["id"], row["score"]) for row in results])
+
+def _cache_product(product: dict | None, version: int):
+    if product is not None and version == _catalog_version:
+        _product_cache.set(product["id"], product)
+
+def _listen_for_catalog_changes():
+    while not _listener_stop.is_set():
+        try:
+            with psycopg.connect(get_conninfo(), autocommit=True) as conn:
+                conn.execute(f"LISTEN {CATALOG_CHANNEL}")
+                # Changes made while we were not listening are unknown
+                invalidate_catalog()
+                while not _listener_stop.is_set():
+                    for notify in conn.notifies(timeout=1.0):
+                        if notify.payload:
+                            invalidate_product(int(notify.payload))
+                        else:
+                            invalidate_catalog()
+        except Exception as e:
+            logger.warning(f"Catalog change listener disconnected: {e}")
+            _listener_stop.wait(5)
+
+def start_catalog_listener():
+    """
+    Start a background thread that invalidates the catalog cache on
+    product_changed notifications sent by other workers and scripts
+    """
+    global _listener_thread
+    if _listener_thread is not None and _listener_thread.is_alive():
+        return
+    _listener_stop.clear()
+    _listener_thread = threading.Thread(target=_listen_for_catalog_changes, name="catalog-listener", daemon=True)
+    _listener_thread.start()
+
+def stop_catalog_listener():
     """
-    Initialize product table in database if not exists
-    Product table:
-    - Product name
-    - Description
-    - Price
-    - Stock
-    - Specifications
+    Stop the catalog change listener thread
     """
+    global _listener_thread
+    _listener_stop.set()
+    if _listener_thread is not None:
+        _listener_thread.join(timeout=5)
+        _listener_thread = None
+        
+def search_products(query: str, limit: int = SEARCH_RESULT_LIMIT) -> list[dict]:
+    """
+    Fuzzy search products by name
+
+    Matching is case and diacritic insensitive and tolerates partial names,
+    e.g. "samsung s24" finds "Samsung Galaxy S24 Ultra".
+
+    Args:
+        query (str): The (partial) product name to search for
+        limit (int): Maximum number of candidates to return
+
+    Returns:
+        list[dict]: Matching products, best match first, each with a "score" in [0, 1]
+    """
+    cached = _get_cached_search(query, limit)
+    if cached is not None:
+        return cached
+    version = _catalog_version
     with get_db_connection() as conn:
         with conn.cursor() as cur:
-            cur.execute("""
-                        CREATE TABLE IF NOT EXISTS product (
-                            id SERIAL PRIMARY KEY,
-                            name VARCHAR(255) NOT NULL,
-                            description TEXT,
-                            price DECIMAL(10, 2) NOT NULL,
-                            stock INTEGER NOT NULL DEFAULT 0,
-                            specifications JSONB,
-                            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                        )
-                        """)
-        conn.commit()
-        
+            cur.execute(SEARCH_PRODUCTS, {"query": query, "limit": limit})
+            results = cur.fetchall()
+    _cache_search(query, limit, results, version)
+    return results
+
 def get_product_by_name(name: str) -> dict | None:
     """
     Query product by name
@@ -68,27 +231,10 @@ def get_product_by_name(name: str) -> dict | None:
         name (str): The name of the product to search for
 
     Returns:
-        dict | None: Product information if found, None if not found
+        dict | None: Best matching product if found, None if not found
     """
-    with get_db_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute("""
-                        SELECT
-                            id,
-                            name,
-                            description,
-                            price,
-                            stock,
-                            specifications,
-                            created_at,
-                            updated_at
-                        FROM product
-                        WHERE LOWER(name) LIKE LOWER(%s)
-                        """,
-                        (name,))
-            result = cur.fetchone()
-
-            return result
+    results = search_products(name, limit=1)
+    return results[0] if results else None
 
 def check_product_stock(product_id: int, quantity: int) -> bool:
     """
@@ -101,19 +247,18 @@ def check_product_stock(product_id: int, quantity: int) -> bool:
     Returns:
         bool: True if the stock is >= the quantity to check, False if not enough
     """
-    with get_db_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute("""
-                        SELECT stock
-                        FROM product
-                        WHERE id = %s
-                        """,
-                        (product_id,))
-            result = cur.fetchone()
+    product = _product_cache.get(product_id)
+    if product is None:
+        version = _catalog_version
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(SELECT_PRODUCT_BY_ID, (product_id,))
+                product = cur.fetchone()
+        _cache_product(product, version)
+
+    return product is not None and product['stock'] >= quantity
+
 
-            return result and result['stock'] >= quantity
-        
-        
 def update_product_stock(product_id: int, quantity: int):
     """
     Update the stock of a product
@@ -127,21 +272,97 @@ def update_product_stock(product_id: int, quantity: int):
     """
     with get_db_connection() as conn:
         with conn.cursor() as cur:
-            cur.execute("""
-                        UPDATE product
-                        SET stock = stock - %s, updated_at = CURRENT_TIMESTAMP
-                        WHERE id = %s AND stock >= %s
-                        RETURNING id
-                        """,
-                        (quantity, product_id, quantity))
+            cur.execute(*_update_product_stock_query(product_id, quantity))
             result = cur.fetchone()
             conn.commit()
-            
-            return bool(result)
+    invalidate_product(product_id)
+
+    return bool(result)
+
+def shard_product_stock(product_id: int, shards: int) -> int | None:
+    """
+    Spread the stock of a hot product over several rows, so concurrent
+    orders of it lock different rows instead of queueing on one
+
+    Args:
+        product_id (int): ID of the product
+        shards (int): Number of stock shards, 0 to keep the stock in the product row again
+
+    Returns:
+        int | None: Total stock of the product, None if the product does not exist
+    """
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(SHARD_PRODUCT_STOCK, (product_id, shards))
+            result = cur.fetchone()
+            conn.commit()
+    invalidate_product(product_id)
+    return result['stock']
+
+def refresh_sharded_stock() -> int:
+    """
+    Copy the shard totals of sharded products into product.stock
+
+    Returns:
+        int: Number of products whose stock changed
+    """
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(REFRESH_SHARDED_STOCK)
+            updated = cur.rowcount
+            conn.commit()
+    return updated
+
+async def asearch_products(query: str, limit: int = SEARCH_RESULT_LIMIT) -> list[dict]:
+    """
+    Async version of search_products
+    """
+    cached = _get_cached_search(query, limit)
+    if cached is not None:
+        return cached
+    version = _catalog_version
+    async with get_async_db_connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(SEARCH_PRODUCTS, {"query": query, "limit": limit})
+            results = await cur.fetchall()
+    _cache_search(query, limit, results, version)
+    return results
+
+async def aget_product_by_name(name: str) -> dict | None:
+    """
+    Async version of get_product_by_name
+    """
+    results = await asearch_products(name, limit=1)
+    return results[0] if results else None
+
+async def acheck_product_stock(product_id: int, quantity: int) -> bool:
+    """
+    Async version of check_product_stock
+    """
+    product = _product_cache.get(product_id)
+    if product is None:
+        version = _catalog_version
+        async with get_async_db_connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(SELECT_PRODUCT_BY_ID, (product_id,))
+                product = await cur.fetchone()
+        _cache_product(product, version)
+    return product is not None and product['stock'] >= quantity
+
+async def aupdate_product_stock(product_id: int, quantity: int) -> bool:
+    """
+    Async version of update_product_stock
+    """
+    async with get_async_db_connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(*_update_product_stock_query(product_id, quantity))
+            result = await cur.fetchone()
+            await conn.commit()
+    invalidate_product(product_id)
+    return bool(result)
         
 
 def main():
-    init_product_table()
     print(get_product_by_name("iPhone 16 pro Max"))
     
 if __name__ == '__main__':
@@ -1,9 +1,13 @@
-import json
+import sys, os
+import argparse
 from decimal import Decimal
+from typing import Iterator
 
-from product_service import init_product_table, get_db_connection
-from order_service import init_order_table
-from wallet_service import init_wallet_table, create_wallet
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, project_root)
+
+from app.db.catalog_import import import_products, import_wallets
+from app.db.migrations import migrate
 
 
 SAMPLE_PRODUCTS = [
@@ -104,47 +108,55 @@ SAMPLE_USERS = [
     }
 ]
 
-def seed_products():
-    """Seed products into database"""
-    with get_db_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute("TRUNCATE TABLE product CASCADE")
-            
-            for product in SAMPLE_PRODUCTS:
-                cur.execute(
-                    """
-                    INSERT INTO product (name, description, price, stock, specifications)
-                    VALUES (%s, %s, %s, %s, %s)
-                    """,
-                    (
-                        product["name"],
-                        product["description"],
-                        product["price"],
-                        product["stock"],
-                        json.dumps(product["specifications"])
-                    )
-                )
-        conn.commit()
+DEFAULT_BALANCE = Decimal("200000000")
+
+def generate_products(count: int = len(SAMPLE_PRODUCTS)) -> Iterator[dict]:
+    """
+    Generate a catalog of the given size
+
+    The sample products come first; beyond them each sample is repeated as a
+    numbered variant, e.g. "Xiaomi 14 Pro (2)".
+    """
+    for index in range(count):
+        sample = SAMPLE_PRODUCTS[index % len(SAMPLE_PRODUCTS)]
+        variant = index // len(SAMPLE_PRODUCTS)
+        yield {
+            **sample,
+            "name": f"{sample['name']} ({variant})" if variant else sample["name"],
+        }
+
+def generate_users(count: int = len(SAMPLE_USERS)) -> Iterator[dict]:
+    """
+    Generate wallets user1..userN; the sample users keep their balances
+    """
+    yield from SAMPLE_USERS[:count]
+    for index in range(len(SAMPLE_USERS), count):
+        yield {"user_id": f"user{index + 1}", "balance": DEFAULT_BALANCE}
+
+def seed_products(count: int = len(SAMPLE_PRODUCTS)):
+    """Seed products into database, updating the ones that already exist by name"""
+    print(import_products(generate_products(count)))
 
-def seed_wallets():
-    """Seed user wallets into database"""
-    for user in SAMPLE_USERS:
-        create_wallet(user["user_id"], user["balance"])
+def seed_wallets(count: int = len(SAMPLE_USERS)):
+    """Seed user wallets into database, resetting the balance of existing ones"""
+    print(import_wallets(generate_users(count)))
 
-def init_and_seed_database():
+def init_and_seed_database(products: int = len(SAMPLE_PRODUCTS), users: int = len(SAMPLE_USERS)):
     """Initialize tables and seed data"""
-    print("Initializing tables...")
-    init_product_table()
-    init_order_table()
-    init_wallet_table()
+    print("Applying migrations...")
+    migrate()
     
-    print("Seeding products...")
-    seed_products()
+    print(f"Seeding {products} products...")
+    seed_products(products)
     
-    print("Seeding user wallets...")
-    seed_wallets()
+    print(f"Seeding {users} user wallets...")
+    seed_wallets(users)
     
     print("Database initialization and seeding completed!")
 
 if __name__ == "__main__":
-    init_and_seed_database() 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Initialize tables and seed sample data")
+    parser.add_argument("--products", type=int, default=len(SAMPLE_PRODUCTS), help="Number of products to generate")
+    parser.add_argument("--users", type=int, default=len(SAMPLE_USERS), help="Number of user wallets to generate")
+    args = parser.parse_args()
+    init_and_seed_database(args.products, args.users)
@@ -2,29 +2,109 @@ import sys, os
 project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
 sys.path.insert(0, project_root)
 
-from app.db.product_service import get_db_connection
+from app.db.connection import get_db_connection, get_async_db_connection, get_conninfo
 from decimal import Decimal
+import logging
+import threading
 
-def init_wallet_table():
-    """
-    Initialize user_wallet table in database if not exists
-    This table stores information about user's wallet, including:
-    - User ID
-    - Balance
-    - Created and updated time
-    """
-    with get_db_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS user_wallet (
-                    id SERIAL PRIMARY KEY,
-                    user_id VARCHAR(255) NOT NULL UNIQUE,
-                    balance DECIMAL(15,2) NOT NULL DEFAULT 0,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-        conn.commit()
+import psycopg
+from psycopg.rows import dict_row
+
+logger = logging.getLogger(__name__)
+
+# row: mỗi giao dịch cập nhật trực tiếp dòng user_wallet (khóa dòng đó đến khi commit).
+# ledger: mỗi giao dịch là một dòng mới trong wallet_ledger; chỉ các lần trừ tiền
+# của cùng một ví phải chờ nhau, cộng tiền (hoàn tiền, nạp tiền) không phải chờ.
+# Các bút toán được gộp định kỳ vào user_wallet.balance bởi start_wallet_compactor().
+WALLET_MODE = os.getenv('WALLET_MODE', 'row').lower()
+WALLET_LEDGER_ENABLED = WALLET_MODE == 'ledger'
+WALLET_COMPACT_INTERVAL = float(os.getenv('WALLET_COMPACT_INTERVAL', '30'))
+WALLET_LEDGER_PAGE_SIZE = int(os.getenv('WALLET_LEDGER_PAGE_SIZE', '50'))
+
+_compactor_stop = threading.Event()
+_compactor_thread: threading.Thread | None = None
+
+# Số dư = snapshot trong user_wallet + các bút toán chưa được gộp vào snapshot
+WALLET_BALANCE = """
+    w.balance + COALESCE((
+        SELECT sum(l.amount)
+        FROM wallet_ledger l
+        WHERE l.user_id = w.user_id AND l.id > w.ledger_id
+    ), 0)
+"""
+
+SELECT_WALLET = f"""
+    SELECT 
+        w.id,
+        w.user_id,
+        {WALLET_BALANCE} AS balance,
+        w.created_at,
+        w.updated_at
+    FROM user_wallet w
+    WHERE w.user_id = %s
+"""
+
+SELECT_WALLET_USER = """
+    SELECT user_id FROM user_wallet WHERE user_id = %s
+"""
+
+# Bỏ qua các bút toán còn lại từ lúc bật chế độ ledger, như ghi đè số dư
+RESET_WALLET_BALANCE = """
+    UPDATE user_wallet 
+    SET balance = %s,
+        ledger_id = (SELECT COALESCE(max(id), 0) FROM wallet_ledger WHERE user_id = %s),
+        updated_at = CURRENT_TIMESTAMP
+    WHERE user_id = %s
+    RETURNING user_id, balance
+"""
+
+RESET_WALLET_BALANCE_LEDGER = """
+    SELECT user_id, balance FROM wallet_reset(%s, %s)
+"""
+
+INSERT_WALLET = """
+    INSERT INTO user_wallet (user_id, balance)
+    VALUES (%s, %s)
+    RETURNING user_id, balance
+"""
+
+UPDATE_WALLET_BALANCE = f"""
+    UPDATE user_wallet w
+    SET balance = w.balance + %(amount)s,
+        updated_at = CURRENT_TIMESTAMP
+    WHERE w.user_id = %(user_id)s AND {WALLET_BALANCE} + %(amount)s >= 0
+    RETURNING 
+        w.id,
+        w.user_id,
+        {WALLET_BALANCE} AS balance,
+        w.created_at,
+        w.updated_at
+"""
+
+POST_WALLET_ENTRY = """
+    SELECT result, wallet_balance, entry_id
+    FROM wallet_post(%(user_id)s, %(amount)s, %(reason)s, %(order_id)s)
+"""
+
+SELECT_LEDGER_PAGE = """
+    SELECT id, user_id, amount, reason, order_id, created_at
+    FROM wallet_ledger
+    WHERE user_id = %(user_id)s AND id < %(before)s
+    ORDER BY id DESC
+    LIMIT %(limit)s
+"""
+
+# Ví có bút toán mới kể từ lần gộp trước
+SELECT_PENDING_WALLETS = """
+    SELECT user_id, max(id) AS last_id
+    FROM wallet_ledger
+    WHERE id > %s
+    GROUP BY user_id
+"""
+
+COMPACT_WALLET = """
+    SELECT wallet_compact(%s) AS folded
+"""
 
 def get_wallet(user_id: str) -> dict | None:
     """
@@ -39,21 +119,17 @@ def get_wallet(user_id: str) -> dict | None:
     with get_db_connection() as conn:
         with conn.cursor() as cur:
             cur.execute(
-                """
-                SELECT 
-                    id,
-                    user_id,
-                    balance,
-                    created_at,
-                    updated_at
-                FROM user_wallet 
-                WHERE user_id = %s
-                """,
+                SELECT_WALLET,
                 (user_id,)
             )
             result = cur.fetchone()
             return result
 
+def _reset_wallet_query(user_id: str, balance: Decimal) -> tuple[str, tuple]:
+    if WALLET_LEDGER_ENABLED:
+        return RESET_WALLET_BALANCE_LEDGER, (user_id, balance)
+    return RESET_WALLET_BALANCE, (balance, user_id, user_id)
+
 def create_wallet(user_id: str, initial_balance: Decimal = Decimal('0')) -> dict | None:
     """
     Tạo ví mới cho người dùng
@@ -68,28 +144,16 @@ def create_wallet(user_id: str, initial_balance: Decimal = Decimal('0')) -> dict
     with get_db_connection() as conn:
         with conn.cursor() as cur:
             cur.execute(
-                """
-                SELECT user_id FROM user_wallet WHERE user_id = %s
-                """,(user_id,)
+                SELECT_WALLET_USER, (user_id,)
             )
             exist = cur.fetchone()
             if exist:
                 cur.execute(
-                    """
-                    UPDATE user_wallet 
-                    SET balance = %s,
-                        updated_at = CURRENT_TIMESTAMP
-                    WHERE user_id = %s
-                    RETURNING user_id, balance
-                    """, (initial_balance, user_id)
+                    *_reset_wallet_query(user_id, initial_balance)
                 )
             else:
                 cur.execute(
-                    """
-                    INSERT INTO user_wallet (user_id, balance)
-                    VALUES (%s, %s)
-                    RETURNING user_id, balance
-                    """,
+                    INSERT_WALLET,
                     (user_id, initial_balance)
                 )
                 
@@ -97,37 +161,166 @@ def create_wallet(user_id: str, initial_balance: Decimal = Decimal('0')) -> dict
             conn.commit()
             return result
 
-def update_balance(user_id: str, amount: Decimal) -> dict | None:
+def _update_balance_params(user_id: str, amount: Decimal, reason: str, order_id: int | None) -> dict:
+    return {"user_id": user_id, "amount": amount, "reason": reason, "order_id": order_id}
+
+def update_balance(user_id: str, amount: Decimal, reason: str = 'adjustment', order_id: int | None = None) -> dict | None:
     """
     Cập nhật số dư trong ví của người dùng
     
     Args:
         user_id (str): ID của người dùng
         amount (Decimal): Số tiền cần thay đổi (dương để thêm vào, âm để trừ đi)
+        reason (str): Lý do ghi vào sổ cái, ví dụ refund hoặc top_up (chỉ dùng ở chế độ ledger)
+        order_id (int | None): Đơn hàng liên quan (chỉ dùng ở chế độ ledger)
         
     Returns:
         dict | None: Thông tin ví sau khi cập nhật, None nếu thất bại hoặc số dư không đủ
     """
+    params = _update_balance_params(user_id, amount, reason, order_id)
     with get_db_connection() as conn:
         with conn.cursor() as cur:
-            cur.execute(
-                """
-                UPDATE user_wallet
-                SET balance = balance + %s,
-                    updated_at = CURRENT_TIMESTAMP
-                WHERE user_id = %s AND balance + %s >= 0
-                RETURNING 
-                    id,
-                    user_id,
-                    balance,
-                    created_at,
-                    updated_at
-                """,
-                (amount, user_id, amount)
-            )
-            result = cur.fetchone()
+            if not WALLET_LEDGER_ENABLED:
+                cur.execute(UPDATE_WALLET_BALANCE, params)
+                result = cur.fetchone()
+                conn.commit()
+                return result
+            cur.execute(POST_WALLET_ENTRY, params)
+            posted = cur.fetchone()
             conn.commit()
-            return result 
-        
+            if posted['result'] != 'ok':
+                return None
+            cur.execute(SELECT_WALLET, (user_id,))
+            return cur.fetchone()
+
+def list_ledger(user_id: str, before: int | None = None, limit: int = WALLET_LEDGER_PAGE_SIZE) -> list[dict]:
+    """
+    Lấy lịch sử bút toán của ví, mới nhất trước
+
+    Args:
+        user_id (str): ID của người dùng
+        before (int | None): Chỉ lấy các bút toán có id nhỏ hơn (id cuối của trang trước)
+        limit (int): Số bút toán tối đa
+
+    Returns:
+        list[dict]: Các bút toán (amount âm là trừ tiền)
+    """
+    params = {"user_id": user_id, "before": before or 2**63 - 1, "limit": limit}
+    with get_db_connection() as conn:
+        return conn.execute(SELECT_LEDGER_PAGE, params).fetchall()
+
+async def aget_wallet(user_id: str) -> dict | None:
+    """
+    Phiên bản async của get_wallet
+    """
+    async with get_async_db_connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(SELECT_WALLET, (user_id,))
+            return await cur.fetchone()
+
+async def acreate_wallet(user_id: str, initial_balance: Decimal = Decimal('0')) -> dict | None:
+    """
+    Phiên bản async của create_wallet
+    """
+    async with get_async_db_connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(SELECT_WALLET_USER, (user_id,))
+            exist = await cur.fetchone()
+            if exist:
+                await cur.execute(*_reset_wallet_query(user_id, initial_balance))
+            else:
+                await cur.execute(INSERT_WALLET, (user_id, initial_balance))
+            result = await cur.fetchone()
+            await conn.commit()
+            return result
+
+async def aupdate_balance(user_id: str, amount: Decimal, reason: str = 'adjustment', order_id: int | None = None) -> dict | None:
+    """
+    Phiên bản async của update_balance
+    """
+    params = _update_balance_params(user_id, amount, reason, order_id)
+    async with get_async_db_connection() as conn:
+        async with conn.cursor() as cur:
+            if not WALLET_LEDGER_ENABLED:
+                await cur.execute(UPDATE_WALLET_BALANCE, params)
+                result = await cur.fetchone()
+                await conn.commit()
+                return result
+            await cur.execute(POST_WALLET_ENTRY, params)
+            posted = await cur.fetchone()
+            await conn.commit()
+            if posted['result'] != 'ok':
+                return None
+            await cur.execute(SELECT_WALLET, (user_id,))
+            return await cur.fetchone()
+
+async def alist_ledger(user_id: str, before: int | None = None, limit: int = WALLET_LEDGER_PAGE_SIZE) -> list[dict]:
+    """
+    Phiên bản async của list_ledger
+    """
+    params = {"user_id": user_id, "before": before or 2**63 - 1, "limit": limit}
+    async with get_async_db_connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(SELECT_LEDGER_PAGE, params)
+            return await cur.fetchall()
+
+def compact_wallets(since: int = 0) -> tuple[int, int]:
+    """
+    Gộp các bút toán mới vào snapshot số dư của từng ví
+
+    Mỗi ví được gộp trong một giao dịch riêng; trong lúc đó các giao dịch mới
+    của ví đó chờ một chút, các ví khác không bị ảnh hưởng.
+
+    Args:
+        since (int): Chỉ xét các ví có bút toán với id lớn hơn giá trị này
+                     (id lớn nhất đã thấy ở lần gộp trước)
+
+    Returns:
+        tuple[int, int]: Số bút toán đã gộp và id lớn nhất đã thấy
+    """
+    folded = 0
+    with psycopg.connect(get_conninfo(), autocommit=True, row_factory=dict_row) as conn:
+        pending = conn.execute(SELECT_PENDING_WALLETS, (since,)).fetchall()
+        for row in pending:
+            folded += conn.execute(COMPACT_WALLET, (row['user_id'],)).fetchone()['folded']
+            since = max(since, row['last_id'])
+    return folded, since
+
+def _run_wallet_compactor():
+    # Một bút toán commit sau một bút toán có id lớn hơn có thể bị bỏ qua ở lần
+    # quét này; số dư vẫn đúng, nó chỉ được gộp ở lần ví đó được gộp tiếp theo
+    since = 0
+    while not _compactor_stop.wait(WALLET_COMPACT_INTERVAL):
+        try:
+            folded, since = compact_wallets(since)
+            if folded:
+                logger.info(f"Compacted {folded} wallet ledger entries")
+        except Exception as e:
+            logger.warning(f"Wallet ledger compaction failed: {e}")
+
+def start_wallet_compactor():
+    """
+    Khởi động luồng nền gộp sổ cái ví định kỳ (chỉ ở chế độ ledger)
+    """
+    global _compactor_thread
+    if not WALLET_LEDGER_ENABLED:
+        return
+    if _compactor_thread is not None and _compactor_thread.is_alive():
+        return
+    _compactor_stop.clear()
+    _compactor_thread = threading.Thread(target=_run_wallet_compactor, name="wallet-compactor", daemon=True)
+    _compactor_thread.start()
+
+def stop_wallet_compactor():
+    """
+    Dừng luồng gộp sổ cái ví
+    """
+    global _compactor_thread
+    _compactor_stop.set()
+    if _compactor_thread is not None:
+        _compactor_thread.join(timeout=5)
+        _compactor_thread = None
+
 if __name__ == '__main__':
-    init_wallet_table()
\ No newline at end of file
+    from app.db.migrations import migrate
+    migrate()
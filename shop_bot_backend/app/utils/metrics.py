@@ -0,0 +1,233 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Iterable
+
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_registry: dict[str, "Metric"] = {}
+_registry_lock = threading.Lock()
+_collectors: list[Callable[[], Iterable[tuple]]] = []
+
+class Metric:
+    """
+    Base class for in-process metrics identified by name and label values.
+
+    Metrics register themselves on creation; creating a metric with a name that
+    already exists returns the existing instance, so modules can declare their
+    metrics at import time without coordinating.
+    """
+    kind = "untyped"
+
+    def __new__(cls, name: str, documentation: str, labelnames: tuple[str, ...] = (), **kwargs):
+        with _registry_lock:
+            existing = _registry.get(name)
+            if existing is not None:
+                if not isinstance(existing, cls):
+                    raise ValueError(f"Metric {name} already registered as {existing.kind}")
+                return existing
+            metric = super().__new__(cls)
+            metric._initialized = False
+            _registry[name] = metric
+            return metric
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        if self._initialized:
+            return
+        self._initialized = True
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: dict[tuple, object] = {}
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self) -> dict[tuple, object]:
+        """
+        Get a copy of the current value for every label combination
+        """
+        with self._lock:
+            return {key: self._copy(value) for key, value in self._values.items()}
+
+    def _copy(self, value):
+        return value
+
+class Counter(Metric):
+    """
+    Monotonically increasing count
+    """
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+class Gauge(Metric):
+    """
+    Value that can go up and down
+    """
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+class Histogram(Metric):
+    """
+    Distribution of observed values (latencies in seconds by default) in
+    cumulative buckets, plus their count and sum
+    """
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        if self._initialized:
+            return
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {"counts": [0] * (len(self.buckets) + 1), "count": 0, "sum": 0.0}
+            state["counts"][index] += 1
+            state["count"] += 1
+            state["sum"] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Observe the wall-clock duration of the with block
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _copy(self, value):
+        return {"counts": list(value["counts"]), "count": value["count"], "sum": value["sum"]}
+
+    def snapshot(self, **labels) -> dict:
+        """
+        Get count, sum, mean and approximate p50/p95/p99 for one label combination
+        """
+        with self._lock:
+            state = self._values.get(self._key(labels))
+            state = self._copy(state) if state else None
+        if not state or not state["count"]:
+            return {"count": 0, "sum": 0.0, "mean": 0.0, "p50": 0.0, "p95": 0.0, "p99": 0.0}
+        return {
+            "count": state["count"],
+            "sum": state["sum"],
+            "mean": state["sum"] / state["count"],
+            "p50": self._quantile(state, 0.5),
+            "p95": self._quantile(state, 0.95),
+            "p99": self._quantile(state, 0.99),
+        }
+
+    def _quantile(self, state: dict, q: float) -> float:
+        # Upper bound of the bucket holding the q-th observation
+        rank = q * state["count"]
+        seen = 0
+        for bound, count in zip(self.buckets, state["counts"]):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+def get_metrics() -> list[Metric]:
+    """
+    Get every registered metric
+    """
+    with _registry_lock:
+        return list(_registry.values())
+
+def register_collector(collector: Callable[[], Iterable[tuple]]):
+    """
+    Register a function called on every render to report values kept
+    elsewhere (pool and cache statistics) without mirroring them into metrics
+
+    The collector returns (name, kind, documentation, labels, value) tuples,
+    kind being "counter" or "gauge".
+    """
+    with _registry_lock:
+        _collectors.append(collector)
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _escape_help(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n")
+
+def _labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in labels.items()) + "}"
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, int) or float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+def _header(lines: list[str], name: str, kind: str, documentation: str):
+    lines.append(f"# HELP {name} {_escape_help(documentation)}")
+    lines.append(f"# TYPE {name} {kind}")
+
+def render_prometheus() -> str:
+    """
+    Render every metric and collector in the Prometheus text exposition format
+    """
+    lines: list[str] = []
+    for metric in sorted(get_metrics(), key=lambda m: m.name):
+        _header(lines, metric.name, metric.kind, metric.documentation)
+        for key, value in sorted(metric.samples().items()):
+            labels = dict(zip(metric.labelnames, key))
+            if isinstance(metric, Histogram):
+                cumulative = 0
+                for bound, count in zip(metric.buckets + (float("inf"),), value["counts"]):
+                    cumulative += count
+                    lines.append(f"{metric.name}_bucket{_labels({**labels, 'le': _number(bound)})} {cumulative}")
+                lines.append(f"{metric.name}_sum{_labels(labels)} {_number(value['sum'])}")
+                lines.append(f"{metric.name}_count{_labels(labels)} {value['count']}")
+            else:
+                lines.append(f"{metric.name}{_labels(labels)} {_number(value)}")
+
+    with _registry_lock:
+        collectors = list(_collectors)
+    families: dict[str, tuple[str, str, list[str]]] = {}
+    for collector in collectors:
+        for name, kind, documentation, labels, value in collector():
+            family = families.setdefault(name, (kind, documentation, []))
+            family[2].append(f"{name}{_labels(labels)} {_number(value)}")
+    for name, (kind, documentation, samples) in sorted(families.items()):
+        _header(lines, name, kind, documentation)
+        lines.extend(samples)
+    return "\n".join(lines) + "\n"
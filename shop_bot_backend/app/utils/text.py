@@ -0,0 +1,19 @@
+import re
+import unicodedata
+
+_WHITESPACE = re.compile(r"\s+")
+
+def fold_diacritics(text: str) -> str:
+    """
+    Remove Vietnamese diacritics, e.g. "Điện thoại" -> "Dien thoai"
+    """
+    decomposed = unicodedata.normalize("NFD", text)
+    stripped = "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+    return stripped.replace("đ", "d").replace("Đ", "D")
+
+def normalize_text(text: str) -> str:
+    """
+    Normalize free text for use as a lookup key: lowercase, diacritics folded
+    and whitespace collapsed
+    """
+    return _WHITESPACE.sub(" ", fold_diacritics(text).lower()).strip()
@@ -0,0 +1,41 @@
+"""
+Per-request agent construction overhead: rebuilding the model client, prompt
+and AgentExecutor on every call versus reusing the process-wide instance.
+
+No model API call is made, so any non-empty GOOGLE_API_KEY works:
+
+    GOOGLE_API_KEY=dummy python benchmarks/bench_agent_build.py --requests 200
+"""
+import sys, os
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+import argparse
+import time
+
+from app.core_ai import ai_service
+
+
+def per_request_ms(requests: int, rebuild: bool) -> float:
+    start = time.perf_counter()
+    for _ in range(requests):
+        if rebuild:
+            ai_service.get_chat_model.cache_clear()
+            ai_service.get_llm_and_agent.cache_clear()
+        ai_service.get_llm_and_agent()
+    return (time.perf_counter() - start) * 1000 / requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+
+    before = per_request_ms(args.requests, rebuild=True)
+    after = per_request_ms(args.requests, rebuild=False)
+    print(f"rebuild per request: {before:.3f} ms/request")
+    print(f"shared agent:        {after:.3f} ms/request")
+
+
+if __name__ == "__main__":
+    main()
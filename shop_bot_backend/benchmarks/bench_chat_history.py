@@ -0,0 +1,80 @@
+"""
+Recent-history load latency for long threads.
+
+Fills one thread with --messages rows, then measures get_recent_chat_history
+straight from Postgres (cache cleared before every call) and from the
+per-thread cache, and prints the query plan used for the database path.
+
+    python benchmarks/bench_chat_history.py --messages 10000 --loads 500
+"""
+import sys, os
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+import argparse
+import uuid
+
+from app.db import chat_history_service
+from app.db.chat_history_service import (
+    get_recent_chat_history, history_load_seconds, SELECT_RECENT_MESSAGES, HISTORY_LOOKBACK_DAYS
+)
+from app.db.connection import get_db_connection
+from app.db.migrations import migrate
+
+
+def fill_thread(thread_id: str, messages: int):
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                INSERT INTO message (thread_id, question, answer, created_at)
+                SELECT %s, 'Câu hỏi ' || i, repeat('Câu trả lời dài ', 50),
+                       now() - make_interval(secs => %s - i)
+                FROM generate_series(1, %s) AS i
+                """,
+                (thread_id, messages, messages),
+            )
+            cur.execute("ANALYZE message")
+        conn.commit()
+
+
+def print_plan(thread_id: str):
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("EXPLAIN (ANALYZE, COSTS OFF) " + SELECT_RECENT_MESSAGES, (thread_id, HISTORY_LOOKBACK_DAYS, 10))
+            for row in cur.fetchall():
+                print("   ", row["QUERY PLAN"])
+
+
+def report(source: str):
+    snap = history_load_seconds.snapshot(source=source)
+    print(f"{source:>5}: n={snap['count']} mean={snap['mean'] * 1000:.3f} ms "
+          f"p50<={snap['p50'] * 1000:.1f} ms p95<={snap['p95'] * 1000:.1f} ms p99<={snap['p99'] * 1000:.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--messages", type=int, default=10_000)
+    parser.add_argument("--loads", type=int, default=500)
+    args = parser.parse_args()
+
+    migrate()
+    thread_id = f"bench-{uuid.uuid4()}"
+    fill_thread(thread_id, args.messages)
+    try:
+        print("plan:")
+        print_plan(thread_id)
+        for _ in range(args.loads):
+            chat_history_service._history_cache.clear()
+            get_recent_chat_history(thread_id)
+        for _ in range(args.loads):
+            get_recent_chat_history(thread_id)
+        report("db")
+        report("cache")
+    finally:
+        with get_db_connection() as conn:
+            conn.execute("DELETE FROM message WHERE thread_id = %s", (thread_id,))
+
+
+if __name__ == "__main__":
+    main()
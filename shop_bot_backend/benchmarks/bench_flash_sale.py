@@ -0,0 +1,198 @@
+"""
+Flash sale of one product through stock reservations.
+
+Creates a product with --stock units and --buyers wallets; every buyer
+reserves one unit with areserve_order at the same time, then pays for it
+(--pay-share), cancels it (--cancel-share) or walks away and lets the
+reservation expire after --ttl seconds. The reservation sweeper runs
+throughout. Run once per --shards value (0 keeps the stock in the product
+row). After the last reservation has expired and been swept, checks that
+nothing was oversold: paid orders <= stock, the remaining stock equals the
+stock minus the paid units, every paid order debited its wallet once and no
+reservation is left held. Generated rows are deleted afterwards.
+
+Run with DB_POOL_MAX_SIZE well above 10, otherwise the pool and not the
+product row is the bottleneck.
+
+    DB_POOL_MAX_SIZE=50 python benchmarks/bench_flash_sale.py --buyers 1000 --stock 300 --shards 0,16
+"""
+import sys, os
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+import argparse
+import asyncio
+import random
+import statistics
+import threading
+import time
+from collections import Counter
+from decimal import Decimal
+
+from app.db.connection import get_db_connection, close_async_db_pool
+from app.db.migrations import migrate
+from app.db.order_service import apay_order, areserve_order, aupdate_order_status, release_reservations
+from app.db.product_service import refresh_sharded_stock, shard_product_stock
+
+PRICE = Decimal("1000000")
+USER_PREFIX = "bench-flash-"
+
+
+def setup(stock: int, buyers: int, shards: int) -> int:
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                INSERT INTO product (name, description, price, stock, specifications)
+                VALUES ('Bench flash sale reservations', 'Sản phẩm benchmark', %s, %s, '{"bench": true}')
+                RETURNING id
+                """,
+                (PRICE, stock),
+            )
+            product_id = cur.fetchone()["id"]
+            cur.execute(
+                """
+                INSERT INTO user_wallet (user_id, balance)
+                SELECT %s || i, %s FROM generate_series(1, %s) AS i
+                """,
+                (USER_PREFIX, PRICE, buyers),
+            )
+        conn.commit()
+    if shards:
+        shard_product_stock(product_id, shards)
+    return product_id
+
+
+def cleanup(product_id: int):
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM stock_reservation WHERE product_id = %s", (product_id,))
+            cur.execute("DELETE FROM wallet_ledger WHERE user_id LIKE %s", (USER_PREFIX + "%",))
+            cur.execute('DELETE FROM "order" WHERE product_id = %s', (product_id,))
+            cur.execute("DELETE FROM product WHERE id = %s", (product_id,))
+            cur.execute("DELETE FROM user_wallet WHERE user_id LIKE %s", (USER_PREFIX + "%",))
+        conn.commit()
+
+
+def verify(product_id: int, stock: int, paid: int) -> list[str]:
+    refresh_sharded_stock()
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            final_stock = cur.execute("SELECT stock FROM product WHERE id = %s", (product_id,)).fetchone()["stock"]
+            orders = Counter({
+                row["status"]: row["n"] for row in cur.execute(
+                    'SELECT status, count(*) AS n FROM "order" WHERE product_id = %s GROUP BY status', (product_id,)
+                )
+            })
+            reservations = Counter({
+                row["status"]: row["n"] for row in cur.execute(
+                    "SELECT status, sum(quantity) AS n FROM stock_reservation WHERE product_id = %s GROUP BY status",
+                    (product_id,),
+                )
+            })
+            debited = cur.execute(
+                "SELECT count(*) AS n FROM user_wallet WHERE user_id LIKE %s AND current_wallet_balance(user_id) < %s",
+                (USER_PREFIX + "%", PRICE),
+            ).fetchone()["n"]
+    problems = []
+    if paid > stock:
+        problems.append(f"{paid} units paid for a stock of {stock}")
+    if orders["paid"] != paid or reservations["committed"] != paid:
+        problems.append(f"{paid} payments, {orders['paid']} paid orders, {reservations['committed']} committed units")
+    if final_stock != stock - paid:
+        problems.append(f"final stock {final_stock} != {stock} - {paid}")
+    if reservations["held"]:
+        problems.append(f"{reservations['held']} units still held")
+    if orders["pending"]:
+        problems.append(f"{orders['pending']} orders still pending")
+    if debited != paid:
+        problems.append(f"{debited} wallets debited for {paid} payments")
+    return problems
+
+
+async def buy(user_id: str, product_id: int, args, rng: random.Random, latencies: list[float]) -> str:
+    start = time.perf_counter()
+    reserved = await areserve_order(user_id, product_id, 1, PRICE, ttl=args.ttl)
+    latencies.append((time.perf_counter() - start) * 1000)
+    if reserved["status"] != "ok":
+        return reserved["status"]
+    order_id = reserved["order"]["id"]
+    action = rng.random()
+    if action < args.pay_share:
+        return "paid" if (await apay_order(order_id))["status"] == "ok" else "payment_failed"
+    if action < args.pay_share + args.cancel_share:
+        await aupdate_order_status(order_id, "cancelled")
+        return "cancelled"
+    return "abandoned"
+
+
+async def flash_sale(product_id: int, args) -> tuple[Counter, list[float], float]:
+    rng = random.Random(42)
+    latencies = []
+    start = time.perf_counter()
+    outcomes = await asyncio.gather(*(
+        buy(f"{USER_PREFIX}{i}", product_id, args, rng, latencies) for i in range(1, args.buyers + 1)
+    ))
+    return Counter(outcomes), latencies, time.perf_counter() - start
+
+
+async def run(shards: int, args) -> list[str]:
+    product_id = setup(args.stock, args.buyers, shards)
+    stop = threading.Event()
+    released = 0
+
+    def sweep():
+        nonlocal released
+        while not stop.wait(args.sweep_interval):
+            released += release_reservations()
+
+    sweeper = threading.Thread(target=sweep, daemon=True)
+    sweeper.start()
+    try:
+        outcomes, latencies, elapsed = await flash_sale(product_id, args)
+        await asyncio.sleep(args.ttl)
+        stop.set()
+        sweeper.join()
+        released += release_reservations()
+
+        percentiles = statistics.quantiles(latencies, n=100)
+        print(f"shards={shards:<3} {args.buyers / elapsed:6.0f} buyers/s"
+              f"  reserve p50 {percentiles[49]:7.1f} ms p99 {percentiles[98]:7.1f} ms"
+              f"  released {released}  {dict(outcomes)}")
+        return verify(product_id, args.stock, outcomes["paid"])
+    finally:
+        stop.set()
+        cleanup(product_id)
+
+
+async def main_async(args) -> bool:
+    failed = False
+    try:
+        for shards in (int(s) for s in args.shards.split(",")):
+            problems = await run(shards, args)
+            if problems:
+                failed = True
+                print("FAILED: " + "; ".join(problems))
+    finally:
+        await close_async_db_pool()
+    return not failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--buyers", type=int, default=1000)
+    parser.add_argument("--stock", type=int, default=300)
+    parser.add_argument("--shards", default="0,16", help="Comma separated shard counts to compare")
+    parser.add_argument("--pay-share", type=float, default=0.6)
+    parser.add_argument("--cancel-share", type=float, default=0.2)
+    parser.add_argument("--ttl", type=float, default=10.0, help="Reservation lifetime in seconds")
+    parser.add_argument("--sweep-interval", type=float, default=0.5)
+    args = parser.parse_args()
+
+    migrate()
+    if not asyncio.run(main_async(args)):
+        sys.exit(1)
+    print("OK: no overselling")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Bulk catalog import throughput.
+
+Writes --products generated products (tagged with specifications.bench = true)
+to a gzipped JSON Lines file, imports it with app/db/catalog_import.py, then
+imports it again (all rows unchanged) and once more with new prices, and
+prints rows/s and peak memory for each pass. Generated rows are deleted
+afterwards unless --keep is given.
+
+    python benchmarks/bench_import.py --products 1000000
+"""
+import sys, os
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+import argparse
+import gzip
+import json
+import resource
+import tempfile
+
+import psycopg
+
+from app.db.catalog_import import import_products, read_records
+from app.db.connection import get_conninfo, get_db_connection
+from app.db.migrations import migrate
+from app.db.product_service import CATALOG_CHANNEL
+
+BRANDS = ["Samsung Galaxy", "iPhone", "Xiaomi", "OPPO Find", "Google Pixel", "Vivo", "Realme", "Nokia"]
+
+
+def write_catalog(path: str, count: int, price_offset: int = 0):
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        for i in range(count):
+            f.write(json.dumps({
+                "name": f"{BRANDS[i % len(BRANDS)]} {i % 97} {64 * (1 + i % 8)}GB #bench{i}",
+                "description": "Sản phẩm benchmark",
+                "price": 1000000 + (i % 500) * 100000 + price_offset,
+                "stock": i % 100,
+                "specifications": {"bench": True, "ram": f"{4 * (1 + i % 4)}GB"},
+            }, ensure_ascii=False) + "\n")
+
+
+def delete_products():
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM product WHERE specifications @> '{\"bench\": true}'")
+        conn.commit()
+
+
+def peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--products", type=int, default=200_000)
+    parser.add_argument("--batch-size", type=int, default=50_000)
+    parser.add_argument("--keep", action="store_true", help="keep imported products")
+    args = parser.parse_args()
+
+    migrate()
+    with tempfile.TemporaryDirectory() as tmp, psycopg.connect(get_conninfo(), autocommit=True) as listener:
+        listener.execute(f"LISTEN {CATALOG_CHANNEL}")
+        path = os.path.join(tmp, "products.jsonl.gz")
+        write_catalog(path, args.products)
+        changed = os.path.join(tmp, "products-changed.jsonl.gz")
+        write_catalog(changed, args.products, price_offset=1000)
+        print(f"Generated {args.products} products, peak memory {peak_rss_mb():.0f} MB")
+        try:
+            for label, source in (("insert", path), ("unchanged", path), ("update", changed)):
+                stats = import_products(read_records(source), args.batch_size)
+                notifies = sum(1 for _ in listener.notifies(timeout=0.5))
+                print(f"{label:10} {stats}  notifications={notifies}  peak memory {peak_rss_mb():.0f} MB")
+        finally:
+            if not args.keep:
+                delete_products()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Tail latency of model calls with a call deadline, retries and hedged requests.
+
+Sends --calls questions (--concurrency at a time) to the scripted fake model,
+which answers after --delay seconds but stalls for --stall-delay seconds on
+--stall-share of the calls and fails with a retryable error on --error-share
+of them. Compares, per mode:
+
+    raw     the fake model as is
+    retry   ResilientChatModel with --timeout per attempt and retries
+    hedge   the same plus a hedged request after the p95 latency
+
+and prints success rate, latency percentiles and the resilience events
+(chat_llm_resilience_events_total). Finally checks that a call made after a
+side-effecting tool ran (a create_order tool call in the messages) is not
+repeated. Runs offline, without a model API or a database.
+
+    python benchmarks/bench_llm_resilience.py --calls 2000 --stall-share 0.03 --stall-delay 10
+"""
+import sys, os
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+import argparse
+import asyncio
+import statistics
+import time
+
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+
+from app.core_ai.resilient_model import ResilientChatModel, llm_resilience_events
+from benchmarks.fake_llm import ScriptedChatModel
+
+EVENTS = ("timeout", "error", "retry", "hedge", "hedge_won", "gave_up", "not_repeated")
+
+
+def make_model(mode: str, args):
+    fake = ScriptedChatModel(
+        delay=args.delay,
+        stall_share=args.stall_share,
+        stall_delay=args.stall_delay,
+        error_share=args.error_share,
+        seed=42,
+    )
+    if mode == "raw":
+        return fake
+    return ResilientChatModel(
+        model=fake,
+        model_name=f"bench-{mode}",
+        timeout=args.timeout,
+        deadline=args.deadline,
+        max_retries=args.retries,
+        hedge=mode == "hedge",
+    )
+
+
+async def run(mode: str, args) -> dict:
+    model = make_model(mode, args)
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies, failures = [], 0
+
+    async def call(index: int):
+        nonlocal failures
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                await model.ainvoke([HumanMessage(content=f"Xin chào {index}")])
+                latencies.append((time.perf_counter() - start) * 1000)
+            except Exception:
+                failures += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(call(index) for index in range(args.calls)))
+    elapsed = time.perf_counter() - start
+
+    percentiles = statistics.quantiles(latencies, n=100)
+    events = {event: int(llm_resilience_events.value(model=f"bench-{mode}", event=event)) for event in EVENTS}
+    print(f"{mode:6} ok {len(latencies) / args.calls:7.2%}  p50 {percentiles[49]:7.1f} ms"
+          f"  p99 {percentiles[98]:7.1f} ms  max {max(latencies):7.1f} ms  {elapsed:5.1f} s"
+          + ("" if mode == "raw" else "  " + " ".join(f"{k}={v}" for k, v in events.items() if v)))
+    return events
+
+
+async def check_side_effects(args) -> list[str]:
+    # Every attempt stalls past the timeout: a repeatable call is retried, a
+    # call after create_order ran must time out once and not be repeated
+    model = ResilientChatModel(
+        model=ScriptedChatModel(stall_share=1.0, stall_delay=args.timeout * 3),
+        model_name="bench-side-effect",
+        timeout=args.timeout / 4,
+        deadline=args.deadline,
+        max_retries=args.retries,
+        backoff=0.01,
+    )
+    question = HumanMessage(content="Mình muốn mua 1 cái Xiaomi 14 Pro")
+    order_call = AIMessage(content="", tool_calls=[{
+        "name": "create_order", "args": {"product_id": 1, "quantity": 1}, "id": "call_bench",
+    }])
+    order_result = ToolMessage(content="Đặt hàng thành công", tool_call_id="call_bench")
+
+    problems = []
+    for messages, expected_timeouts in (([question], args.retries + 1), ([question, order_call, order_result], 1)):
+        before = llm_resilience_events.value(model="bench-side-effect", event="timeout")
+        try:
+            await model.ainvoke(messages)
+            problems.append("stalled call did not time out")
+        except TimeoutError:
+            pass
+        timeouts = llm_resilience_events.value(model="bench-side-effect", event="timeout") - before
+        if timeouts != expected_timeouts:
+            problems.append(f"{int(timeouts)} attempts instead of {expected_timeouts} for {len(messages)} messages")
+    return problems
+
+
+async def main_async(args) -> list[str]:
+    for mode in args.modes.split(","):
+        await run(mode, args)
+    return await check_side_effects(args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--delay", type=float, default=0.2, help="Normal latency of the fake model")
+    parser.add_argument("--stall-share", type=float, default=0.03)
+    parser.add_argument("--stall-delay", type=float, default=10.0)
+    parser.add_argument("--error-share", type=float, default=0.02)
+    parser.add_argument("--timeout", type=float, default=1.0, help="Per-attempt timeout of the resilient modes")
+    parser.add_argument("--deadline", type=float, default=5.0)
+    parser.add_argument("--retries", type=int, default=2)
+    parser.add_argument("--modes", default="raw,retry,hedge")
+    args = parser.parse_args()
+
+    problems = asyncio.run(main_async(args))
+    if problems:
+        print("FAILED: " + "; ".join(problems))
+        sys.exit(1)
+    print("OK: calls after a side-effecting tool are not repeated")
+
+
+if __name__ == "__main__":
+    main()
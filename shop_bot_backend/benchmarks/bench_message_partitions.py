@@ -0,0 +1,180 @@
+"""
+Chat history growth: monthly partitions of message vs one unpartitioned table.
+
+Writes --months months of synthetic history (--rows-per-month turns spread
+over --threads threads) into message, one partition per month starting at
+2000-01, and the same rows into an unpartitioned copy, bench_message_flat.
+After each month it times --inserts single-turn inserts into the newest month
+of both tables and prints the index size an insert has to maintain: the
+newest partition's indexes vs the whole index of the flat table.
+
+Then archives the oldest month with archive_message_partition, restores it
+with restore_message_archive and checks that every turn came back. The
+generated partitions and the flat table are dropped afterwards. Run against
+a test database: a maintenance thread with MESSAGE_RETENTION_MONTHS set
+would archive the generated months while this runs.
+
+    python benchmarks/bench_message_partitions.py --months 12 --rows-per-month 200000
+"""
+import sys, os
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+import argparse
+import random
+import statistics
+import tempfile
+import time
+import uuid
+from datetime import date, datetime, timedelta
+
+from app.db.connection import get_db_connection
+from app.db.message_partitions import archive_message_partition, list_message_partitions, restore_message_archive
+from app.db.migrations import migrate
+
+FIRST_MONTH = date(2000, 1, 1)
+FLAT_TABLE = "bench_message_flat"
+
+
+def month_start(index: int) -> date:
+    return date(FIRST_MONTH.year + index // 12, index % 12 + 1, 1)
+
+
+def setup():
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(f"DROP TABLE IF EXISTS {FLAT_TABLE}")
+            cur.execute(f"""
+                CREATE TABLE {FLAT_TABLE} (
+                    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+                    thread_id VARCHAR(255) NOT NULL,
+                    question TEXT NOT NULL,
+                    answer TEXT NOT NULL,
+                    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            cur.execute(f"CREATE INDEX ON {FLAT_TABLE} (thread_id, created_at DESC)")
+        conn.commit()
+
+
+def cleanup(months: int):
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            for index in range(months):
+                cur.execute(f"DROP TABLE IF EXISTS message_{month_start(index):%Y_%m}")
+            cur.execute(f"DROP TABLE IF EXISTS {FLAT_TABLE}")
+        conn.commit()
+
+
+def load_month(month: date, rows: int, threads: int):
+    seconds = ((month.replace(day=28) + timedelta(days=4)).replace(day=1) - month).total_seconds()
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT create_message_partition(%s)", (month,))
+            for table in ("message", FLAT_TABLE):
+                cur.execute(
+                    f"""
+                    INSERT INTO {table} (id, thread_id, question, answer, created_at)
+                    SELECT gen_random_uuid(), 'bench-thread-' || (random() * %s)::int,
+                           'Câu hỏi ' || i, repeat('Câu trả lời ', 20),
+                           %s::timestamp + make_interval(secs => random() * %s)
+                    FROM generate_series(1, %s) AS i
+                    """,
+                    (threads, month, seconds, rows),
+                )
+            cur.execute("ANALYZE message")
+            cur.execute(f"ANALYZE {FLAT_TABLE}")
+        conn.commit()
+
+
+def time_inserts(table: str, month: date, inserts: int, threads: int, rng: random.Random) -> list[float]:
+    timings = []
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            for i in range(inserts):
+                created_at = datetime.combine(month, datetime.min.time()) + timedelta(seconds=rng.randrange(86400 * 27))
+                start = time.perf_counter()
+                cur.execute(
+                    f"INSERT INTO {table} (id, thread_id, question, answer, created_at) VALUES (%s, %s, %s, %s, %s)",
+                    (uuid.uuid4(), f"bench-thread-{rng.randrange(threads)}", f"Câu hỏi {i}", "Câu trả lời", created_at),
+                )
+                conn.commit()
+                timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def flat_index_bytes() -> int:
+    with get_db_connection() as conn:
+        return conn.execute("SELECT pg_indexes_size(%s::regclass) AS size", (FLAT_TABLE,)).fetchone()["size"]
+
+
+def megabytes(size: int) -> str:
+    return f"{size / 1024 / 1024:.1f} MB"
+
+
+def summary(timings: list[float]) -> str:
+    percentiles = statistics.quantiles(timings, n=100)
+    return f"mean {statistics.mean(timings):5.2f} ms p99 {percentiles[98]:6.2f} ms"
+
+
+def round_trip(month: date) -> list[str]:
+    name = f"message_{month:%Y_%m}"
+    with get_db_connection() as conn:
+        expected = conn.execute(f"SELECT count(*) AS n FROM {name}").fetchone()["n"]
+    with tempfile.TemporaryDirectory() as archive_dir:
+        start = time.perf_counter()
+        path = archive_message_partition(name, archive_dir)
+        archived_in = time.perf_counter() - start
+        size = os.path.getsize(path)
+        with get_db_connection() as conn:
+            gone = conn.execute("SELECT to_regclass(%s) IS NULL AS gone", (name,)).fetchone()["gone"]
+        start = time.perf_counter()
+        restored = restore_message_archive(path)
+        restored_in = time.perf_counter() - start
+    with get_db_connection() as conn:
+        count = conn.execute(f"SELECT count(*) AS n FROM {name}").fetchone()["n"]
+    print(f"archive {name}: {expected} turns -> {megabytes(size)} gzip in {archived_in:.2f} s,"
+          f" restored {restored} in {restored_in:.2f} s")
+    problems = []
+    if not gone:
+        problems.append(f"{name} still exists after archiving")
+    if restored != expected or count != expected:
+        problems.append(f"{name}: {expected} turns archived, {restored} restored, {count} in the table")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--months", type=int, default=12)
+    parser.add_argument("--rows-per-month", type=int, default=200_000)
+    parser.add_argument("--threads", type=int, default=20_000)
+    parser.add_argument("--inserts", type=int, default=1000, help="Timed single-turn inserts per table and month")
+    args = parser.parse_args()
+
+    migrate()
+    cleanup(args.months)
+    setup()
+    rng = random.Random(42)
+    try:
+        print(f"{'month':7} {'history':>9}  {'partition index':>15}  {'partitioned insert':28}"
+              f"  {'flat index':>10}  flat insert")
+        for index in range(args.months):
+            month = month_start(index)
+            load_month(month, args.rows_per_month, args.threads)
+            partitioned = time_inserts("message", month, args.inserts, args.threads, rng)
+            flat = time_inserts(FLAT_TABLE, month, args.inserts, args.threads, rng)
+            newest = next(p for p in list_message_partitions() if p["month"] == month)
+            print(f"{month:%Y-%m} {(index + 1) * args.rows_per_month:>9}"
+                  f"  {megabytes(newest['index_bytes']):>15}  {summary(partitioned):28}"
+                  f"  {megabytes(flat_index_bytes()):>10}  {summary(flat)}")
+        problems = round_trip(FIRST_MONTH)
+    finally:
+        cleanup(args.months)
+    if problems:
+        print("FAILED: " + "; ".join(problems))
+        sys.exit(1)
+    print("OK: archived month restored completely")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+Order history page latency at increasing depth: keyset cursor vs OFFSET.
+
+Generates --orders orders (default 10M) spread over --users wallets named
+bench-order-user-N, with one heavy user holding --heavy-share of them, then
+fetches a page of --page-size orders at several depths, both with
+list_orders (keyset on (created_at, id)) and with the LIMIT/OFFSET query it
+replaces, for the heavy user and for the all-orders listing. Generated orders
+and wallets are deleted afterwards unless --keep is given.
+
+    python benchmarks/bench_order_pages.py --orders 10000000
+    python benchmarks/bench_order_pages.py --no-generate   # reuse kept orders
+"""
+import sys, os
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+import argparse
+import statistics
+import time
+
+from app.db.connection import get_db_connection
+from app.db.migrations import migrate
+from app.db.order_service import list_orders
+
+USER_PREFIX = "bench-order-user-"
+HEAVY_USER = f"{USER_PREFIX}0"
+
+SELECT_OFFSET_PAGE = """
+    SELECT id, user_id, product_id, quantity, total_amount, status, created_at, updated_at
+    FROM "order"
+    {where}
+    ORDER BY created_at DESC, id DESC
+    LIMIT %(limit)s OFFSET %(offset)s
+"""
+
+
+def generate(orders: int, users: int, heavy_share: float):
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            product_id = cur.execute("SELECT min(id) AS id FROM product").fetchone()["id"]
+            if product_id is None:
+                raise SystemExit("No products in the database, run app/db/seed_data.py first")
+            cur.execute("""
+                INSERT INTO user_wallet (user_id, balance)
+                SELECT %s || i, 0 FROM generate_series(0, %s - 1) AS i
+                ON CONFLICT (user_id) DO NOTHING
+            """, (USER_PREFIX, users))
+            # Timestamps one second apart going back from now, in random order of insertion
+            cur.execute("""
+                INSERT INTO "order" (user_id, product_id, quantity, total_amount, status, created_at, updated_at)
+                SELECT
+                    CASE WHEN random() < %(heavy)s THEN %(prefix)s || '0'
+                         ELSE %(prefix)s || (1 + (i %% (%(users)s - 1))) END,
+                    %(product_id)s,
+                    1 + i %% 3,
+                    1000000 + (i %% 500) * 1000,
+                    'paid',
+                    ts, ts
+                FROM generate_series(1, %(orders)s) AS i,
+                     LATERAL (SELECT now()::timestamp - i * interval '1 second') AS t(ts)
+            """, {"heavy": heavy_share, "prefix": USER_PREFIX, "users": users, "product_id": product_id, "orders": orders})
+            cur.execute('ANALYZE "order"')
+        conn.commit()
+
+
+def delete_generated():
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute('DELETE FROM "order" WHERE user_id LIKE %s', (USER_PREFIX + "%",))
+            cur.execute("DELETE FROM user_wallet WHERE user_id LIKE %s", (USER_PREFIX + "%",))
+        conn.commit()
+
+
+def offset_page(user_id: str | None, offset: int, limit: int) -> list[dict]:
+    where = "WHERE user_id = %(user_id)s" if user_id else ""
+    with get_db_connection() as conn:
+        return conn.execute(
+            SELECT_OFFSET_PAGE.format(where=where),
+            {"user_id": user_id, "limit": limit, "offset": offset}
+        ).fetchall()
+
+
+def cursor_at(user_id: str | None, depth: int) -> tuple | None:
+    if depth == 0:
+        return None
+    row = offset_page(user_id, depth - 1, 1)
+    return (row[0]["created_at"], row[0]["id"]) if row else None
+
+
+def timed(fn, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def count_orders(user_id: str | None) -> int:
+    with get_db_connection() as conn:
+        if user_id:
+            return conn.execute('SELECT count(*) AS n FROM "order" WHERE user_id = %s', (user_id,)).fetchone()["n"]
+        return conn.execute('SELECT count(*) AS n FROM "order"').fetchone()["n"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--orders", type=int, default=10_000_000)
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--heavy-share", type=float, default=0.1, help="Share of orders that belong to one user")
+    parser.add_argument("--page-size", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--no-generate", dest="generate", action="store_false")
+    parser.add_argument("--keep", action="store_true", help="keep generated orders and wallets")
+    args = parser.parse_args()
+
+    migrate()
+    if args.generate:
+        print(f"Generating {args.orders} orders...")
+        start = time.perf_counter()
+        generate(args.orders, args.users, args.heavy_share)
+        print(f"  done in {time.perf_counter() - start:.0f}s")
+    try:
+        for label, user_id in (("heavy user", HEAVY_USER), ("all orders", None)):
+            total = count_orders(user_id)
+            print(f"{label}: {total} orders, page size {args.page_size}")
+            print(f"  {'depth':>10}  {'keyset ms':>10}  {'offset ms':>10}")
+            depth = 0
+            while depth < total:
+                after = cursor_at(user_id, depth)
+                keyset = timed(lambda: list_orders(user_id, after, args.page_size), args.repeat)
+                offset = timed(lambda: offset_page(user_id, depth, args.page_size), args.repeat)
+                print(f"  {depth:>10}  {keyset:>10.2f}  {offset:>10.2f}")
+                depth = depth * 10 if depth else 1000
+    finally:
+        if args.generate and not args.keep:
+            delete_generated()
+
+
+if __name__ == "__main__":
+    main()
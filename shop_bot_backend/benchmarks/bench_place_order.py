@@ -0,0 +1,120 @@
+"""
+Concurrent buyers racing for the last units of one product through place_order.
+
+Creates a product with --stock units (spread over --shards stock shards if
+given) and --buyers wallets, lets every buyer order one unit in parallel and
+checks that nothing was oversold: successful orders == min(stock, buyers),
+final stock == stock - successful orders and no wallet was debited without
+an order. Generated rows are deleted afterwards.
+
+    python benchmarks/bench_place_order.py --stock 50 --buyers 500 --concurrency 32
+    python benchmarks/bench_place_order.py --stock 50 --buyers 500 --shards 8
+"""
+import sys, os
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+import argparse
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from app.db.connection import get_db_connection
+from app.db.order_service import place_order
+from app.db.product_service import refresh_sharded_stock, shard_product_stock
+
+PRICE = Decimal("1000000")
+
+
+def setup(stock: int, buyers: int) -> int:
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                INSERT INTO product (name, description, price, stock, specifications)
+                VALUES ('Bench flash sale', 'Sản phẩm benchmark', %s, %s, '{"bench": true}')
+                RETURNING id
+                """,
+                (PRICE, stock),
+            )
+            product_id = cur.fetchone()["id"]
+            cur.execute(
+                """
+                INSERT INTO user_wallet (user_id, balance)
+                SELECT 'bench-buyer-' || i, %s FROM generate_series(1, %s) AS i
+                """,
+                (PRICE, buyers),
+            )
+        conn.commit()
+    return product_id
+
+
+def cleanup(product_id: int):
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute('DELETE FROM "order" WHERE product_id = %s', (product_id,))
+            cur.execute("DELETE FROM product WHERE id = %s", (product_id,))
+            cur.execute("DELETE FROM wallet_ledger WHERE user_id LIKE 'bench-buyer-%%'")
+            cur.execute("DELETE FROM user_wallet WHERE user_id LIKE 'bench-buyer-%%'")
+        conn.commit()
+
+
+def verify(product_id: int, stock: int, buyers: int, placed: int) -> list[str]:
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT stock FROM product WHERE id = %s", (product_id,))
+            final_stock = cur.fetchone()["stock"]
+            cur.execute('SELECT count(*) AS n FROM "order" WHERE product_id = %s', (product_id,))
+            orders = cur.fetchone()["n"]
+            cur.execute(
+                "SELECT count(*) AS n FROM user_wallet WHERE user_id LIKE 'bench-buyer-%%' AND current_wallet_balance(user_id) < %s",
+                (PRICE,),
+            )
+            debited = cur.fetchone()["n"]
+    problems = []
+    if placed != min(stock, buyers):
+        problems.append(f"expected {min(stock, buyers)} successful orders, got {placed}")
+    if final_stock != stock - placed or final_stock < 0:
+        problems.append(f"final stock {final_stock} != {stock} - {placed}")
+    if orders != placed:
+        problems.append(f"{orders} order rows for {placed} successful orders")
+    if debited != placed:
+        problems.append(f"{debited} wallets debited for {placed} successful orders")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--stock", type=int, default=50)
+    parser.add_argument("--buyers", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--shards", type=int, default=0, help="Stock shards of the product, 0 for none")
+    args = parser.parse_args()
+
+    product_id = setup(args.stock, args.buyers)
+    if args.shards:
+        shard_product_stock(product_id, args.shards)
+    try:
+        def buy(i: int) -> str:
+            return place_order(f"bench-buyer-{i}", product_id, 1, PRICE)["status"]
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            outcomes = Counter(executor.map(buy, range(1, args.buyers + 1)))
+        elapsed = time.perf_counter() - start
+        refresh_sharded_stock()
+
+        print(f"outcomes: {dict(outcomes)}")
+        print(f"throughput: {args.buyers / elapsed:.0f} orders/s")
+        problems = verify(product_id, args.stock, args.buyers, outcomes["ok"])
+        if problems:
+            print("FAILED: " + "; ".join(problems))
+            sys.exit(1)
+        print("OK: no overselling")
+    finally:
+        cleanup(product_id)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Fuzzy product search latency over a large generated catalog.
+
+Inserts --products generated rows (tagged with specifications.bench = true),
+runs search_products for a mix of partial, unaccented and misspelled queries
+and prints latency percentiles. Generated rows are deleted afterwards unless
+--keep is given.
+
+    python benchmarks/bench_product_search.py --products 100000 --queries 2000
+"""
+import sys, os
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+import argparse
+import random
+import statistics
+import time
+
+from app.db.connection import get_db_connection
+from app.db.migrations import migrate
+from app.db.product_service import search_products
+
+BRANDS = ["Samsung Galaxy", "iPhone", "Xiaomi", "OPPO Find", "Google Pixel", "Vivo", "Realme", "Nokia", "Điện thoại Vsmart", "Huawei Nova"]
+VARIANTS = ["", " Pro", " Pro Max", " Ultra", " Plus", " Lite", " Mini"]
+
+QUERIES = [
+    "samsung s24", "iphone 16 pro max", "xiaomi 14 pro", "pixel 8", "oppo find x7",
+    "dien thoai vsmart", "điện thoại", "huawei nova 12", "galaxy ultra", "realme 11 plus",
+]
+
+
+def generate_products(count: int):
+    brands = "ARRAY[" + ",".join(f"'{b}'" for b in BRANDS) + "]"
+    variants = "ARRAY[" + ",".join(f"'{v}'" for v in VARIANTS) + "]"
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(f"""
+                INSERT INTO product (name, description, price, stock, specifications)
+                SELECT
+                    ({brands})[1 + i %% {len(BRANDS)}]
+                        || ' ' || (i %% 97) || ({variants})[1 + i %% {len(VARIANTS)}]
+                        || ' ' || (64 * (1 + i %% 8)) || 'GB #' || i,
+                    'Sản phẩm benchmark',
+                    1000000 + (i %% 500) * 100000,
+                    i %% 100,
+                    '{{"bench": true}}'::jsonb
+                FROM generate_series(1, %s) AS i
+            """, (count,))
+            cur.execute("ANALYZE product")
+        conn.commit()
+
+
+def delete_products():
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM product WHERE specifications @> '{\"bench\": true}'")
+        conn.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--products", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--keep", action="store_true", help="keep generated products")
+    args = parser.parse_args()
+
+    migrate()
+    print(f"Generating {args.products} products...")
+    generate_products(args.products)
+    try:
+        for query in QUERIES:
+            search_products(query)
+
+        timings = []
+        for _ in range(args.queries):
+            query = random.choice(QUERIES)
+            start = time.perf_counter()
+            search_products(query)
+            timings.append((time.perf_counter() - start) * 1000)
+
+        timings.sort()
+        print(f"queries: {len(timings)}")
+        print(f"mean: {statistics.mean(timings):.2f} ms")
+        for pct in (50, 95, 99):
+            print(f"p{pct}: {timings[int(len(timings) * pct / 100) - 1]:.2f} ms")
+        print("sample:", [(row["name"], round(row["score"], 2)) for row in search_products("samsung s24")[:3]])
+    finally:
+        if not args.keep:
+            delete_products()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+CPU cost of the streaming path per answer.
+
+Streams --streams answers of --chunks small chunks through /api/chat/stream
+in-process, once with the previous implementation (json.dumps and one network
+write per model chunk) and once with the current one (orjson frames,
+coalescing window after the first frame). The agent is replaced by a
+synthetic generator emitting a chunk every --chunk-interval-ms, so only the
+route, encoding and ASGI overhead is measured.
+
+    python benchmarks/bench_stream.py --streams 200 --chunks 300 --concurrency 20
+"""
+import sys, os
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+import argparse
+import asyncio
+import json
+import time
+
+import httpx
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+
+from app.api.chatbot import routes
+
+CHUNK = "Dạ, "
+
+
+def make_answer_stream(chunks: int, interval: float):
+    async def answer_stream(question: str, thread_id: str, user_key: str | None = None, usage: dict | None = None):
+        for _ in range(chunks):
+            if interval:
+                await asyncio.sleep(interval)
+            yield CHUNK
+    return answer_stream
+
+
+def make_app(answer_stream) -> FastAPI:
+    app = FastAPI()
+
+    async def legacy_generator(question: str, thread_id: str):
+        # /api/chat/stream before coalescing and orjson
+        answer = ""
+        async for chunk in answer_stream(question, thread_id):
+            if chunk:
+                answer += chunk
+                yield f"{json.dumps({'content': chunk}, ensure_ascii=False)}\n"
+
+    @app.post("/legacy/chat/stream")
+    async def legacy_stream(request: routes.ChatRequest):
+        return StreamingResponse(legacy_generator(request.question, request.thread_id), media_type="text/event-stream")
+
+    routes.get_answer_stream = answer_stream
+    app.include_router(routes.router, prefix="/api")
+    return app
+
+
+async def measure(app: FastAPI, path: str, streams: int, concurrency: int) -> dict:
+    transport = httpx.ASGITransport(app=app)
+    semaphore = asyncio.Semaphore(concurrency)
+    received = {"bytes": 0, "frames": 0}
+
+    async def one(index: int):
+        async with semaphore:
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+                async with client.stream("POST", path, json={"question": "q", "thread_id": f"t{index}"}) as response:
+                    async for raw in response.aiter_raw():
+                        received["bytes"] += len(raw)
+                        received["frames"] += raw.count(b"\n\n") or raw.count(b"\n")
+
+    cpu, wall = time.process_time(), time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(streams)))
+    cpu, wall = time.process_time() - cpu, time.perf_counter() - wall
+    return {
+        "cpu_ms_per_answer": cpu * 1000 / streams,
+        "wall_s": wall,
+        "frames_per_answer": received["frames"] / streams,
+        "bytes_per_answer": received["bytes"] / streams,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--streams", type=int, default=200)
+    parser.add_argument("--chunks", type=int, default=300)
+    parser.add_argument("--chunk-interval-ms", type=float, default=2)
+    parser.add_argument("--concurrency", type=int, default=20)
+    args = parser.parse_args()
+
+    app = make_app(make_answer_stream(args.chunks, args.chunk_interval_ms / 1000))
+    print(f"coalescing window {routes.STREAM_COALESCE_MS} ms / {routes.STREAM_COALESCE_BYTES} bytes")
+    for name, path in (("before", "/legacy/chat/stream"), ("after", "/api/chat/stream")):
+        asyncio.run(measure(app, path, args.concurrency, args.concurrency))  # warm-up
+        stats = asyncio.run(measure(app, path, args.streams, args.concurrency))
+        print(f"{name:>6}: {stats['cpu_ms_per_answer']:.2f} ms CPU/answer, "
+              f"{stats['frames_per_answer']:.1f} frames/answer, {stats['bytes_per_answer']:.0f} bytes/answer, "
+              f"wall {stats['wall_s']:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Cancellation of streamed answers when the client disconnects.
+
+Serves the app in-process with the scripted model streaming slowly, opens
+--streams streams, reads the first data frame of each and then drops the
+connection. For every stream it measures how long the server keeps working
+after the disconnect (until chat_streams_active drops and the model stops
+being called), and checks that the database pools are idle again and that
+the partial answer was saved as interrupted.
+
+    python benchmarks/bench_stream_cancel.py --streams 20 --token-delay 0.05
+"""
+import sys, os
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+import argparse
+import asyncio
+import time
+import uuid
+
+import httpx
+
+from app.api.chatbot.routes import active_streams, stream_cancel_seconds, STREAM_DISCONNECT_POLL_SECONDS
+from app.core_ai.ai_service import INTERRUPTED_ANSWER_NOTE
+from app.db.chat_history_service import aget_recent_chat_history
+from app.db.connection import get_db_pool_stats
+from benchmarks.run import load_product_names, start_local_server
+
+
+async def wait_for(predicate, timeout: float) -> float | None:
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        if predicate():
+            return time.perf_counter() - start
+        await asyncio.sleep(0.01)
+    return None
+
+
+async def disconnect_one(base_url: str, name: str, model, timeout: float) -> dict:
+    thread_id = f"bench-cancel-{uuid.uuid4()}"
+    async with httpx.AsyncClient(base_url=base_url, timeout=30) as client:
+        async with client.stream("POST", "/api/chat/stream", json={"question": f"giá {name} bao nhiêu?", "thread_id": thread_id}) as response:
+            async for line in response.aiter_lines():
+                if line.startswith("data:"):
+                    break
+    # Connection closed here
+    calls = model.calls
+    freed = await wait_for(lambda: active_streams.value() == 0, timeout)
+    await asyncio.sleep(0.2)
+    history = await aget_recent_chat_history(thread_id)
+    return {
+        "freed_s": freed,
+        "model_stopped": model.calls == calls,
+        "saved_interrupted": bool(history) and history[0]["answer"].endswith(INTERRUPTED_ANSWER_NOTE),
+    }
+
+
+async def main_async(args):
+    names = load_product_names()
+    if not names:
+        raise SystemExit("No products in the database, seed it with app/db/seed_data.py")
+    server, task, base_url, model = await start_local_server(names, args)
+    bound = STREAM_DISCONNECT_POLL_SECONDS + args.slack
+    try:
+        results = [await disconnect_one(base_url, names[i % len(names)], model, args.timeout) for i in range(args.streams)]
+        freed = [r["freed_s"] for r in results if r["freed_s"] is not None]
+        pools = get_db_pool_stats()
+    finally:
+        server.should_exit = True
+        await task
+
+    print(f"streams: {len(results)}, freed: {len(freed)}, poll interval {STREAM_DISCONNECT_POLL_SECONDS}s")
+    if freed:
+        freed.sort()
+        print(f"time to free after disconnect: p50={freed[len(freed) // 2] * 1000:.0f} ms max={freed[-1] * 1000:.0f} ms (bound {bound * 1000:.0f} ms)")
+    snap = stream_cancel_seconds.snapshot()
+    print(f"producer cancel time: n={snap['count']} mean={snap['mean'] * 1000:.1f} ms")
+    print(f"model stopped after disconnect: {sum(r['model_stopped'] for r in results)}/{len(results)}")
+    print(f"partial answer saved as interrupted: {sum(r['saved_interrupted'] for r in results)}/{len(results)}")
+    for name, stats in pools.items():
+        print(f"pool {name}: size={stats['pool_size']} available={stats['pool_available']}")
+    ok = len(freed) == len(results) and all(f <= bound for f in freed) and all(r["model_stopped"] for r in results)
+    print("PASS" if ok else "FAIL")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--streams", type=int, default=20)
+    parser.add_argument("--delay", type=float, default=0.05)
+    parser.add_argument("--token-delay", type=float, default=0.05)
+    parser.add_argument("--timeout", type=float, default=10, help="Give up waiting for a stream to be freed after this many seconds")
+    parser.add_argument("--slack", type=float, default=0.5, help="Allowed time on top of the disconnect poll interval")
+    args = parser.parse_args()
+    sys.exit(0 if asyncio.run(main_async(args)) else 1)
+
+
+if __name__ == "__main__":
+    main()
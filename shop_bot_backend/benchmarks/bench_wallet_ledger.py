@@ -0,0 +1,155 @@
+"""
+Hot wallet contention: single-row balance updates vs the append-only ledger.
+
+Creates --wallets wallets named bench-wallet-N with --balance each and runs
+--ops update_balance calls against them from --concurrency threads, a
+--credit-share of them credits (+1) and the rest debits (-1), once per
+WALLET_MODE. In ledger mode wallets are compacted every --compact-interval
+seconds while the load runs. Prints throughput and debit/credit latency, and
+checks that every final balance equals the starting balance plus the
+accepted changes and that no wallet went negative. Generated rows are
+deleted afterwards.
+
+Run with DB_POOL_MAX_SIZE at least --concurrency, otherwise the pool and not
+the wallet is the bottleneck.
+
+    DB_POOL_MAX_SIZE=64 python benchmarks/bench_wallet_ledger.py --wallets 1 --concurrency 64
+"""
+import sys, os
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+import argparse
+import random
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from app.db import wallet_service
+from app.db.connection import get_db_connection
+from app.db.migrations import migrate
+
+USER_PREFIX = "bench-wallet-"
+
+
+def setup(wallets: int, balance: Decimal):
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                INSERT INTO user_wallet (user_id, balance)
+                SELECT %s || i, %s FROM generate_series(0, %s - 1) AS i
+                """,
+                (USER_PREFIX, balance, wallets),
+            )
+        conn.commit()
+
+
+def cleanup():
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM wallet_ledger WHERE user_id LIKE %s", (USER_PREFIX + "%",))
+            cur.execute("DELETE FROM user_wallet WHERE user_id LIKE %s", (USER_PREFIX + "%",))
+        conn.commit()
+
+
+def percentile(timings: list[float], q: float) -> float:
+    if not timings:
+        return 0.0
+    return statistics.quantiles(timings, n=100)[q - 1] if len(timings) > 1 else timings[0]
+
+
+def run(mode: str, args) -> list[str]:
+    wallet_service.WALLET_LEDGER_ENABLED = mode == "ledger"
+    setup(args.wallets, Decimal(args.balance))
+    rng = random.Random(42)
+    ops = [
+        (f"{USER_PREFIX}{rng.randrange(args.wallets)}", 1 if rng.random() < args.credit_share else -1)
+        for _ in range(args.ops)
+    ]
+    accepted = {f"{USER_PREFIX}{i}": 0 for i in range(args.wallets)}
+    timings = {1: [], -1: []}
+    refused = 0
+    lock = threading.Lock()
+
+    def apply(op: tuple[str, int]):
+        nonlocal refused
+        user_id, amount = op
+        start = time.perf_counter()
+        result = wallet_service.update_balance(user_id, Decimal(amount), reason="bench")
+        elapsed = (time.perf_counter() - start) * 1000
+        with lock:
+            timings[amount].append(elapsed)
+            if result is None:
+                refused += 1
+            else:
+                accepted[user_id] += amount
+
+    stop = threading.Event()
+    folded = 0
+
+    def compact():
+        nonlocal folded
+        since = 0
+        while not stop.wait(args.compact_interval):
+            count, since = wallet_service.compact_wallets(since)
+            folded += count
+
+    compactor = threading.Thread(target=compact, daemon=True)
+    if mode == "ledger":
+        compactor.start()
+    try:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            list(executor.map(apply, ops))
+        elapsed = time.perf_counter() - start
+        stop.set()
+        if compactor.is_alive():
+            compactor.join()
+
+        print(f"{mode:7} {args.ops / elapsed:8.0f} ops/s"
+              f"  debit p50 {percentile(timings[-1], 50):6.2f} ms p99 {percentile(timings[-1], 99):6.2f} ms"
+              f"  credit p50 {percentile(timings[1], 50):6.2f} ms p99 {percentile(timings[1], 99):6.2f} ms"
+              f"  refused {refused}" + (f"  compacted {folded}" if mode == "ledger" else ""))
+
+        problems = []
+        for user_id, change in accepted.items():
+            balance = wallet_service.get_wallet(user_id)["balance"]
+            if balance != Decimal(args.balance) + change:
+                problems.append(f"{user_id}: balance {balance} != {args.balance} + {change}")
+            if balance < 0:
+                problems.append(f"{user_id}: negative balance {balance}")
+        return problems
+    finally:
+        stop.set()
+        cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ops", type=int, default=20_000)
+    parser.add_argument("--wallets", type=int, default=1)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--balance", type=int, default=100, help="Starting balance of each wallet")
+    parser.add_argument("--credit-share", type=float, default=0.45)
+    parser.add_argument("--compact-interval", type=float, default=0.5)
+    parser.add_argument("--modes", default="row,ledger")
+    args = parser.parse_args()
+
+    migrate()
+    cleanup()
+    failed = False
+    for mode in args.modes.split(","):
+        problems = run(mode, args)
+        if problems:
+            failed = True
+            print("FAILED: " + "; ".join(problems[:10]))
+    if failed:
+        sys.exit(1)
+    print("OK: balances match the accepted changes, none negative")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+Compare result files written by benchmarks/run.py.
+
+The first file is the baseline; every other file is shown with its change
+relative to it.
+
+    python benchmarks/compare.py benchmarks/results/baseline-*.json benchmarks/results/pool-*.json
+"""
+import argparse
+import json
+
+METRICS = [
+    ("req/s", lambda s: s["req_per_s"]),
+    ("p50 ms", lambda s: s["latency_ms"]["p50"]),
+    ("p95 ms", lambda s: s["latency_ms"]["p95"]),
+    ("p99 ms", lambda s: s["latency_ms"]["p99"]),
+    ("ttft p50 ms", lambda s: s["ttft_ms"]["p50"]),
+    ("ttft p95 ms", lambda s: s["ttft_ms"]["p95"]),
+    ("db queries/turn", lambda s: s.get("db_queries_per_turn")),
+    ("model calls/turn", lambda s: s.get("model_calls_per_turn")),
+    ("errors", lambda s: s["errors"]),
+]
+
+
+def load(path: str) -> dict:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def cell(value, base) -> str:
+    if value is None:
+        return "-"
+    text = f"{value:.2f}" if isinstance(value, float) else str(value)
+    if base not in (None, 0) and value != base:
+        text += f" ({(value - base) / base * 100:+.1f}%)"
+    return text
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="+")
+    args = parser.parse_args()
+
+    reports = [load(path) for path in args.files]
+    endpoints = [e for e in ("chat", "stream") if any(e in r["results"] for r in reports)]
+    labels = [r["label"] for r in reports]
+    width = max(18, *(len(label) + 14 for label in labels))
+
+    for endpoint in endpoints:
+        print(f"\n/api/chat{'/stream' if endpoint == 'stream' else ''}")
+        print(f"{'':<18}" + "".join(f"{label:>{width}}" for label in labels))
+        base = reports[0]["results"].get(endpoint)
+        for name, get in METRICS:
+            row = f"{name:<18}"
+            for report in reports:
+                stats = report["results"].get(endpoint)
+                value = get(stats) if stats else None
+                row += f"{cell(value, get(base) if base and report is not reports[0] else None):>{width}}"
+            print(row)
+
+
+if __name__ == "__main__":
+    main()
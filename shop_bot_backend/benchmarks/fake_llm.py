@@ -0,0 +1,145 @@
+"""
+Scripted chat model for offline benchmarks.
+
+Plays the agent's part of a conversation without a model API: for a question
+naming a known product it calls product_search, for a purchase it follows up
+with create_order using the id and price from the search result, and then
+writes a short Vietnamese answer. Latency is simulated with a fixed delay
+before the first token and an optional delay between streamed chunks; a
+share of the calls can stall for stall_delay instead, or fail with a
+retryable FakeServiceUnavailable, to exercise timeouts and retries.
+
+    from benchmarks.fake_llm import ScriptedChatModel
+    ai_service.set_chat_model_factory(lambda name: ScriptedChatModel(products=names, delay=0.3))
+"""
+import asyncio
+import json
+import random
+import re
+import time
+import uuid
+from typing import Any, AsyncIterator, Iterator
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, HumanMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import Field, PrivateAttr
+
+ORDER_WORDS = re.compile(r"\b(mua|đặt)\b", re.IGNORECASE)
+TOOL_ID = re.compile(r"""['"]id['"]:\s*(\d+)""")
+TOOL_PRICE = re.compile(r"""['"]price['"]:\s*(?:Decimal\()?['"]?([\d.]+)""")
+
+
+class FakeServiceUnavailable(Exception):
+    """Transient model API error; code is the HTTP status, as on google.api_core errors"""
+    code = 503
+
+
+class ScriptedChatModel(BaseChatModel):
+    products: list[str] = Field(default_factory=list)
+    user_id: str = "user1"
+    delay: float = 0.0
+    token_delay: float = 0.0
+    chunk_words: int = 4
+    stall_share: float = 0.0
+    stall_delay: float = 0.0
+    error_share: float = 0.0
+    seed: int | None = None
+
+    _call_count: int = PrivateAttr(default=0)
+    _rng: random.Random = PrivateAttr(default_factory=random.Random)
+
+    def model_post_init(self, __context: Any):
+        self._rng = random.Random(self.seed)
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted-fake"
+
+    @property
+    def calls(self) -> int:
+        """Number of model calls made so far"""
+        return self._call_count
+
+    def bind_tools(self, tools: list, **kwargs: Any) -> "ScriptedChatModel":
+        return self
+
+    def _first_token_delay(self) -> float:
+        roll = self._rng.random()
+        if roll < self.error_share:
+            raise FakeServiceUnavailable("scripted model unavailable")
+        return self.stall_delay if roll < self.error_share + self.stall_share else self.delay
+
+    def _find_product(self, question: str) -> str | None:
+        lowered = question.lower()
+        matches = [name for name in self.products if name.lower() in lowered]
+        return max(matches, key=len) if matches else None
+
+    def _respond(self, messages: list[BaseMessage]) -> AIMessage:
+        self._call_count += 1
+        last_human = max(
+            (index for index, message in enumerate(messages) if isinstance(message, HumanMessage)),
+            default=-1,
+        )
+        question = messages[last_human].content if last_human >= 0 else ""
+        results = [m.content for m in messages[last_human + 1:] if isinstance(m, ToolMessage)]
+        product = self._find_product(question)
+
+        if product is None:
+            return AIMessage(content="Xin chào! Mình là trợ lý bán hàng, bạn cần tìm sản phẩm nào ạ?")
+        if not results:
+            return self._tool_call("product_search", {"product_name": product})
+        if len(results) == 1 and ORDER_WORDS.search(question):
+            product_id, price = TOOL_ID.search(results[0]), TOOL_PRICE.search(results[0])
+            if product_id and price:
+                return self._tool_call("create_order", {
+                    "user_id": self.user_id,
+                    "product_id": int(product_id.group(1)),
+                    "quantity": 1,
+                    "total_amount": float(price.group(1)),
+                })
+        return AIMessage(content=(
+            f"Dạ, đây là thông tin về {product} mà mình tìm được: {results[-1][:300]} "
+            "Bạn cần mình hỗ trợ thêm gì không ạ?"
+        ))
+
+    def _tool_call(self, name: str, args: dict) -> AIMessage:
+        return AIMessage(content="", tool_calls=[{"name": name, "args": args, "id": f"call_{uuid.uuid4().hex[:12]}"}])
+
+    def _chunks(self, message: AIMessage) -> Iterator[AIMessageChunk]:
+        if message.tool_calls:
+            call = message.tool_calls[0]
+            yield AIMessageChunk(content="", tool_call_chunks=[{
+                "name": call["name"], "args": json.dumps(call["args"]), "id": call["id"], "index": 0,
+            }])
+            return
+        words = message.content.split(" ")
+        for start in range(0, len(words), self.chunk_words):
+            text = " ".join(words[start:start + self.chunk_words])
+            yield AIMessageChunk(content=text if start == 0 else " " + text)
+
+    def _generate(self, messages: list[BaseMessage], stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        time.sleep(self._first_token_delay())
+        return ChatResult(generations=[ChatGeneration(message=self._respond(messages))])
+
+    async def _agenerate(self, messages: list[BaseMessage], stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        await asyncio.sleep(self._first_token_delay())
+        return ChatResult(generations=[ChatGeneration(message=self._respond(messages))])
+
+    def _stream(self, messages: list[BaseMessage], stop=None, run_manager=None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        time.sleep(self._first_token_delay())
+        for index, chunk in enumerate(self._chunks(self._respond(messages))):
+            if index and self.token_delay:
+                time.sleep(self.token_delay)
+            if run_manager and chunk.content:
+                run_manager.on_llm_new_token(chunk.content, chunk=ChatGenerationChunk(message=chunk))
+            yield ChatGenerationChunk(message=chunk)
+
+    async def _astream(self, messages: list[BaseMessage], stop=None, run_manager=None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        await asyncio.sleep(self._first_token_delay())
+        for index, chunk in enumerate(self._chunks(self._respond(messages))):
+            if index and self.token_delay:
+                await asyncio.sleep(self.token_delay)
+            if run_manager and chunk.content:
+                await run_manager.on_llm_new_token(chunk.content, chunk=ChatGenerationChunk(message=chunk))
+            yield ChatGenerationChunk(message=chunk)
@@ -0,0 +1,246 @@
+"""
+End-to-end load benchmark for /api/chat and /api/chat/stream.
+
+Seeds a local Postgres with a catalog of --products items (the DB_* variables
+must point at a throwaway database, orders and wallets are modified), swaps
+Gemini for the scripted model in benchmarks/fake_llm.py and serves the app
+in-process with uvicorn. Virtual users then send --requests questions at
+--concurrency and the run reports req/s, p50/p95/p99 latency, time to first
+token and database queries / model calls per turn, and writes everything to
+a JSON file for benchmarks/compare.py.
+
+    python benchmarks/run.py --requests 500 --concurrency 20 --delay 0.3 --label baseline
+    python benchmarks/run.py --endpoint stream --token-delay 0.02 --label stream
+
+With --url the running server at that address is measured instead (start it
+with benchmarks/serve.py to keep the fake model); database query counts are
+then not available.
+"""
+import sys, os
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+import argparse
+import asyncio
+import json
+import random
+import socket
+import time
+import uuid
+from datetime import datetime, timezone
+
+import httpx
+
+from app.db.connection import get_db_connection, db_queries
+from app.db.seed_data import init_and_seed_database
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+QUESTIONS = [
+    "giá {name} bao nhiêu?",
+    "còn hàng {name} không?",
+    "cho mình xem cấu hình {name}",
+    "{name} có gì nổi bật?",
+]
+ORDER_QUESTION = "tôi muốn mua 1 cái {name}"
+GREETING = "xin chào shop"
+
+
+def load_product_names(limit: int | None = None) -> list[str]:
+    # Seeding upserts by name, so the first products are the ones just seeded
+    with get_db_connection() as conn:
+        return [row["name"] for row in conn.execute("SELECT name FROM product ORDER BY id LIMIT %s", (limit,)).fetchall()]
+
+
+def make_questions(names: list[str], requests: int, order_ratio: float, rng: random.Random) -> list[str]:
+    questions = []
+    for _ in range(requests):
+        roll = rng.random()
+        if roll < 0.05:
+            questions.append(GREETING)
+        elif roll < 0.05 + order_ratio:
+            questions.append(ORDER_QUESTION.format(name=rng.choice(names)))
+        else:
+            questions.append(rng.choice(QUESTIONS).format(name=rng.choice(names)))
+    return questions
+
+
+async def send_chat(client: httpx.AsyncClient, question: str, thread_id: str) -> dict:
+    start = time.perf_counter()
+    response = await client.post("/api/chat", json={"question": question, "thread_id": thread_id})
+    latency = time.perf_counter() - start
+    ok = response.status_code == 200 and "answer" in response.json()
+    return {"latency": latency, "ttft": latency, "ok": ok}
+
+
+async def send_stream(client: httpx.AsyncClient, question: str, thread_id: str) -> dict:
+    start = time.perf_counter()
+    ttft, ok = None, True
+    async with client.stream("POST", "/api/chat/stream", json={"question": question, "thread_id": thread_id}) as response:
+        ok = response.status_code == 200
+        async for line in response.aiter_lines():
+            if line.startswith("data:") and ttft is None:
+                ttft = time.perf_counter() - start
+            elif line == "event: error":
+                ok = False
+    latency = time.perf_counter() - start
+    return {"latency": latency, "ttft": ttft if ttft is not None else latency, "ok": ok and ttft is not None}
+
+
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(samples: list[dict], elapsed: float) -> dict:
+    ok = [s for s in samples if s["ok"]]
+    latencies = [s["latency"] for s in ok]
+    ttfts = [s["ttft"] for s in ok]
+    return {
+        "requests": len(samples),
+        "errors": len(samples) - len(ok),
+        "elapsed_s": elapsed,
+        "req_per_s": len(ok) / elapsed if elapsed else 0.0,
+        "latency_ms": {name: percentile(latencies, q) * 1000 for name, q in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99))},
+        "latency_mean_ms": sum(latencies) / len(latencies) * 1000 if latencies else 0.0,
+        "ttft_ms": {name: percentile(ttfts, q) * 1000 for name, q in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99))},
+    }
+
+
+async def drive(client: httpx.AsyncClient, endpoint: str, questions: list[str], concurrency: int, turns_per_thread: int) -> tuple[list[dict], float]:
+    send = send_stream if endpoint == "stream" else send_chat
+    pending = iter(enumerate(questions))
+    samples: list[dict] = []
+
+    async def user():
+        thread_id, turns = None, 0
+        for _, question in pending:
+            if thread_id is None or turns >= turns_per_thread:
+                thread_id, turns = f"bench-{uuid.uuid4()}", 0
+            try:
+                samples.append(await send(client, question, thread_id))
+            except httpx.HTTPError:
+                samples.append({"latency": 0.0, "ttft": 0.0, "ok": False})
+            turns += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(user() for _ in range(concurrency)))
+    return samples, time.perf_counter() - start
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def start_local_server(names: list[str], args) -> tuple[object, asyncio.Task, str, object]:
+    import uvicorn
+    from app.core_ai import ai_service
+    from benchmarks.fake_llm import ScriptedChatModel
+
+    model = ScriptedChatModel(products=names, delay=args.delay, token_delay=args.token_delay)
+    ai_service.set_chat_model_factory(lambda model_name: model)
+    from main import app
+
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        if task.done():
+            task.result()
+        await asyncio.sleep(0.05)
+    return server, task, f"http://127.0.0.1:{port}", model
+
+
+async def run(args) -> dict:
+    if args.seed:
+        init_and_seed_database(args.products, args.users)
+    names = load_product_names(args.products)
+    if not names:
+        raise SystemExit("No products in the database, run without --no-seed")
+    rng = random.Random(args.random_seed)
+
+    server, task, model = None, None, None
+    base_url = args.url
+    if base_url is None:
+        server, task, base_url, model = await start_local_server(names, args)
+
+    results = {}
+    try:
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+            for endpoint in args.endpoint:
+                questions = make_questions(names, args.requests, args.order_ratio, rng)
+                # Warm-up turns are not measured
+                await drive(client, endpoint, questions[:args.concurrency], args.concurrency, args.turns_per_thread)
+                queries_before = db_queries.value()
+                calls_before = model.calls if model else 0
+                samples, elapsed = await drive(client, endpoint, questions, args.concurrency, args.turns_per_thread)
+                stats = summarize(samples, elapsed)
+                turns = max(1, stats["requests"] - stats["errors"])
+                if server is not None:
+                    # Let write-behind flushes of this run land in its own count
+                    await asyncio.sleep(0.5)
+                    stats["db_queries_per_turn"] = (db_queries.value() - queries_before) / turns
+                    stats["model_calls_per_turn"] = (model.calls - calls_before) / turns
+                results[endpoint] = stats
+    finally:
+        if server is not None:
+            server.should_exit = True
+            await task
+
+    return {
+        "label": args.label,
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "config": {key: value for key, value in vars(args).items() if key != "out"},
+        "results": results,
+    }
+
+
+def print_report(report: dict):
+    for endpoint, stats in report["results"].items():
+        print(f"/api/chat{'/stream' if endpoint == 'stream' else ''}: "
+              f"{stats['requests']} requests, {stats['errors']} errors, {stats['req_per_s']:.1f} req/s")
+        print("  latency ms  " + "  ".join(f"{k}={v:.1f}" for k, v in stats["latency_ms"].items()))
+        print("  ttft ms     " + "  ".join(f"{k}={v:.1f}" for k, v in stats["ttft_ms"].items()))
+        if "db_queries_per_turn" in stats:
+            print(f"  db queries/turn={stats['db_queries_per_turn']:.2f}  model calls/turn={stats['model_calls_per_turn']:.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--endpoint", nargs="+", choices=("chat", "stream"), default=["chat", "stream"])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--turns-per-thread", type=int, default=3, help="Questions sent in one thread before starting a new one")
+    parser.add_argument("--order-ratio", type=float, default=0.0, help="Share of questions that place an order")
+    parser.add_argument("--delay", type=float, default=0.2, help="Fake model latency before the first token, seconds")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="Fake model delay between streamed chunks, seconds")
+    parser.add_argument("--products", type=int, default=100)
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--no-seed", dest="seed", action="store_false", help="Reuse the data already in the database")
+    parser.add_argument("--url", help="Measure a running server instead of an in-process one")
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--random-seed", type=int, default=42)
+    parser.add_argument("--label", default="run")
+    parser.add_argument("--out", help="Result file, default benchmarks/results/<label>-<timestamp>.json")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    print_report(report)
+
+    out = args.out or os.path.join(
+        RESULTS_DIR, f"{args.label}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"saved {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+"""
+Serve the app with the scripted fake model instead of Gemini, for load tests
+driven from another process or machine (benchmarks/run.py --url ...).
+
+    python benchmarks/serve.py --port 8030 --delay 0.3
+"""
+import sys, os
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+import argparse
+
+import uvicorn
+
+from app.core_ai import ai_service
+from app.db.connection import get_db_connection
+from benchmarks.fake_llm import ScriptedChatModel
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8030)
+    parser.add_argument("--delay", type=float, default=0.2)
+    parser.add_argument("--token-delay", type=float, default=0.0)
+    args = parser.parse_args()
+
+    with get_db_connection() as conn:
+        names = [row["name"] for row in conn.execute("SELECT name FROM product").fetchall()]
+    model = ScriptedChatModel(products=names, delay=args.delay, token_delay=args.token_delay)
+    ai_service.set_chat_model_factory(lambda model_name: model)
+
+    from main import app
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
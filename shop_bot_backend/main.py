@@ -1,21 +1,46 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from app.api.chatbot.routes import router as chat_router
-from app.db.chat_history_service import init_chat_history_table
-from app.db.product_service import init_product_table
-from app.db.order_service import init_order_table
-from app.db.wallet_service import init_wallet_table
+from app.api.metrics.routes import router as metrics_router
+from app.api.orders.routes import router as orders_router
+from app.api.wallets.routes import router as wallets_router
+from app.core_ai.ai_service import warm_up_agent
+from app.core_ai.thread_locks import thread_locks
+from app.db.connection import init_db_pool, close_db_pool, init_async_db_pool, close_async_db_pool
+from app.db.chat_history_writer import start_chat_history_writer, stop_chat_history_writer
+from app.db.message_partitions import start_message_maintenance, stop_message_maintenance
+from app.db.migrations import check_schema_version
+from app.db.order_service import start_reservation_sweeper, stop_reservation_sweeper
+from app.db.product_service import start_catalog_listener, stop_catalog_listener
+from app.db.wallet_service import start_wallet_compactor, stop_wallet_compactor
 
 app = FastAPI()
 
-# Initialize database tables
+# Check the database schema and start background workers
 @app.on_event("startup")
 async def startup_event():
-    """Initialize all database tables on startup"""
-    init_product_table()
-    init_order_table()
-    init_wallet_table()
-    init_chat_history_table()
+    """Open the shared database pools, check the schema version and build the agent on startup"""
+    init_db_pool()
+    await init_async_db_pool()
+    check_schema_version()
+    start_catalog_listener()
+    start_chat_history_writer()
+    start_message_maintenance()
+    start_wallet_compactor()
+    start_reservation_sweeper()
+    await warm_up_agent()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Flush queued chat history and close the shared database pools on shutdown"""
+    stop_chat_history_writer()
+    stop_catalog_listener()
+    stop_message_maintenance()
+    stop_wallet_compactor()
+    stop_reservation_sweeper()
+    await thread_locks.close()
+    await close_async_db_pool()
+    close_db_pool()
 
 app.add_middleware(
     CORSMiddleware,
@@ -25,4 +50,7 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-app.include_router(chat_router, prefix="/api")
\ No newline at end of file
+app.include_router(chat_router, prefix="/api")
+app.include_router(orders_router, prefix="/api")
+app.include_router(wallets_router, prefix="/api")
+app.include_router(metrics_router)
\ No newline at end of file